@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import argparse
 import random
@@ -9,6 +8,9 @@ import sys
 from time import time
 from datetime import datetime
 
+from memprof import MemoryProfiler
+from profiler import NULL_PROFILER
+
 # constants
 #ARMS = 10
 RUNS = 1
@@ -18,9 +20,12 @@ CHOOSE_IMPLEMENTATION = "one_agent"
 #TRAINING_STEPS = 10
 #TESTING_STEPS = 5
 seed_count = 16
+SAVED_MODELS_FOLDER = './data/'
 
 
 NOW = "{0:%Y-%m-%dT%H-%M-%S}".format(datetime.now())
+# memory of the runs, see --memprof
+profiler = NULL_PROFILER
 
 # #############################################################################
 #
@@ -41,6 +46,14 @@ def get_arguments():
     parser.add_argument('-choose_implementation', '--choose_implementation', type=str, default=CHOOSE_IMPLEMENTATION,
                         help='choose if you do 1 run, 50 runs, or variance for 50 runs'
                         'Default: ' + CHOOSE_IMPLEMENTATION)
+    parser.add_argument('--no_plot', action='store_true',
+                        help='If this flag is set, the average final weights '
+                        'are printed instead of plotted, and matplotlib is '
+                        'not imported.')
+    parser.add_argument('--memprof', action='store_true',
+                        help='If this flag is set, the memory allocated by '
+                        'the agent and by every run is reported, and saved in '
+                        'the {} folder.'.format(SAVED_MODELS_FOLDER))
 
     return parser.parse_args()
 
@@ -56,6 +69,8 @@ def plot_all_variances(data):
 
     data: data of shape(nb_runs, steps, 8)'''
 
+    import matplotlib.pyplot as plt
+
     fig, axs = plt.subplots(nrows=3, ncols=3,
                             sharey=True,
                             figsize=(12,15))
@@ -103,7 +118,17 @@ def plot_line_variance(axs, id_ax, data_one_var, label, color, axis=0, delta=1):
     #plt.show()
 
 
+def print_final_w(ws):
+    '''Prints the weights at the last step, averaged over the runs.'''
+
+    aver_ws = np.mean(ws[:, -1], axis=0)
+    print('Final weights: ' + '  '.join(
+        'w{}={:.4g}'.format(pos_w + 1, w) for pos_w, w in enumerate(aver_ws)))
+
+
 def plot_coefficients_w(ws):
+    import matplotlib.pyplot as plt
+
     aver_ws = np.mean(ws, axis = 0)
     x_range = list(range(aver_ws.shape[0]))
     for pos_w in range(aver_ws.shape[1]):
@@ -150,6 +175,7 @@ def random_argmax(vector):
 
 class TD_Zero_Agent_Baird_Counterexample():
     def __init__(self,args, nb_runs, gamma = 0.99):
+        t = profiler.now()
         self.args = args
         self.alpha = self.args.alpha
         self.gamma = gamma
@@ -173,6 +199,7 @@ class TD_Zero_Agent_Baird_Counterexample():
         self.features[6, 6] = 1
         self.features[6, 7] = 2
         self.current_state = None
+        profiler.lap('init', t)
 
     def train_all_runs(self):
         for run_id in range(0, self.nb_runs):
@@ -180,7 +207,12 @@ class TD_Zero_Agent_Baird_Counterexample():
             np.random.seed(seed_count)
             seed_count += 1
             self.current_state = np.random.choice(7)
+            t = profiler.now()
             self.semi_gradient_one_run(run_id)
+            profiler.lap('semi_gradient', t)
+            profiler.count('steps', self.args.steps)
+            # a run of Baird's counterexample is one episode of the profile
+            profiler.end_episode()
 
     def semi_gradient_one_run(self, run_id):
         for step in range(1,self.args.steps+1):
@@ -210,7 +242,10 @@ def train_one_agent(args):
     agent.train_all_runs()
     #print(np.mean(agent.ws[0:,-1], axis = 0))
     #print(agent.ws[0:, -1])
-    plot_coefficients_w(agent.ws)
+    if args.no_plot:
+        print_final_w(agent.ws)
+    else:
+        plot_coefficients_w(agent.ws)
     """
     In the previous plot, you can observe the curves for all the parameters $w_1$, $w_2$, $w_3$, $w_4$, $w_5$,
     $w_6$, \$w_7$, $w_8$. The parameters grow very similarly to Figure 11.2 of the RL book of Sutton and Barto. 
@@ -223,7 +258,10 @@ def train_one_agent(args):
 def train_agents_50(args):
     agents_50 = TD_Zero_Agent_Baird_Counterexample(args, nb_runs=50)
     agents_50.train_all_runs()
-    plot_coefficients_w(agents_50.ws)
+    if args.no_plot:
+        print_final_w(agents_50.ws)
+    else:
+        plot_coefficients_w(agents_50.ws)
 
     """
     In the previous plot, we did the same experiment as in the first plot but we averaged 50 runs instead of a single run. 
@@ -235,7 +273,10 @@ def train_agents_50(args):
 def agents_50_variance(args):
     agents_50 = TD_Zero_Agent_Baird_Counterexample(args, nb_runs=50)
     agents_50.train_all_runs()
-    plot_all_variances(agents_50.ws)
+    if args.no_plot:
+        print_final_w(agents_50.ws)
+    else:
+        plot_all_variances(agents_50.ws)
 
     """
     Just as the previous comments, we were not sure if we had to run the algorithm for multiple runs. We did it 
@@ -245,7 +286,11 @@ def agents_50_variance(args):
     """
 
 def main():
+    global profiler
+
     args = get_arguments()
+    if args.memprof:
+        profiler = MemoryProfiler()
     #print(args.choose_implementation)
     assert args.choose_implementation in ["one_agent", "agents_50", "agents_50_variance"]
     if args.choose_implementation =="one_agent":
@@ -254,6 +299,9 @@ def main():
         train_agents_50(args)
     elif args.choose_implementation == "agents_50_variance":
         agents_50_variance(args)
+    if args.memprof:
+        profiler.end_run('baird_' + args.choose_implementation)
+        profiler.export(os.path.join(SAVED_MODELS_FOLDER, NOW + '_'))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,22 +1,31 @@
 import os
 import sys
-import gym
-import pickle
+import time
 import argparse
+import contextlib
+import multiprocessing
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 
-import torch
-import torch.nn as nn
-import torch.optim as optim
-import torch.nn.functional as F
-
-from torch.distributions import Categorical
-
-from tqdm import tqdm
 from datetime import datetime
 
+# torch, gym and matplotlib take seconds to import, so they are imported by
+# the functions that need them: --help, --invalidate_cache and --load (until
+# the plot) start without them. The model lives in policy.py for that reason.
+
+from checkpoint import SweepCheckpoint, load_run_state, save_run_state
+from compile_utils import COMPILE_MODES
+from metrics import CONSOLE_INTERVAL, MetricsRecorder, metrics_path
+from memprof import MemoryProfiler
+from profiler import NULL_PROFILER, Profiler
+from result_cache import ResultCache, source_version
+from scheduler import ETA, SuccessiveHalving
+from shared_results import SharedResults, publish
+from threads import THREADS, TUNING_STEPS, thread_count
+from tile_coding import TRACE_DECAY
+from results_index import index_results
+from results_store import (STORE_SUFFIX, ResultsStore, compact_dtype,
+                           open_results)
+
 SEED = None
 GAMMA = 0.9
 ALPHAS = [0.01, 0.001, 0.0001]
@@ -25,8 +34,28 @@ RUNS = 5
 EPISODES = 2000
 MAX_STEPS = 200
 UPDATE_EVERY = 10
+COMPILE = 'eager'
+BACKEND = 'torch'
+CHECKPOINT_EVERY = 0
+CACHE_SIZE = 512
+SOLVED_WINDOW = 100
+# reward thresholds of gym's specs, so that loading results of these
+# environments does not import gym
+SOLVED_SCORES = {'CartPole-v0': 195., 'CartPole-v1': 475.}
+AFTER_SOLVED = 'train'
+SCHEDULER = 'grid'
+MIN_EPISODES = 100
+WORKERS = 1
+SEGMENT_LENGTH = 0
+EVAL_EVERY = 0
+EVAL_EPISODES = 10
+EVAL_MODE = 'greedy'
 ENV = 'CartPole-v0'
 SAVED_MODELS_FOLDER = './data/'
+CACHE_FOLDER = os.path.join(SAVED_MODELS_FOLDER, 'cache')
+# version of the fields of run_config, so that the entries cached with
+# other fields never match
+CACHE_KEY_VERSION = 2
 NOW = "{0:%Y-%m-%dT%H-%M-%S}".format(datetime.now())
 
 # #############################################################################
@@ -56,7 +85,8 @@ def get_arguments():
                         'separated by spaces. Default: ' + str(ALPHAS))
     parser.add_argument('-s', '--hidden_size', type=int, default=HIDDEN_SIZE,
                         nargs='*',
-                        help='Size of the hidden layer. '
+                        help='Size of the hidden layer, or number of '
+                        'tilings with --backend tiles. '
                         'Default: ' + str(HIDDEN_SIZE))
     parser.add_argument('-n', '--runs', type=int, default=RUNS,
                         help='Number of runs to be executed. Default: '
@@ -71,6 +101,111 @@ def get_arguments():
     parser.add_argument('-u', '--update_every', type=int, default=UPDATE_EVERY,
                         help='Number of episodes to run before every weight '
                         'update. Default: ' + str(UPDATE_EVERY))
+    parser.add_argument('--solved_score', type=float, default=None,
+                        help='A run is solved when the average number of '
+                        'steps over the last --solved_window episodes reaches '
+                        'this score. Default: reward threshold of the '
+                        'environment (195 for CartPole-v0, 475 for '
+                        'CartPole-v1).')
+    parser.add_argument('--solved_window', type=int, default=SOLVED_WINDOW,
+                        help='Number of episodes of the moving average of the '
+                        'solved criterion. Default: ' + str(SOLVED_WINDOW))
+    parser.add_argument('--after_solved', type=str, default=AFTER_SOLVED,
+                        choices=['train', 'evaluate', 'censor'],
+                        help='What to do with the remaining episodes of a '
+                        'solved run: keep training, play them without '
+                        'learning (no gradients), or stop the run and mark '
+                        'them as not played (0 steps). Default: '
+                        + AFTER_SOLVED)
+    parser.add_argument('--scheduler', type=str, default=SCHEDULER,
+                        choices=['grid', 'asha'],
+                        help='grid trains every hidden size and learning '
+                        'rate for --episodes episodes. asha (asynchronous '
+                        'successive halving) starts every combination with '
+                        '--min_episodes episodes and only continues the best '
+                        '1/--eta of them at every rung, once every '
+                        'combination of the rung finished it. asha runs in '
+                        'the main process, without --workers and --cache. '
+                        'Default: ' + SCHEDULER)
+    parser.add_argument('--min_episodes', type=int, default=MIN_EPISODES,
+                        help='Episodes of the first rung of asha. '
+                        'Default: ' + str(MIN_EPISODES))
+    parser.add_argument('--eta', type=int, default=ETA,
+                        help='Reduction factor between two rungs of asha. '
+                        'Default: ' + str(ETA))
+    parser.add_argument('--segment_length', type=int, default=SEGMENT_LENGTH,
+                        help='If larger than 0, the model is updated every '
+                        'segment_length steps of an episode, on returns '
+                        'truncated at the end of the segment and bootstrapped '
+                        'with the value of the critic, so that memory and '
+                        'update time do not grow with the length of the '
+                        'episodes. 0 updates on whole episodes. Default: '
+                        + str(SEGMENT_LENGTH))
+    parser.add_argument('--eval_every', type=int, default=EVAL_EVERY,
+                        help='If larger than 0, the policy is evaluated every '
+                        'eval_every episodes and after the last one, on '
+                        '--eval_episodes episodes played in their own '
+                        'environments. The lengths are written in the '
+                        'metrics as the cell <run>/eval. Default: '
+                        + str(EVAL_EVERY))
+    parser.add_argument('--eval_episodes', type=int, default=EVAL_EPISODES,
+                        help='Number of episodes of an evaluation, played '
+                        'together with batched forward passes. Default: '
+                        + str(EVAL_EPISODES))
+    parser.add_argument('--eval_mode', type=str, default=EVAL_MODE,
+                        choices=['greedy', 'stochastic'],
+                        help='greedy plays the most probable action, '
+                        'stochastic samples it, with a generator of its own. '
+                        'Default: ' + EVAL_MODE)
+    parser.add_argument('--ensemble', action='store_true',
+                        help='If this flag is set, the runs of a hidden size '
+                        'and learning rate are trained together, with their '
+                        'parameters stacked in batched kernels (see '
+                        'policy.EnsemblePolicy). Every run keeps its own '
+                        'seed, sampling generator and optimizer state. Only '
+                        'with the grid scheduler and --after_solved train; '
+                        '--compile, --checkpoint_every and --eval_every do '
+                        'not apply.')
+    parser.add_argument('--async_rollouts', action='store_true',
+                        help='If this flag is set with --ensemble, the runs '
+                        'of a task are split in two groups whose '
+                        'environments step in two worker processes, each '
+                        'group computing its actions while the environments '
+                        'of the other step (see async_envs.py). Not with '
+                        '--workers or --render.')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='Number of processes running the runs of the '
+                        'grid scheduler in parallel. Their steps are written '
+                        'in shared memory, which can be followed with python '
+                        'shared_results.py <sweep folder>. Default: '
+                        + str(WORKERS))
+    parser.add_argument('--threads', type=thread_count, default=THREADS,
+                        help='Threads of torch and of BLAS in every process '
+                        'training runs: auto gives every worker its share of '
+                        'the cores, tune times a training step with 1, 2, '
+                        '4, ... threads up to that share and keeps the '
+                        'fastest, and a number sets it (see threads.py). '
+                        'Default: ' + THREADS)
+    parser.add_argument('--log_interval', type=float,
+                        default=CONSOLE_INTERVAL,
+                        help='Minimum number of seconds between two progress '
+                        'summaries on the console. Default: '
+                        + str(CONSOLE_INTERVAL))
+    parser.add_argument('--profile', action='store_true',
+                        help='If this flag is set, the phases of the training '
+                        'loop are timed, and a summary and a Chrome trace are '
+                        'saved in the {} folder, for the runs of the main '
+                        'process, not those of --workers.'.format(
+                            SAVED_MODELS_FOLDER))
+    parser.add_argument('--memprof', action='store_true',
+                        help='If this flag is set, the memory allocated by '
+                        'every phase of the training loop, the memory of '
+                        'every episode and the allocations that grew during '
+                        'every run are reported, and saved in the {} folder, '
+                        'for the runs of the main process, not those of '
+                        '--workers. Slows the training down; with --profile, '
+                        'the times are exported as well.'.format(
+                            SAVED_MODELS_FOLDER))
     parser.add_argument('-v', '--verbose', action="store_true",
                         help='If this flag is set, the algorithm will '
                         'generate more output, useful for debugging.')
@@ -78,9 +213,67 @@ def get_arguments():
                         help='If this flag is set, each episode will be '
                         'rendered.')
     parser.add_argument('-l', '--load', type=str, default=None,
-                        help='Filename of a .pickle pre-saved data file saved '
-                        'in the {} folder. Please include the .pickle '
-                        'extension.'.format(SAVED_MODELS_FOLDER))
+                        help='Saved results in the {} folder: either a '
+                        'results folder ({}) or a .pickle file, which is '
+                        'converted to a results folder the first time it '
+                        'is loaded.'.format(SAVED_MODELS_FOLDER, STORE_SUFFIX))
+    parser.add_argument('--backend', type=str, default=BACKEND,
+                        choices=['torch', 'numpy', 'tiles'],
+                        help='Implementation of the policy: torch (see '
+                        'policy.py), numpy, hand-written forward and '
+                        'backward passes without a framework, faster for '
+                        'small networks (see numpy_policy.py), or tiles, a '
+                        'linear baseline on tile-coded features with '
+                        '--hidden_size tilings, ac learning at every step '
+                        '(see tile_coding.py). numpy and tiles do not '
+                        'import torch, and do not apply to --ensemble and '
+                        '--compile. Default: ' + BACKEND)
+    parser.add_argument('--trace_decay', type=float, default=TRACE_DECAY,
+                        help='Decay (lambda) of the eligibility traces of ac '
+                        'with --backend tiles, 0 for one-step updates. '
+                        'Default: ' + str(TRACE_DECAY))
+    parser.add_argument('--compile', type=str, default=COMPILE,
+                        choices=COMPILE_MODES,
+                        help='Execution mode of the forward pass and of the '
+                        'loss: eager, TorchScript (script) or torch.compile '
+                        '(inductor). Falls back to a cheaper mode when '
+                        'compilation is not available. Default: ' + COMPILE)
+    parser.add_argument('--checkpoint_every', type=int,
+                        default=CHECKPOINT_EVERY,
+                        help='Number of episodes between two saves of the '
+                        'model and optimizer of the current run, 0 to only '
+                        'save finished runs. Default: ' + str(CHECKPOINT_EVERY))
+    parser.add_argument('--resume', type=str, default=None,
+                        help='Folder of an interrupted sweep, saved in the {} '
+                        'folder. Finished runs are skipped and unfinished '
+                        'runs continue from their last checkpoint.'.format(
+                            SAVED_MODELS_FOLDER))
+    parser.add_argument('--export', type=str, default=None,
+                        help='Folder where the policy of every run is '
+                        'exported at the end of the run, as <run>.npz (see '
+                        'policy_export.py and inference_server.py). Runs '
+                        'found in the cache or in the sweep are not trained, '
+                        'so they are not exported.')
+    parser.add_argument('--record', type=str, default=None,
+                        help='Folder where the trajectories of every run are '
+                        'recorded, in <run>/, as memory-mapped arrays of '
+                        'observations, actions, rewards, dones and '
+                        'log-probabilities (see trajectories.py). A resumed '
+                        'run continues its recording from its checkpoint.')
+    parser.add_argument('--cache', action='store_true',
+                        help='If this flag is set, the steps of every run are '
+                        'cached in {} under a hash of their configuration, '
+                        'and runs found in the cache are not trained '
+                        'again.'.format(CACHE_FOLDER))
+    parser.add_argument('--cache_size', type=int, default=CACHE_SIZE,
+                        help='Maximum size of the cache in MB. The least '
+                        'recently used runs are removed beyond it. '
+                        'Default: ' + str(CACHE_SIZE))
+    parser.add_argument('--invalidate_cache', type=str, default=None,
+                        nargs='*', metavar='FIELD=VALUE',
+                        help='Removes from the cache the runs matching all '
+                        'the given fields, e.g. agent=ac hidden_size=64, or '
+                        'every run if no field is given, and exits.')
 
     return parser.parse_args()
 
@@ -96,19 +289,23 @@ def plot9(title, steps_rf, steps_ac):
     '''Creates 9 plots for different combinations of the
     hyperparameters.'''
 
+    import matplotlib.pyplot as plt
+
     fig, axs = plt.subplots(nrows=3, ncols=3,
                             constrained_layout=True,
                             sharey=True,
                             figsize=(10, 10))
 
     fig.suptitle(title, fontsize=12)
+    size_label = ('Tilings' if getattr(args, 'backend', BACKEND) == 'tiles'
+                  else 'Hidden layer size')
     i = 0
     for hs_idx, hs in enumerate(args.hidden_size):
         for alpha_idx, alpha in enumerate(args.alphas):
             plot_learning_curves(axs[hs_idx, alpha_idx], steps_rf, steps_ac, hs_idx, alpha_idx)
             axs[hs_idx, alpha_idx].set_xlabel('Episodes')
             axs[hs_idx, alpha_idx].set_ylabel('Number of steps')
-            axs[hs_idx, alpha_idx].set_title('Hidden layer size: {}\nLearning rate: {}'.format(hs, alpha))
+            axs[hs_idx, alpha_idx].set_title('{}: {}\nLearning rate: {}'.format(size_label, hs, alpha))
             axs[hs_idx, alpha_idx].legend()
             i += 1
             if i == 9: break
@@ -157,7 +354,8 @@ def plot_learning_curves(ax, steps_rf, steps_ac, hidden_idx, alpha_idx):
 
 def plot_line_variance(ax, x_values, data, label, color, axis=0, delta=1):
     '''Plots the average data for each time step and draws a cloud
-    of the standard deviation around the average.
+    of the standard deviation around the average. Episodes that were not
+    played (0 steps, see --after_solved) are left out of the average.
 
     Input:
     ax      : axis object where the plot will be drawn
@@ -167,8 +365,9 @@ def plot_line_variance(ax, x_values, data, label, color, axis=0, delta=1):
     delta   : (optional) scaling of the standard deviation around the average
               if ommitted, delta = 1.'''
 
-    avg = np.average(data, axis)
-    std = np.std(data, axis)
+    data = np.where(data > 0, data, np.nan)
+    avg = np.nanmean(data, axis)
+    std = np.nanstd(data, axis)
 
     # min_values = np.min(data, axis)
     # max_values = np.max(data, axis)
@@ -186,231 +385,862 @@ def plot_line_variance(ax, x_values, data, label, color, axis=0, delta=1):
 
 # #############################################################################
 #
-# Rewards
+# Solved criterion
 #
 # #############################################################################
 
 
-def discount_rewards(rewards):
-    returns = []
-    R = 0
+def solved_episodes(steps, score, window):
+    '''Episode at which each run is solved, i.e. the first episode where
+    the average number of steps over the last window episodes reaches
+    score, or -1 if the run is never solved.
+
+    Input:
+    steps   : array of shape (..., episodes)
+    score   : score of the solved criterion
+    window  : number of episodes of the moving average
+
+    Output:
+    array of shape steps.shape[:-1]'''
+
+    steps = np.asarray(steps, dtype=float)
+    if steps.shape[-1] < window:
+        return np.full(steps.shape[:-1], -1)
 
-    # calculate discounted rewards from inversed array
-    for r in rewards[::-1]:
-        # calculate the discounted value
-        R = r + args.gamma * R
-        # insert in the beginning of the list
-        # (the list is once again in the correct order)
-        returns.insert(0, R)
+    cumsum = np.cumsum(steps, axis=-1)
+    cumsum = np.concatenate(
+        [np.zeros(steps.shape[:-1] + (1,)), cumsum], axis=-1)
+    averages = (cumsum[..., window:] - cumsum[..., :-window]) / window
+    solved = averages >= score
 
-    return returns
+    return np.where(solved.any(axis=-1),
+                    np.argmax(solved, axis=-1) + window - 1, -1)
 
 # #############################################################################
 #
-# Model
+# Runs
 #
 # #############################################################################
 
 
-class Policy(nn.Module):
-    def __init__(self, agent, input_dim, output_dim, hidden_size, alpha):
-        super(Policy, self).__init__()
-
-        self.hidden = nn.Linear(input_dim, hidden_size)
+def run_seed(run):
+    '''Seed of the run-th run of a cell. When --seed is set, it only
+    depends on --seed and on run, so a cell gives the same results
+    whatever the rest of the grid.'''
 
-        # actor
-        self.action_head = nn.Linear(hidden_size, output_dim)
+    if args.seed is None:
+        return np.random.randint(0, 2**32 - 1)
 
-        # critic
-        self.value_head = nn.Linear(hidden_size, 1)
+    return int(np.random.SeedSequence([args.seed, run]).generate_state(1)[0])
 
-        self.actions = []
-        self.rewards = []
 
-        self.optimizer = torch.optim.Adam(self.parameters(), lr=alpha)
+def run_config(agent, hidden_size, alpha, seed, run):
+    '''Everything that determines the outcome of a run, used as the key of
+    the cache. Runs without --seed are interchangeable samples, so they are
+    cached by run index.'''
 
-        if agent == 'ac':
-            self.backprop = self.backprop_ac
-        else:
-            self.backprop = self.backprop_rf
+    return {
+        'env': args.env,
+        'agent': agent,
+        'hidden_size': hidden_size,
+        'alpha': alpha,
+        'gamma': args.gamma,
+        'episodes': args.episodes,
+        'max_steps': args.max_steps,
+        'solved_score': args.solved_score,
+        'solved_window': args.solved_window,
+        'after_solved': args.after_solved,
+        'segment_length': args.segment_length,
+        'backend': args.backend,
+        'trace_decay': args.trace_decay,
+        # EnsemblePolicy samples every run with its own generator, so a
+        # seeded run does not play the same episodes as with one_run
+        'ensemble': args.ensemble,
+        'seed': seed if args.seed is not None else None,
+        'run': run,
+        'code': CODE_VERSION,
+        'key_version': CACHE_KEY_VERSION,
+    }
 
-    def forward(self, x):
 
-        x = F.relu(self.hidden(x))
 
-        action_prob = F.softmax(self.action_head(x), dim=-1)
-        value = self.value_head(x)
+def new_policy(agent, env, hidden_size, alpha, seed=None):
+    '''Policy of --backend for the gym environment env, initialised from
+    seed.'''
 
-        return action_prob, value
-
-    def choose_action(self, state):
-        state = torch.from_numpy(state).float()
-        probs, value = self(state)
+    input_dim = env.observation_space.shape[0]
+    output_dim = env.action_space.n
 
-        # get categorical distribution from probabilities
-        # and sample an action
-        distr = Categorical(probs)
-        action = distr.sample()
+    if args.backend == 'numpy':
+        from numpy_policy import NumpyPolicy
 
-        # save to action buffer
-        self.actions.append([distr.log_prob(action), value])
+        return NumpyPolicy(agent, input_dim, output_dim, hidden_size, alpha,
+                           args.gamma, seed)
 
-        return action.item()
+    if args.backend == 'tiles':
+        from tile_coding import TileCodingPolicy
 
-    def backprop_rf(self):
-        '''Calculate losses and do gradient backpropagation.
-        This code for the reinforce method complety ignores the
-        value branch of the network, and back propagates over
-        the policy.'''
+        return TileCodingPolicy(agent, env.observation_space.low,
+                                env.observation_space.high, output_dim,
+                                hidden_size, alpha, args.gamma,
+                                args.trace_decay, seed)
 
-        policy_losses = []
+    import torch
+    from policy import Policy
 
-        # discount rewards and normalise returns
-        returns = discount_rewards(self.rewards)
-        returns = torch.tensor(returns)
-        returns = (returns - returns.mean()) / (returns.std() + eps)
+    if seed is not None:
+        torch.manual_seed(seed)
 
-        # calculate losses
-        for (log_prob, value), R in zip(self.actions, returns):
+    return Policy(agent, input_dim, output_dim, hidden_size, alpha,
+                  args.gamma)
 
-            # actor loss (negative log-likelihood)
-            policy_losses.append(-log_prob * R)
 
-        # sum up all the values of policy_losses and value_losses
-        loss = torch.stack(policy_losses).sum()
+def grad_enabled(enabled):
+    '''torch.set_grad_enabled, or nothing with the numpy and tiles
+    backends, which only compute gradients in their updates.'''
 
-        # backprop
-        self.optimizer.zero_grad()
-        loss.backward()
-        self.optimizer.step()
+    if args.backend != 'torch':
+        return contextlib.nullcontext()
 
-        # reset buffers
-        del self.rewards[:]
-        del self.actions[:]
+    import torch
 
-    def backprop_ac(self):
-        '''Calculate losses and do gradient backpropagation
-        for the actor-critic (reinforce with baseline) method.'''
+    return torch.set_grad_enabled(enabled)
 
-        policy_losses = []
-        value_losses = []
 
-        # discount rewards and normalise returns
-        returns = discount_rewards(self.rewards)
-        returns = torch.tensor(returns)
-        returns = (returns - returns.mean()) / (returns.std() + eps)
+def one_run(agent, hidden_size, alpha, seed=None, compiled=None,
+            checkpoint=None, name=None, n_episodes=None, out=None):
+    '''Trains one agent for args.episodes episodes.
 
-        # calculate losses
-        for (log_prob, value), R in zip(self.actions, returns):
-            advantage = R - value.item()
+    Input:
+    agent       : 'rf' or 'ac'
+    hidden_size : size of the hidden layer
+    alpha       : learning rate
+    seed        : (optional) seed of the environment and of the policy
+    compiled    : (optional) compiled functions returned by warm_up
+    checkpoint  : (optional) path of the state of the run. If it exists, the
+                  run continues from it, and it is updated every
+                  args.checkpoint_every episodes
+    name        : (optional) name of the run in the metrics
+    n_episodes  : (optional) stops the run after n_episodes episodes instead
+                  of args.episodes. The state of the run is then saved in
+                  checkpoint, so that the run can be continued later
+    out         : (optional) (SharedResults, index of the run) where the steps
+                  are written as soon as every episode is played
 
-            # actor loss (negative log-likelihood)
-            policy_losses.append(-log_prob * advantage)
+    Output:
+    list with the number of steps of every episode. When the run is solved
+    (see --after_solved), the remaining episodes are played without
+    learning, or set to 0 if they are not played at all.'''
 
-            # critic loss using L1 smooth loss
-            value_losses.append(F.smooth_l1_loss(value, torch.tensor([R])))
+    if n_episodes is None:
+        n_episodes = args.episodes
+    update_every = args.update_every
+    gamma = args.gamma
 
-        # sum up all the values of policy_losses and value_losses
-        loss = torch.stack(policy_losses).sum() + torch.stack(value_losses).sum()
+    assert 0 <= gamma <= 1
+    assert alpha > 0
 
-        # backprop
-        self.optimizer.zero_grad()
-        loss.backward()
-        self.optimizer.step()
+    import gym
 
-        # reset buffers
-        del self.rewards[:]
-        del self.actions[:]
+    env = gym.make(args.env)
+    env.seed(seed)
 
-# #############################################################################
-#
-# Runs
-#
-# #############################################################################
+    # env._max_episode_steps = args.max_steps
 
+    input_dim = env.observation_space.shape[0]
 
-def one_run(agent, hidden_size, alpha, seed=None):
+    model = new_policy(agent, env, hidden_size, alpha, seed)
+    model.profiler = profiler
+    # update after every step, see tile_coding.py
+    observe = getattr(model, 'observe', None)
+    if compiled is not None:
+        model.use_compiled(compiled['forward'], compiled[agent])
 
-    n_episodes = args.episodes
-    update_every = args.update_every
-    gamma = args.gamma
     scores = []
+    if checkpoint is not None:
+        scores = load_run_state(checkpoint, model, env)
 
-    assert 0 <= gamma <= 1
-    assert alpha > 0
+    if name is None:
+        name = '{}_h{}_a{}'.format(agent, hidden_size, alpha)
+    if recorder is not None:
+        cell = recorder.cell(name)
 
-    env = gym.make(args.env)
-    env.seed(args.seed)
+    solved = (args.after_solved != 'train'
+              and solved_episodes(scores, args.solved_score,
+                                  args.solved_window).item() >= 0)
 
-    # env._max_episode_steps = args.max_steps
+    if args.eval_every > 0:
+        evaluation = Evaluation(seed, name)
 
-    input_dim = env.observation_space.shape[0]
-    output_dim = env.action_space.n
+    trajectory = None
+    if args.record is not None:
+        from trajectories import TrajectoryRecorder
+        trajectory = TrajectoryRecorder(
+            os.path.join(args.record, name), input_dim, episodes=len(scores),
+            config=dict(env=args.env, agent=agent, hidden_size=hidden_size,
+                        alpha=alpha, gamma=gamma, seed=seed))
 
-    model = Policy(agent, input_dim, output_dim, hidden_size, alpha)
+    for episode in range(len(scores), n_episodes):
 
-    for episode in range(args.episodes):
+        if solved and args.after_solved == 'censor':
+            scores.extend([0] * (n_episodes - len(scores)))
+            break
 
         # reset environment and episode reward
+        start = time.perf_counter()
+        t = profiler.now()
         state = env.reset()
         steps = 0
         done = False
+        # (loss, entropy, steps) of the updates of the episode
+        segments = []
+        t = profiler.lap('env_reset', t)
 
         while not done:
 
             # select action from policy
-            action = model.choose_action(state)
+            with grad_enabled(not solved):
+                action = model.choose_action(state)
 
             # take the action
+            t = profiler.now()
+            obs = state
             state, reward, done, _ = env.step(action)
+            if trajectory is not None:
+                trajectory.record(obs, action, reward, done,
+                                  model.actions[-1][0].item())
 
             if args.render:
                 env.render()
 
             model.rewards.append(reward)
             steps += 1
+            t = profiler.lap('env_step', t)
+
+            if observe is not None and not solved:
+                observe(reward, state, done)
+                t = profiler.lap('backprop', t)
+
+            if (args.segment_length > 0 and not done
+                    and len(model.rewards) == args.segment_length):
+                segments.append(learn(model, solved, model.bootstrap(state)))
+                profiler.lap('backprop', t)
 
+        t = profiler.now()
         scores.append(steps)
-        model.backprop()
+        if out is not None:
+            out[0].update(out[1], scores)
+        if trajectory is not None:
+            trajectory.end_episode()
+        segments.append(learn(model, solved,
+                              0. if args.segment_length > 0 else None))
+        loss = sum(loss for loss, _, _ in segments)
+        entropy = (sum(entropy * length for _, entropy, length in segments)
+                   / steps)
+        t = profiler.lap('backprop', t)
+
+        if (args.after_solved != 'train' and not solved
+                and len(scores) >= args.solved_window
+                and np.mean(scores[-args.solved_window:]) >= args.solved_score):
+            solved = True
+            print('Solved at episode {}'.format(episode))
+
+        if (checkpoint is not None and args.checkpoint_every > 0
+                and (episode + 1) % args.checkpoint_every == 0):
+            save_run_state(checkpoint, model, env, scores)
+
+        # log results
+        if recorder is not None:
+            recorder.record(cell, episode, steps, loss, entropy,
+                            time.perf_counter() - start)
+        t = profiler.lap('logging', t)
+
+        if args.eval_every > 0 and ((episode + 1) % args.eval_every == 0
+                                    or episode + 1 == args.episodes):
+            evaluation.run(model, episode)
+            profiler.lap('evaluation', t)
+        profiler.count('steps', steps)
+        profiler.end_episode()
+
+    profiler.end_run(name)
+
+    if trajectory is not None:
+        trajectory.close()
+
+    if checkpoint is not None and n_episodes < args.episodes:
+        save_run_state(checkpoint, model, env, scores)
+
+    if args.export is not None and len(scores) >= args.episodes:
+        from policy_export import EXPORT_SUFFIX, save_network
+        weights, biases = model.actor_weights()
+        save_network(os.path.join(args.export, name + EXPORT_SUFFIX),
+                     weights, biases, env=args.env, agent=agent,
+                     hidden_size=hidden_size, alpha=alpha, seed=seed,
+                     episodes=len(scores), backend=args.backend)
+
+    if out is not None:
+        # restored or censored episodes
+        out[0].update(out[1], scores[:n_episodes])
+
+    return scores[:n_episodes]
+
+
+def ensemble_run(agent, hidden_size, alpha, seeds, names=None, out=None):
+    '''Trains len(seeds) runs of one agent together, with batched forward
+    and backward passes (see policy.EnsemblePolicy). Every run plays its
+    own environment, seeded like in one_run, and every run plays its
+    episode e before any run starts episode e + 1.
+
+    Input:
+    agent       : 'rf' or 'ac'
+    hidden_size : size of the hidden layer
+    alpha       : learning rate
+    seeds       : seeds of the runs
+    names       : (optional) names of the runs in the metrics
+    out         : (optional) (SharedResults, indices of the runs) where the
+                  steps are written after every episode
+
+    Output:
+    array of shape (len(seeds), args.episodes) with the number of steps of
+    every episode of every run'''
+
+    import gym
+    from policy import EnsemblePolicy
+
+    assert 0 <= args.gamma <= 1
+    assert alpha > 0
+
+    envs = [gym.make(args.env) for _ in seeds]
+    for env, seed in zip(envs, seeds):
+        env.seed(seed)
+
+    input_dim = envs[0].observation_space.shape[0]
+    output_dim = envs[0].action_space.n
+
+    model = EnsemblePolicy(agent, input_dim, output_dim, hidden_size, alpha,
+                           args.gamma, seeds)
+    model.profiler = profiler
+
+    n_runs = len(seeds)
+    scores = np.zeros((n_runs, args.episodes), dtype=int)
+    if names is None:
+        names = ['{}_h{}_a{}_r{}'.format(agent, hidden_size, alpha, run)
+                 for run in range(n_runs)]
+    if recorder is not None:
+        cells = [recorder.cell(name) for name in names]
+
+    for episode in range(args.episodes):
+
+        # reset environments
+        start = time.perf_counter()
+        t = profiler.now()
+        states = np.array([env.reset() for env in envs])
+        active = np.ones(n_runs, dtype=bool)
+        t = profiler.lap('env_reset', t)
+
+        while active.any():
+
+            # select the actions of every run
+            actions = model.choose_actions(states, active)
+
+            # take the actions of the runs that are still playing
+            t = profiler.now()
+            rewards = np.zeros(n_runs)
+            for run in np.flatnonzero(active):
+                states[run], rewards[run], done, _ = envs[run].step(
+                    actions[run])
+                scores[run, episode] += 1
+                if done:
+                    active[run] = False
+
+            if args.render:
+                envs[0].render()
+
+            model.rewards.append(rewards)
+            profiler.lap('env_step', t)
+
+        t = profiler.now()
+        losses, entropies = model.backprop()
+        t = profiler.lap('backprop', t)
+
+        if out is not None:
+            for run, index in enumerate(out[1]):
+                out[0].update(index, scores[run, :episode + 1])
 
         # log results
-        if episode % args.update_every == 0:
-            print('Episode {}\tLast reward: {:.2f}\tAverage reward: {:.2f}'.format(
-                  episode, steps, np.mean(scores[-args.update_every:])))
+        if recorder is not None:
+            duration = time.perf_counter() - start
+            for run in range(n_runs):
+                recorder.record(cells[run], episode, scores[run, episode],
+                                losses[run], entropies[run], duration)
+        profiler.lap('logging', t)
+        profiler.count('steps', int(scores[:, episode].sum()))
+        profiler.end_episode()
+
+    profiler.end_run('{}_h{}_a{}_ensemble'.format(agent, hidden_size, alpha))
+
+    return scores
+
+
+class RolloutGroup():
+    '''Runs of async_ensemble_run played together: their EnsemblePolicy,
+    their environments in a worker process, and the state of their episode.
+
+    Input:
+    seeds : seeds of every run of the task
+    runs  : indices of the runs of the group in seeds'''
+
+    def __init__(self, agent, hidden_size, alpha, seeds, runs):
+        from async_envs import EnvGroup
+        from policy import EnsemblePolicy
+
+        self.runs = runs
+        self.envs = EnvGroup(args.env, [seeds[run] for run in runs])
+        self.model = EnsemblePolicy(agent, self.envs.input_dim,
+                                    self.envs.output_dim, hidden_size, alpha,
+                                    args.gamma, [seeds[run] for run in runs])
+        self.model.profiler = profiler
+        self.episode = 0
+        # runs still playing the episode, None until the states of the reset
+        self.active = None
+        self.start = None
+
+    def reset(self):
+        '''Starts the next episode, the environments resetting meanwhile.'''
+
+        self.start = time.perf_counter()
+        self.active = None
+        self.envs.reset_async()
+
+
+def async_ensemble_run(agent, hidden_size, alpha, seeds, names=None,
+                       out=None):
+    '''Same as ensemble_run, with the rollouts pipelined (see
+    --async_rollouts). The runs are split in two groups, each with its
+    own EnsemblePolicy and its environments in a worker process (see
+    async_envs.py), and the groups alternate: while the policy of one group
+    computes its actions, or learns at the end of its episode, the
+    environments of the other group step.
+
+    The runs of a group play their episodes in lockstep, as in
+    ensemble_run, but the two groups do not wait for each other. As the
+    runs are independent, every run plays the same episodes as with
+    ensemble_run.
+
+    Output:
+    array of shape (len(seeds), args.episodes) with the number of steps of
+    every episode of every run'''
+
+    n_runs = len(seeds)
+    scores = np.zeros((n_runs, args.episodes), dtype=int)
+    if names is None:
+        names = ['{}_h{}_a{}_r{}'.format(agent, hidden_size, alpha, run)
+                 for run in range(n_runs)]
+    if recorder is not None:
+        cells = [recorder.cell(name) for name in names]
+
+    groups = [RolloutGroup(agent, hidden_size, alpha, seeds, runs)
+              for runs in np.array_split(np.arange(n_runs), 2)]
+    for group in groups:
+        group.reset()
+
+    start = time.perf_counter()
+    waited = 0.
+    playing = list(groups)
+    while playing:
+        for group in list(playing):
+
+            # states reached by the last actions of the group
+            t = profiler.now()
+            wait_start = time.perf_counter()
+            result = group.envs.wait()
+            waited += time.perf_counter() - wait_start
+            t = profiler.lap('env_wait', t)
+
+            if group.active is None:
+                states = result
+                group.active = np.ones(len(group.runs), dtype=bool)
+            else:
+                states, rewards, dones = result
+                scores[group.runs[group.active], group.episode] += 1
+                group.model.rewards.append(rewards)
+                group.active &= ~dones
+
+            if group.active.any():
+                # the other group steps meanwhile
+                actions = group.model.choose_actions(states, group.active)
+                group.envs.step_async(actions, group.active)
+                continue
+
+            # end of the episode of the group
+            t = profiler.now()
+            losses, entropies = group.model.backprop()
+            t = profiler.lap('backprop', t)
+
+            if out is not None:
+                for run in group.runs:
+                    out[0].update(out[1][run],
+                                  scores[run, :group.episode + 1])
+
+            # log results
+            if recorder is not None:
+                duration = time.perf_counter() - group.start
+                for run, loss, entropy in zip(group.runs, losses, entropies):
+                    recorder.record(cells[run], group.episode,
+                                    scores[run, group.episode], loss, entropy,
+                                    duration)
+            profiler.lap('logging', t)
+            profiler.count('steps', int(scores[group.runs,
+                                               group.episode].sum()))
+            profiler.end_episode()
+
+            group.episode += 1
+            if group.episode < args.episodes:
+                group.reset()
+            else:
+                playing.remove(group)
+
+    duration = time.perf_counter() - start
+    idle = [group.envs.close()[1] for group in groups]
+    if args.verbose:
+        print('Pipeline: waited for the environments {:.1%} of {:.1f} s, '
+              'environment workers idle {}'.format(
+                  waited / duration, duration,
+                  ', '.join('{:.1%}'.format(t / duration) for t in idle)))
+
+    profiler.end_run('{}_h{}_a{}_ensemble'.format(agent, hidden_size, alpha))
 
     return scores
 
 
-def runs(agent, sizes, alphas):
+class Evaluation():
+    '''Evaluations of the policy of one run (see --eval_every).
+
+    The environments of the evaluation and the generator sampling its
+    actions are seeded from the seed of the run but are not those of the
+    training, so evaluating does not change the training.
+
+    Input:
+    seed : seed of the run, or None
+    name : name of the run in the metrics'''
+
+    def __init__(self, seed, name):
+        import gym
+
+        # a child of the seed of the run, random when seed is None
+        seeds = np.random.SeedSequence(seed).spawn(1)[0]
+        env_seeds = seeds.generate_state(args.eval_episodes + 1)
+
+        self.envs = [gym.make(args.env) for _ in range(args.eval_episodes)]
+        for env, env_seed in zip(self.envs, env_seeds[1:].tolist()):
+            env.seed(env_seed)
+        if args.backend != 'torch':
+            self.generator = np.random.default_rng(int(env_seeds[0]))
+        else:
+            import torch
+
+            self.generator = torch.Generator()
+            self.generator.manual_seed(int(env_seeds[0]))
+
+        self.name = name + '/eval'
+        if recorder is not None:
+            self.cell = recorder.cell(self.name)
+
+    def run(self, model, episode):
+        '''Evaluates model after the training episode episode.
+
+        Output:
+        array with the number of steps of every evaluation episode'''
+
+        start = time.perf_counter()
+        steps = model.evaluate(self.envs, args.eval_mode == 'greedy',
+                               self.generator)
+        duration = (time.perf_counter() - start) / len(steps)
+
+        if recorder is not None:
+            for length in steps.tolist():
+                recorder.record(self.cell, episode, length, duration=duration)
+        if args.verbose:
+            print('{}	Episode {}	Evaluation: {:.2f} +- {:.2f}'.format(
+                self.name, episode, steps.mean(), steps.std()))
+
+        return steps
+
+
+def learn(model, solved, next_value=None):
+    '''Learns from the steps in the buffers of model, or only empties them
+    once the run is solved.
+
+    Input:
+    next_value : value bootstrapping the returns of a segment (see
+                 --segment_length), or None to update on a whole episode
+
+    Output:
+    loss, average entropy and number of steps of the update'''
+
+    length = len(model.rewards)
+    if solved:
+        loss, entropy = np.nan, model.entropy()
+        model.forget()
+    elif next_value is None:
+        loss, entropy = model.backprop()
+    else:
+        loss, entropy = model.backprop_segment(next_value)
+
+    return loss, entropy, length
+
+
+def runs(agent, sizes, alphas, compiled=None, sweep=None, cache=None):
     '''Performs multiple runs (as defined by parameter --runs)
     for a list of parameters alpha and a list of parameter alphas_w.
+    With --workers larger than 1, the runs are shared between worker
+    processes, which write their steps directly in shared memory. With
+    --ensemble, the runs of a hidden size and learning rate are trained
+    together by ensemble_run.
 
     Input:
     agent     : the agent to be used
     sizes     : sizes of the hidden layer
     alphas    : list of alpha_t (learning rates)
+    compiled  : (optional) compiled functions returned by warm_up
+    sweep     : (optional) SweepCheckpoint where every finished run is
+                saved. Runs already saved in it are not executed again.
+    cache     : (optional) ResultCache of the runs
 
     Output:
     array of shape (len(sizes), len(alphas), args.runs, args.episodes)
     containing the number of steps for each alpha, run, episode
     '''
 
-    steps = np.empty((len(sizes), len(alphas), args.runs, args.episodes))
+    shared = SharedResults((len(sizes), len(alphas), args.runs, args.episodes))
+    try:
+        if sweep is not None:
+            publish(sweep.folder, shared, agent)
+
+        jobs = []
+        for size_idx, hidden_size in enumerate(sizes):
+            for alpha_idx, alpha in enumerate(alphas):
+                for run in range(args.runs):
+                    # sets a new seed for each run
+                    seed = run_seed(run)
+                    cell = (agent, hidden_size, alpha, run)
+                    index = (size_idx, alpha_idx, run)
+
+                    if sweep is not None and sweep.is_done(*cell):
+                        shared.update(index, sweep.load_cell(*cell))
+                        continue
+
+                    if cache is not None:
+                        config = run_config(agent, hidden_size, alpha, seed, run)
+                        scores = cache.get(cache.key(config))
+                        if scores is not None:
+                            shared.update(index, scores)
+                            if sweep is not None:
+                                sweep.save_cell(scores, *cell)
+                            continue
+
+                    jobs.append((index, cell, seed,
+                                 sweep.state_path(*cell) if sweep is not None
+                                 else None))
+
+        # runs trained together
+        if args.ensemble:
+            groups = {}
+            for job in jobs:
+                groups.setdefault(job[0][:2], []).append(job)
+            tasks = list(groups.values())
+        else:
+            tasks = [[job] for job in jobs]
+
+        if args.workers > 1 and len(tasks) > 1:
+            preload()
+            with multiprocessing.Pool(
+                    min(args.workers, len(tasks)), initializer=init_worker,
+                    initargs=(args, shared, sweep.folder if sweep is not None
+                              else None, worker_threads)) as pool:
+                for task in pool.imap_unordered(run_task, tasks):
+                    for job in task:
+                        save_job(job, shared, sweep, cache)
+        else:
+            for task in tasks:
+                for job in run_task(task, shared, compiled):
+                    save_job(job, shared, sweep, cache)
+
+        return np.array(shared.steps)
+    finally:
+        shared.close()
+
+
+def preload():
+    '''Creates an environment and a model once, so that the lazy imports
+    of gym and torch (over a second for the first optimizer) are done before
+    the workers are forked instead of in every worker.'''
 
-    for size_idx, hidden_size in enumerate(sizes):
-        for alpha_idx, alpha in enumerate(alphas):
-            for run in tqdm(range(args.runs)):
-                # sets a new seed for each run
-                seed = np.random.randint(0, 2**32 - 1)
-                print('Agent: {}\tHidden size: {}\tLearning rate: {}'.format(agent, hidden_size, alpha))
-                steps[size_idx, alpha_idx, run, :] = one_run(
-                    agent,
-                    hidden_size,
-                    alpha,
-                    seed
-                )
+    import gym
 
-    return steps
+    env = gym.make(args.env)
+    new_policy('rf', env, 1, 1)
+    env.close()
+
+
+def init_worker(worker_args, shared, folder, threads=1):
+    '''Initializes a worker process of runs: the arguments, the shared
+    results, the compiled functions, the metrics file and the threads of
+    the worker.'''
+
+    global args, recorder, profiler, results, compiled_fns
+
+    from threads import set_threads
+
+    set_threads(threads, framework=worker_args.backend)
+
+    args = worker_args
+    results = shared
+    recorder = MetricsRecorder(metrics_path(folder) if folder is not None
+                               else None, console_interval=args.log_interval)
+    profiler = NULL_PROFILER
+
+    if args.compile != 'eager':
+        import gym
+        from policy import warm_up
+
+        env = gym.make(args.env)
+        compiled_fns = warm_up(args.compile, args.hidden_size,
+                               env.observation_space.shape[0],
+                               env.action_space.n)
+        env.close()
+
+
+def tuning_step(compiled=None):
+    '''Function playing an episode of TUNING_STEPS random states with the
+    actor-critic of the largest hidden size, and updating on it, timed to
+    tune the threads (see threads.py).'''
+
+    import gym
+
+    env = gym.make(args.env)
+    input_dim = env.observation_space.shape[0]
+    model = new_policy('ac', env, max(args.hidden_size), min(args.alphas))
+    env.close()
+    if compiled is not None:
+        model.use_compiled(compiled['forward'], compiled['ac'])
+    states = np.random.default_rng(0).standard_normal(
+        (TUNING_STEPS, input_dim)).astype(np.float32)
+
+    def step():
+        for state in states:
+            model.choose_action(state)
+            model.rewards.append(1.)
+        model.backprop()
+
+    return step
+
+
+def run_task(task, shared=None, compiled=None):
+    '''Trains the runs of a task of runs, a list of (index, cell, seed,
+    checkpoint) jobs, and writes their steps in the shared results. The
+    runs of a task of several jobs are trained together.'''
+
+    if shared is None:
+        # worker process, see init_worker
+        shared, compiled = results, compiled_fns
+
+    agent, hidden_size, alpha, _ = task[0][1]
+    print('Agent: {}\tHidden size: {}\tLearning rate: {}'.format(agent, hidden_size, alpha))
+    if len(task) > 1:
+        run_ensemble = (async_ensemble_run if args.async_rollouts
+                        else ensemble_run)
+        run_ensemble(agent, hidden_size, alpha, [seed for _, _, seed, _ in task],
+                     [SweepCheckpoint.cell_name(*cell) for _, cell, _, _ in task],
+                     out=(shared, [index for index, _, _, _ in task]))
+    else:
+        index, cell, seed, checkpoint = task[0]
+        one_run(agent, hidden_size, alpha, seed, compiled, checkpoint,
+                SweepCheckpoint.cell_name(*cell), out=(shared, index))
+    if recorder is not None:
+        recorder.flush()
+
+    return task
+
+
+def save_job(job, shared, sweep, cache):
+    '''Saves a finished run of runs in the sweep and in the cache.'''
+
+    index, cell, seed, _ = job
+    scores = shared.steps[index]
+    if cache is not None:
+        config = run_config(*cell[:3], seed, cell[3])
+        cache.put(cache.key(config), scores, config)
+    if sweep is not None:
+        sweep.save_cell(scores, *cell)
+
+
+def asha_runs(agent, sizes, alphas, sweep, compiled=None):
+    '''Same as runs, but the combinations of hidden size and learning rate
+    are scheduled with successive halving (see scheduler.py), with
+    synchronous promotions since the jobs run one after the other. A
+    combination is scored by the average number of steps of its runs over
+    the last args.solved_window episodes, and a promoted combination
+    continues its runs from their saved states.
+
+    Output:
+    array of shape (len(sizes), len(alphas), args.runs, args.episodes)
+    containing the number of steps for each alpha, run, episode, with 0 for
+    the episodes of the combinations that were stopped early, and array of
+    shape (len(sizes), len(alphas)) with the number of episodes played by
+    each combination'''
+
+    steps = np.zeros((len(sizes), len(alphas), args.runs, args.episodes))
+    configs = [(size_idx, alpha_idx) for size_idx in range(len(sizes))
+               for alpha_idx in range(len(alphas))]
+    scheduler = SuccessiveHalving(configs, min(args.min_episodes, args.episodes),
+                                  args.episodes, args.eta, synchronous=True)
+    seeds = {}
+
+    job = scheduler.next_job()
+    while job is not None:
+        (size_idx, alpha_idx), rung = job
+        hidden_size, alpha = sizes[size_idx], alphas[alpha_idx]
+        budget = scheduler.budgets[rung]
+        print('Agent: {}\tHidden size: {}\tLearning rate: {}\t'
+              'Episodes: {}'.format(agent, hidden_size, alpha, budget))
+
+        for run in range(args.runs):
+            cell = (agent, hidden_size, alpha, run)
+            if cell not in seeds:
+                seeds[cell] = run_seed(run)
+            steps[size_idx, alpha_idx, run, :budget] = one_run(
+                agent,
+                hidden_size,
+                alpha,
+                seeds[cell],
+                compiled,
+                sweep.state_path(*cell),
+                SweepCheckpoint.cell_name(*cell),
+                budget
+            )
+
+        # censored episodes (see --after_solved) belong to solved runs
+        last = steps[size_idx, alpha_idx, :, max(0, budget - args.solved_window):budget]
+        score = np.mean(np.where(last > 0, last, args.solved_score))
+        scheduler.report((size_idx, alpha_idx), rung, score)
+
+        job = scheduler.next_job()
+
+    played = np.zeros((len(sizes), len(alphas)), dtype=int)
+    for size_idx, alpha_idx in configs:
+        played[size_idx, alpha_idx] = scheduler.budgets[
+            scheduler.last_rung((size_idx, alpha_idx))]
+        if played[size_idx, alpha_idx] < args.episodes:
+            print('Stopped early: agent {}\tHidden size: {}\tLearning rate: '
+                  '{}\tEpisodes: {}'.format(agent, sizes[size_idx],
+                                            alphas[alpha_idx],
+                                            played[size_idx, alpha_idx]))
+        for run in range(args.runs):
+            sweep.save_cell(steps[size_idx, alpha_idx, run],
+                            agent, sizes[size_idx], alphas[alpha_idx], run)
+
+    return steps, played
 
 
 # #############################################################################
@@ -420,41 +1250,165 @@ def runs(agent, sizes, alphas):
 # #############################################################################
 
 
-# global variables
-args = get_arguments()
-eps = np.finfo(np.float32).eps.item()
+# global variables, args is set by main
+args = None
+CODE_VERSION = source_version(
+    __file__, *[os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                for name in ['policy.py', 'numpy_policy.py',
+                             'tile_coding.py']])
+# per-episode metrics of the training runs, see metrics.py
+recorder = None
+# timers of the phases of the training loop, see profiler.py
+profiler = NULL_PROFILER
+# shared results and compiled functions of a worker process, see init_worker
+results = None
+compiled_fns = None
+# threads of the processes training runs, see threads.py
+worker_threads = 1
+
+
+def save(steps, filename, arrays=None):
+    '''Saves the steps of each agent, given as a dictionary
+    {agent: array of shape (len(sizes), len(alphas), runs, episodes)},
+    and the other arrays of the dictionary arrays in a ResultsStore.'''
+
+    arrays = arrays or {}
+    folder = os.path.join(SAVED_MODELS_FOLDER,
+                          NOW + '_' + filename + STORE_SUFFIX)
+    store = ResultsStore.create(folder, list(steps), args.hidden_size,
+                                args.alphas, args.runs, args.episodes,
+                                vars(args), compact_dtype(*steps.values()))
+    for agent, data in steps.items():
+        store.write_agent(agent, data)
+    for name, data in arrays.items():
+        store.write_array(name, data)
+    index_results(folder, SAVED_MODELS_FOLDER)
 
 
-def save(objects, filename):
-    f = open(os.path.join(SAVED_MODELS_FOLDER,
-                          NOW + '_' + filename + '.pickle'), 'wb')
-    pickle.dump(objects, f)
-    f.close()
+def load(filename):
+    '''Opens saved results, in the current folder, as a full path or in
+    the data folder. The steps are read lazily, see results_store.
 
+    Output:
+    the steps of rf and ac, the arguments of the sweep, and the saved
+    episodes at which the runs were solved of every agent, None for the
+    results saved without them'''
 
-def load(filename):
-    # try to open in current folder or full path
-    try:
-        f = open(filename, 'rb')
-        steps_rf, steps_ac, args = pickle.load(f)
-        f.close()
-    except FileNotFoundError:
-        # try to open file in the data folder
-        filename = os.path.join(SAVED_MODELS_FOLDER, filename)
-        load(filename)
+    for path in [filename, os.path.join(SAVED_MODELS_FOLDER, filename)]:
+        if os.path.exists(path):
+            break
+    else:
         print('Could not open file {}'.format(filename))
         sys.exit()
 
-    return steps_rf, steps_ac, args
+    store = open_results(path.rstrip(os.sep))
+
+    solved = {agent: store.array('solved_' + agent) for agent in ['rf', 'ac']}
+
+    return store.steps('rf'), store.steps('ac'), store.args(), solved
+
+
+def reward_threshold(env):
+    '''Score at which env is solved, from SOLVED_SCORES or from gym.'''
+
+    if env in SOLVED_SCORES:
+        return SOLVED_SCORES[env]
+    import gym
+
+    return gym.spec(env).reward_threshold
+
+
+def report_solved(title, steps, solved=None):
+    '''Prints the average episode at which the runs of each cell were
+    solved, and how many of them were solved. Unless they are given in
+    solved, they are computed one cell at a time, so that saved results
+    are read one chunk at a time (see results_store.LazySteps).'''
+
+    if solved is None:
+        solved = np.array([[solved_episodes(steps[size_idx, alpha_idx],
+                                            args.solved_score,
+                                            args.solved_window)
+                            for alpha_idx in range(len(args.alphas))]
+                           for size_idx in range(len(args.hidden_size))])
+
+    print(title)
+    for size_idx, hidden_size in enumerate(args.hidden_size):
+        for alpha_idx, alpha in enumerate(args.alphas):
+            cell = solved[size_idx, alpha_idx]
+            print('Hidden size: {}\tLearning rate: {}\tSolved: {}/{}\t'
+                  'Average time to solve: {}'.format(
+                      hidden_size, alpha, np.sum(cell >= 0), len(cell),
+                      '{:.1f}'.format(np.mean(cell[cell >= 0]))
+                      if np.any(cell >= 0) else '-'))
+
+    return solved
 
 
 def main():
-    global args
+    global args, recorder, profiler, worker_threads
+
+    args = get_arguments()
+
+    if args.ensemble and (args.scheduler != 'grid'
+                          or args.after_solved != 'train'
+                          or args.segment_length > 0
+                          or args.eval_every > 0
+                          or args.record is not None):
+        print('--ensemble needs --scheduler grid, --after_solved train, '
+              'no --segment_length, no --eval_every and no --record')
+        sys.exit()
+
+    if args.async_rollouts and (not args.ensemble or args.workers > 1
+                                or args.render):
+        print('--async_rollouts needs --ensemble, no --workers and no '
+              '--render')
+        sys.exit()
+
+    if args.scheduler == 'asha' and (args.workers > 1 or args.cache):
+        print('--scheduler asha needs no --workers and no --cache')
+        sys.exit()
+
+    if (args.profile or args.memprof) and args.workers > 1:
+        print('Warning: the runs of --workers are not profiled, the profile '
+              'only has the runs of the main process')
+
+    if args.backend != 'torch' and (args.ensemble
+                                    or args.compile != 'eager'):
+        print('--backend {} needs no --ensemble and no --compile'.format(
+            args.backend))
+        sys.exit()
+
+    if args.backend == 'tiles' and (args.segment_length > 0
+                                    or args.export is not None):
+        print('--backend tiles needs no --segment_length and no --export')
+        sys.exit()
+
+    cache = None
+    if args.cache or args.invalidate_cache is not None:
+        cache = ResultCache(CACHE_FOLDER, args.cache_size * 2**20)
+
+    if args.invalidate_cache is not None:
+        fields = dict(field.split('=', 1) for field in args.invalidate_cache)
+        print('Removed {} runs from the cache'.format(
+            cache.invalidate(**fields)))
+        sys.exit()
+
+    if args.resume is not None:
+        folder = args.resume
+        if not os.path.isdir(folder):
+            folder = os.path.join(SAVED_MODELS_FOLDER, folder)
+        sweep = SweepCheckpoint(folder)
+        sweep.restore_args(args)
+        print('Resuming sweep from: {}'.format(sweep.folder))
+    elif args.load is None:
+        if args.solved_score is None:
+            args.solved_score = reward_threshold(args.env)
+        sweep = SweepCheckpoint(
+            os.path.join(SAVED_MODELS_FOLDER, NOW + '_sweep'))
+        sweep.save_config(vars(args))
 
     # sets the seed for random experiments
     np.random.seed(args.seed)
-    if args.seed is not None:
-        torch.manual_seed(args.seed)
 
     # env._max_episode_steps = args.max_steps
 
@@ -463,12 +1417,74 @@ def main():
     if args.load is not None:
         # load pre-saved data
         filename = args.load
-        steps_rf, steps_ac, args = load(filename)
+        steps_rf, steps_ac, args, solved = load(filename)
         print('Using saved data from: {}'.format(filename))
+
+        # results saved before the solved criterion existed
+        if getattr(args, 'solved_score', None) is None:
+            args.solved_score = reward_threshold(args.env)
+        if getattr(args, 'solved_window', None) is None:
+            args.solved_window = SOLVED_WINDOW
     else:
-        steps_rf = runs('rf', args.hidden_size, alphas)
-        steps_ac = runs('ac', args.hidden_size, alphas)
-        save([steps_rf, steps_ac, args], 'steps')
+        import gym
+        from threads import configure_threads
+
+        compiled = None
+        random_state = contextlib.nullcontext()
+        if args.backend == 'torch':
+            import torch
+            from policy import warm_up
+
+            if args.seed is not None:
+                torch.manual_seed(args.seed)
+
+            if args.compile != 'eager':
+                env = gym.make(args.env)
+                compiled = warm_up(args.compile, args.hidden_size,
+                                   env.observation_space.shape[0],
+                                   env.action_space.n)
+                env.close()
+            random_state = torch.random.fork_rng()
+
+        # the tuning step does not change the random numbers of the runs
+        with random_state:
+            worker_threads = configure_threads(
+                args.threads,
+                args.workers,
+                tuning_step(compiled) if args.threads == 'tune' else None,
+                framework=args.backend,
+                verbose=args.verbose or args.threads == 'tune')
+
+        recorder = MetricsRecorder(metrics_path(sweep.folder),
+                                   console_interval=args.log_interval)
+        if args.memprof:
+            profiler = MemoryProfiler(timing=args.profile)
+        elif args.profile:
+            profiler = Profiler()
+        arrays = {}
+        if args.scheduler == 'asha':
+            steps_rf, arrays['played_rf'] = asha_runs(
+                'rf', args.hidden_size, alphas, sweep, compiled)
+            steps_ac, arrays['played_ac'] = asha_runs(
+                'ac', args.hidden_size, alphas, sweep, compiled)
+        else:
+            steps_rf = runs('rf', args.hidden_size, alphas, compiled, sweep,
+                            cache)
+            steps_ac = runs('ac', args.hidden_size, alphas, compiled, sweep,
+                            cache)
+        recorder.close()
+        if args.profile or args.memprof:
+            profiler.export(os.path.join(SAVED_MODELS_FOLDER, NOW + '_'))
+
+        arrays['solved_rf'] = solved_episodes(steps_rf, args.solved_score,
+                                              args.solved_window)
+        arrays['solved_ac'] = solved_episodes(steps_ac, args.solved_score,
+                                              args.solved_window)
+        save({'rf': steps_rf, 'ac': steps_ac}, 'steps', arrays)
+        solved = {'rf': arrays['solved_rf'], 'ac': arrays['solved_ac']}
+
+    report_solved('Reinforce', steps_rf, solved['rf'])
+    report_solved('Actor-Critic', steps_ac, solved['ac'])
 
     plot9('Learning curves', steps_rf, steps_ac)
 
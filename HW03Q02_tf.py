@@ -1,13 +1,18 @@
 import tensorflow as tf
 import numpy as np
+import os
 import gym
+import time
 import argparse
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 import pickle
 # import a2c.py
 from datetime import datetime
 
+from metrics import CONSOLE_INTERVAL, MetricsRecorder, metrics_path
+from memprof import MemoryProfiler
+from profiler import NULL_PROFILER, Profiler
+from threads import THREADS, configure_threads, thread_count
+
 SEED = None
 GAMMA = 0.9 #LFPR: avant 0.9
 ALPHAS = 2.0**np.array([-6, -4, -2, 0])
@@ -68,6 +73,34 @@ def get_arguments():
     parser.add_argument('-u', '--update_every', type=int, default=UPDATE_EVERY,
                         help='Number of episodes to run before every weight '
                         'update. Default: ' + str(UPDATE_EVERY))
+    parser.add_argument('--trace', action='store_true',
+                        help='If this flag is set, reinforce accumulates an '
+                        'eligibility trace of the discounted gradients and '
+                        'applies the update every --update_every episodes, '
+                        'instead of applying the gradients of the episode so '
+                        'far after every step.')
+    parser.add_argument('--log_interval', type=float,
+                        default=CONSOLE_INTERVAL,
+                        help='Minimum number of seconds between two progress '
+                        'summaries on the console. Default: '
+                        + str(CONSOLE_INTERVAL))
+    parser.add_argument('--profile', action='store_true',
+                        help='If this flag is set, the phases of the training '
+                        'loop are timed, and a summary and a Chrome trace are '
+                        'saved in the {} folder.'.format(SAVED_MODELS_FOLDER))
+    parser.add_argument('--memprof', action='store_true',
+                        help='If this flag is set, the memory allocated by '
+                        'every phase of the training loop, the memory of '
+                        'every episode and the allocations that grew during '
+                        'every run are reported, and saved in the {} '
+                        'folder. Slows the training down; with --profile, '
+                        'the times are exported as well.'.format(
+                            SAVED_MODELS_FOLDER))
+    parser.add_argument('--threads', type=thread_count, default=THREADS,
+                        help='Intra-op threads of TensorFlow and threads of '
+                        'BLAS: auto uses every core, and a number sets it '
+                        '(see threads.py). The inter-op pool gets one '
+                        'thread. Default: ' + THREADS)
     parser.add_argument('-v', '--verbose', action="store_true",
                         help='If this flag is set, the algorithm will '
                         'generate more output, useful for debugging.')
@@ -141,6 +174,8 @@ class policy(tf.keras.Model):
         for ix, grad in enumerate(self.gradients):
             self.gradients[ix] = grad * 0
 
+        self.profiler = NULL_PROFILER
+
     def call(self, state):
         state = state[None] # LFPR: pourquoi None ici ?
         state = tf.convert_to_tensor(state) #LFPR: J'ai ajouté ça
@@ -152,18 +187,22 @@ class policy(tf.keras.Model):
         compute_loss = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
         #compute_loss = tf.keras.losses.SparseCategoricalCrossentropy() # LFPR
 
+        t = self.profiler.now()
         with tf.GradientTape() as tape:
             # forward pass
             logits = self(state)
             #action_probs = logits.numpy()
             action_probs = tf.nn.softmax(logits).numpy()
+            t = self.profiler.lap('forward', t)
             #print("action_probs: ", action_probs)
             # Choose random action with p = action dist
             action = np.random.choice(action_probs[0], p=action_probs[0]) # LFPR
             # Pourquoi ne pas utiliser list(range(len(action_probs[0]))), donc pas l'autre ligne
             action = np.argmax(action_probs == action)
+            t = self.profiler.lap('sample', t)
             loss = compute_loss([action], logits)
         grads = tape.gradient(loss, self.model.trainable_variables)
+        self.profiler.lap('actor_gradient', t)
 
         return action, grads
 
@@ -172,6 +211,19 @@ class policy(tf.keras.Model):
             for idx, grad in enumerate(grads):
                 self.gradients[idx] += grad * r
 
+    def reset_trace(self):
+        self.trace = [grad * 0 for grad in self.gradients]
+
+    def update_trace(self, grads, r, gamma):
+        '''Accumulates one step of reinforce. With the trace
+        e_k = gamma * e_(k-1) + grads_k, the sum over the steps of r_k * e_k
+        equals the sum of grads_t * G_t, so the steps of the episode do not
+        need to be kept until its end.'''
+
+        for idx, grad in enumerate(grads):
+            self.trace[idx] = gamma * self.trace[idx] + grad
+            self.gradients[idx] += r * self.trace[idx]
+
     def update_actor(self, grads, I, delta):
         for idx, grad in enumerate(grads):
             self.gradients[idx] += I * delta * grad
@@ -272,38 +324,72 @@ def reinforce(alpha, seed=None):
     env.spec.max_episode_steps = args.max_steps
 
     pi = policy(env, alpha, seed)
+    pi.profiler = profiler
+
+    name = 'rf_a{}'.format(alpha)
+    if recorder is not None:
+        cell = recorder.cell(name)
 
     for e in range(n_episodes):
+        start = time.perf_counter()
+        t = profiler.now()
         state = env.reset()
+        if args.trace:
+            pi.reset_trace()
+        profiler.lap('env_reset', t)
         episode = []
         steps = 0
         done = False
         while not done:
             action, grads = pi.choose_action(state)
+            t = profiler.now()
             state, r, done, _ = env.step(action)
+            t = profiler.lap('env_step', t)
             if done: r -= 10    # makes training faster
-            episode.append([grads, r]) #LFPR: r est toujours 1?
             steps += 1
 
+            if args.trace:
+                # accumulate the discounted update of the episode
+                pi.update_trace(grads, r, gamma)
+                profiler.lap('update_trace', t)
+                continue
+
+            episode.append([grads, r]) #LFPR: r est toujours 1?
+
              # update weights
             pi.update(episode)
             pi.apply_gradients()
+            profiler.lap('apply_gradients', t)
 
 
         scores.append(steps)
 
-        # Discound rewards
-        episode = np.array(episode)
-        episode[:, 1] = discount_rewards(episode[:, 1], gamma)
+        if args.trace:
+            # update weights
+            t = profiler.now()
+            if (e + 1) % update_every == 0:
+                pi.apply_gradients()
+            profiler.lap('apply_gradients', t)
+        else:
+            # Discound rewards
+            episode = np.array(episode)
+            episode[:, 1] = discount_rewards(episode[:, 1], gamma)
+
+            # # update weights
+            # pi.update(episode)
 
-        # # update weights
-        # pi.update(episode)
+            # if e % update_every == 0:
+            #     pi.apply_gradients()
 
-        # if e % update_every == 0:
-        #     pi.apply_gradients()
+        t = profiler.now()
+        if recorder is not None:
+            recorder.record(cell, e, steps,
+                            duration=time.perf_counter() - start)
+        profiler.lap('logging', t)
+        profiler.count('steps', steps)
+        profiler.end_episode()
 
-        if e % 100 == 0:
-            print("Episode  {}  Score  {}".format(e, np.mean(scores[-100:])))
+    profiler.end_run(name)
 
 
 def actor_critic(alpha_t, alpha_w, seed=None):
@@ -332,8 +418,17 @@ def actor_critic(alpha_t, alpha_w, seed=None):
         input_dim=actor.env.observation_space.shape[0]
         )
 
+    actor.profiler = profiler
+
+    name = 'ac_at{}_aw{}'.format(alpha_t, alpha_w)
+    if recorder is not None:
+        cell = recorder.cell(name)
+
     for e in range(n_episodes):
+        start = time.perf_counter()
+        t = profiler.now()
         state0 = env.reset()
+        profiler.lap('env_reset', t)
         episode = []
         steps = 0
         done = False
@@ -343,29 +438,40 @@ def actor_critic(alpha_t, alpha_w, seed=None):
         while not done:
             #print("value of state (with w) is {} at step {}".format(critic(state0), steps))
             action, grads = actor.choose_action(state0)
+            t = profiler.now()
             state1, r, done, _ = env.step(action)
+            t = profiler.lap('env_step', t)
             steps += 1
             #if done: r -= 10    # makes training faster
 
             delta = critic.update(state0, state1, r, done)
+            t = profiler.lap('critic_update', t)
             actor.update([[grads, i * delta]])
 
             actor.apply_gradients()
             critic.apply_gradients()
+            profiler.lap('apply_gradients', t)
             
             i *= gamma #LFPR: J'avais enlevé enlevé ça
             state0 = state1
 
         scores.append(steps)
 
-
+        t = profiler.now()
+        if recorder is not None:
+            recorder.record(cell, e, steps,
+                            duration=time.perf_counter() - start)
+        profiler.lap('logging', t)
+        profiler.count('steps', steps)
+        profiler.end_episode()
 
         if (e % 100 == 0 and e > 0) :
             last_100_scores_mean = np.mean(scores[-100:])
-            print("Episode  {}  Score  {}".format(e, last_100_scores_mean))
             if last_100_scores_mean > best_scores_per_hyperparams[(alpha_t, alpha_w)][-1]:
                 best_scores_per_hyperparams[(alpha_t, alpha_w)][-1] = last_100_scores_mean
 
+    profiler.end_run(name)
+
 
 # #############################################################################
 #
@@ -374,8 +480,12 @@ def actor_critic(alpha_t, alpha_w, seed=None):
 # #############################################################################
 
 
-# global variables
-args = get_arguments()
+# global variables, args is set by main
+args = None
+# per-episode metrics of the training runs, see metrics.py
+recorder = None
+# timers of the phases of the training loop, see profiler.py
+profiler = NULL_PROFILER
 
 
 def save(objects, filename):
@@ -427,7 +537,13 @@ def runs(env, alphas, lambdas):
 
 
 def main():
-    global args
+    global args, recorder, profiler
+
+    args = get_arguments()
+
+    # before the first operation, which starts the runtime of TensorFlow
+    configure_threads(args.threads, framework='tensorflow',
+                      verbose=args.verbose)
 
     # sets the seed for random experiments
     np.random.seed(args.seed)
@@ -464,7 +580,17 @@ def main():
         #         actor_critic(alpha_t, alpha_w)
         #         actor_critic(alpha_t, alpha_w)
         #         actor_critic(alpha_t, alpha_w)
+        recorder = MetricsRecorder(
+            metrics_path(SAVED_MODELS_FOLDER, NOW + '_'),
+            console_interval=args.log_interval)
+        if args.memprof:
+            profiler = MemoryProfiler(timing=args.profile)
+        elif args.profile:
+            profiler = Profiler()
         actor_critic(alpha_t=0.1, alpha_w=0.0003)
+        recorder.close()
+        if args.profile or args.memprof:
+            profiler.export(os.path.join(SAVED_MODELS_FOLDER, NOW + '_'))
 
         global best_scores_per_hyperparams
         print(best_scores_per_hyperparams)
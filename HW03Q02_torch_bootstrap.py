@@ -2,11 +2,10 @@ import os
 import sys
 import gym
 import copy
+import time
 import pickle
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 
 import torch
 import torch.nn as nn
@@ -18,6 +17,17 @@ from torch.distributions import Categorical
 from tqdm import tqdm
 from datetime import datetime
 
+from compile_utils import COMPILE_MODES, compile_function, report_latency
+from metrics import CONSOLE_INTERVAL, MetricsRecorder, metrics_path
+from policy_export import export_policy
+from memprof import MemoryProfiler
+from profiler import NULL_PROFILER, Profiler
+from threads import (THREADS, TUNING_STEPS, configure_threads,
+                     thread_count)
+from replay import (IMPORTANCE_EXPONENT, PRIORITY_EXPONENT,
+                    PrioritizedReplayBuffer, ReplayBuffer)
+from trajectories import TrajectoryDataset, TrajectoryRecorder
+
 SEED = None
 GAMMA = 0.99
 ALPHAS = [0.01]
@@ -26,6 +36,16 @@ RUNS = 5
 EPISODES = 2000
 MAX_STEPS = 200
 UPDATE_EVERY = 10
+COMPILE = 'eager'
+REPLAY = 'none'
+REPLAY_CAPACITY = 50000
+BATCH_SIZE = 128
+TRAIN_EVERY = 8
+REPLAY_UPDATES = 1
+TRUNCATION = 10.0
+TARGET_UPDATE = 0.01
+REPLAY_ALPHA = 0.0001
+OFFLINE_EPOCHS = 10
 ENV = 'CartPole-v0'
 SAVED_MODELS_FOLDER = './data/'
 NOW = "{0:%Y-%m-%dT%H-%M-%S}".format(datetime.now())
@@ -71,6 +91,23 @@ def get_arguments():
     parser.add_argument('-u', '--update_every', type=int, default=UPDATE_EVERY,
                         help='Number of episodes to run before every weight '
                         'update. Default: ' + str(UPDATE_EVERY))
+    parser.add_argument('--log_interval', type=float,
+                        default=CONSOLE_INTERVAL,
+                        help='Minimum number of seconds between two progress '
+                        'summaries on the console. Default: '
+                        + str(CONSOLE_INTERVAL))
+    parser.add_argument('--profile', action='store_true',
+                        help='If this flag is set, the phases of the training '
+                        'loop are timed, and a summary and a Chrome trace are '
+                        'saved in the {} folder.'.format(SAVED_MODELS_FOLDER))
+    parser.add_argument('--memprof', action='store_true',
+                        help='If this flag is set, the memory allocated by '
+                        'every phase of the training loop, the memory of '
+                        'every episode and the allocations that grew during '
+                        'every run are reported, and saved in the {} '
+                        'folder. Slows the training down; with --profile, '
+                        'the times are exported as well.'.format(
+                            SAVED_MODELS_FOLDER))
     parser.add_argument('-v', '--verbose', action="store_true",
                         help='If this flag is set, the algorithm will '
                         'generate more output, useful for debugging.')
@@ -81,6 +118,81 @@ def get_arguments():
                         help='Filename of a .pickle pre-saved data file saved '
                         'in the {} folder. Please include the .pickle '
                         'extension.'.format(SAVED_MODELS_FOLDER))
+    parser.add_argument('--replay', type=str, default=REPLAY,
+                        choices=['none', 'uniform', 'prioritized'],
+                        help='none updates the actor and the critic on every '
+                        'transition once. uniform and prioritized keep the '
+                        'transitions in a replay buffer (see replay.py) and '
+                        'update on minibatches drawn from it, off-policy, '
+                        'with truncated importance weights. Default: '
+                        + REPLAY)
+    parser.add_argument('--replay_capacity', type=int,
+                        default=REPLAY_CAPACITY,
+                        help='Number of transitions kept in the replay '
+                        'buffer. Default: ' + str(REPLAY_CAPACITY))
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE,
+                        help='Number of transitions of a replay update. '
+                        'Default: ' + str(BATCH_SIZE))
+    parser.add_argument('--train_every', type=int, default=TRAIN_EVERY,
+                        help='Number of environment steps between two replay '
+                        'updates. Default: ' + str(TRAIN_EVERY))
+    parser.add_argument('--replay_updates', type=int, default=REPLAY_UPDATES,
+                        help='Number of minibatches of a replay update. '
+                        'Default: ' + str(REPLAY_UPDATES))
+    parser.add_argument('--replay_alpha', type=float, default=REPLAY_ALPHA,
+                        help='Learning rate of the actor with replay, whose '
+                        'updates are averaged over a minibatch. Default: '
+                        + str(REPLAY_ALPHA))
+    parser.add_argument('--truncation', type=float, default=TRUNCATION,
+                        help='Largest importance weight of the actor update '
+                        'on replayed transitions. Default: '
+                        + str(TRUNCATION))
+    parser.add_argument('--target_update', type=float, default=TARGET_UPDATE,
+                        help='Rate at which the target critic of replay '
+                        'updates, which values the next states, follows the '
+                        'critic. Default: ' + str(TARGET_UPDATE))
+    parser.add_argument('--priority_exponent', type=float,
+                        default=PRIORITY_EXPONENT,
+                        help='Exponent of the TD errors in the priorities of '
+                        'prioritized replay. Default: '
+                        + str(PRIORITY_EXPONENT))
+    parser.add_argument('--importance_exponent', type=float,
+                        default=IMPORTANCE_EXPONENT,
+                        help='Exponent of the importance-sampling weights of '
+                        'prioritized replay. Default: '
+                        + str(IMPORTANCE_EXPONENT))
+    parser.add_argument('--export', type=str, default=None,
+                        help='.npz file where the trained actor is exported '
+                        '(see policy_export.py and inference_server.py). The '
+                        'critic is exported next to it, as <name>_critic.npz. '
+                        'With --offline, the trained critic is exported.')
+    parser.add_argument('--record', type=str, default=None,
+                        help='Folder where the trajectories of the run are '
+                        'recorded, as memory-mapped arrays of observations, '
+                        'actions, rewards, dones and log-probabilities (see '
+                        'trajectories.py).')
+    parser.add_argument('--offline', type=str, default=None,
+                        help='Folder of trajectories recorded with --record. '
+                        'Instead of playing, the critic is trained on them '
+                        'with TD(0) on shuffled minibatches of --batch_size '
+                        'steps and a target critic (see --target_update), '
+                        'and the loss, the value error and the throughput '
+                        'are reported after every epoch.')
+    parser.add_argument('--offline_epochs', type=int, default=OFFLINE_EPOCHS,
+                        help='Number of passes over the trajectories with '
+                        '--offline. Default: ' + str(OFFLINE_EPOCHS))
+    parser.add_argument('--threads', type=thread_count, default=THREADS,
+                        help='Threads of torch and of BLAS: auto uses every '
+                        'core, tune times a training step with 1, 2, 4, ... '
+                        'threads and keeps the fastest, and a number sets it '
+                        '(see threads.py). Default: ' + THREADS)
+    parser.add_argument('--compile', type=str, default=COMPILE,
+                        choices=COMPILE_MODES,
+                        help='Execution mode of the forward passes of the '
+                        'actor and of the critic: eager, TorchScript (script) '
+                        'or torch.compile (inductor). Falls back to a cheaper '
+                        'mode when compilation is not available. '
+                        'Default: ' + COMPILE)
 
     return parser.parse_args()
 
@@ -95,6 +207,8 @@ def get_arguments():
 def plot3(title, steps_rf, steps_ac):
     '''Creates the plots: average steps per lambda, per alpha, per episodes'''
 
+    import matplotlib.pyplot as plt
+
     fig, axs = plt.subplots(nrows=1, ncols=1,
                             constrained_layout=True,
                             sharey=True,
@@ -209,6 +323,27 @@ def discount_rewards(rewards):
 # #############################################################################
 
 
+def critic_forward(x, hidden1_w, hidden1_b, hidden2_w, hidden2_b,
+                   value_w, value_b):
+    '''Forward pass of Critic written in terms of its parameters, so that
+    it can be compiled once and shared by every model.'''
+
+    x = F.relu(F.linear(x, hidden1_w, hidden1_b))
+    x = F.relu(F.linear(x, hidden2_w, hidden2_b))
+
+    return F.linear(x, value_w, value_b)
+
+
+def actor_forward(x, hidden1_w, hidden1_b, hidden2_w, hidden2_b,
+                  action_w, action_b):
+    '''Forward pass of Actor written in terms of its parameters.'''
+
+    x = F.relu(F.linear(x, hidden1_w, hidden1_b))
+    x = F.relu(F.linear(x, hidden2_w, hidden2_b))
+
+    return F.softmax(F.linear(x, action_w, action_b), dim=-1)
+
+
 class Critic(nn.Module):
     def __init__(self, input_dim, output_dim, alpha):
         super(Critic, self).__init__()
@@ -224,7 +359,14 @@ class Critic(nn.Module):
 
         self.optimizer = torch.optim.Adam(self.parameters(), lr=0.001)
 
+        # compiled forward pass, see use_compiled
+        self.forward_fn = None
+        self.params = None
+
     def forward(self, x):
+        if self.forward_fn is not None:
+            return self.forward_fn(x, *self.params).item()
+
         # critic: evaluates being in the state s_t
         x = F.relu(self.hidden1(x))
         x = F.relu(self.hidden2(x))
@@ -233,6 +375,28 @@ class Critic(nn.Module):
 
         return value.item()
 
+    def values(self, x):
+        '''Values of a batch of states, with gradient.'''
+
+        if self.forward_fn is not None:
+            return self.forward_fn(x, *self.params).squeeze(-1)
+
+        x = F.relu(self.hidden1(x))
+        x = F.relu(self.hidden2(x))
+
+        return self.value_head(x).squeeze(-1)
+
+    def critic_layers(self):
+        '''Layers of the critic, to export it (see policy_export.py).'''
+
+        return [self.hidden1, self.hidden2, self.value_head]
+
+    def use_compiled(self, forward_fn):
+        '''Routes the forward pass through a compiled critic_forward.'''
+
+        self.forward_fn = forward_fn
+        self.params = tuple(self.parameters())
+
     def backprop(self, log_prob, target, v0, i):
 
         gamma = args.gamma
@@ -284,7 +448,15 @@ class Actor(nn.Module):
 
         self.optimizer = torch.optim.Adam(self.parameters(), lr=0.00002)
 
+        # compiled forward pass, see use_compiled
+        self.forward_fn = None
+        self.params = None
+
+        self.profiler = NULL_PROFILER
+
     def forward(self, x):
+        if self.forward_fn is not None:
+            return self.forward_fn(x, *self.params)
 
         x = F.relu(self.hidden1(x))
         x = F.relu(self.hidden2(x))
@@ -295,16 +467,32 @@ class Actor(nn.Module):
 
         return action_prob
 
+    def actor_layers(self):
+        '''Layers of the actor, to export it (see policy_export.py).'''
+
+        return [self.hidden1, self.hidden2, self.action_head]
+
+    def use_compiled(self, forward_fn):
+        '''Routes the forward pass through a compiled actor_forward.'''
+
+        self.forward_fn = forward_fn
+        self.params = tuple(self.parameters())
+
     def choose_action(self, state):
         # state = torch.from_numpy(state).float()
+        t = self.profiler.now()
         probs= self(state)
+        t = self.profiler.lap('actor_forward', t)
 
         # get categorical distribution from probabilities
         # and sample an action
         distr = Categorical(probs)
         action = distr.sample()
+        log_prob = distr.log_prob(action)
+        action = action.item()
+        self.profiler.lap('sample', t)
 
-        return action.item(), distr.log_prob(action)
+        return action, log_prob
 
     def backprop(self, log_prob, target, v0, i):
 
@@ -333,6 +521,29 @@ class Actor(nn.Module):
         self.optimizer.step()
 
 
+def warm_up(mode, input_dim, output_dim):
+    '''Compiles actor_forward and critic_forward before the first episode,
+    so that compilation time is not counted in the runs.
+
+    Output:
+    dictionary with the compiled forward passes of the actor and of the
+    critic, to be passed to use_compiled'''
+
+    actor = Actor(input_dim, output_dim, 1)
+    critic = Critic(input_dim, output_dim, 1)
+    state = torch.rand(input_dim)
+
+    compiled = {}
+    for name, model, fn in [('actor', actor, actor_forward),
+                            ('critic', critic, critic_forward)]:
+        params = tuple(model.parameters())
+        compiled[name], used = compile_function(fn, mode, [(state,) + params])
+        report_latency(name.capitalize() + ' forward', model, (state,),
+                       compiled[name], (state,) + params, used)
+
+    return compiled
+
+
 # #############################################################################
 #
 # Methods
@@ -340,7 +551,7 @@ class Actor(nn.Module):
 # #############################################################################
 
 
-def actor_critic(alpha, seed=None):
+def actor_critic(alpha, seed=None, compiled=None):
 
     n_episodes = args.episodes
     update_every = args.update_every
@@ -361,12 +572,25 @@ def actor_critic(alpha, seed=None):
 
     ac = Actor(input_dim, output_dim, alpha)
     cr = Critic(input_dim, output_dim, alpha)
+    ac.profiler = profiler
+    if compiled is not None:
+        ac.use_compiled(compiled['actor'])
+        cr.use_compiled(compiled['critic'])
+
+    name = 'ac_a{}'.format(alpha)
+    if recorder is not None:
+        cell = recorder.cell(name)
+    trajectory = new_trajectory(input_dim, 'bootstrap_ac', alpha)
 
     for episode in range(args.episodes):
 
         # reset environment and episode reward
+        start = time.perf_counter()
+        t = profiler.now()
         state0 = env.reset()
+        t = profiler.lap('env_reset', t)
         state0 = torch.from_numpy(state0).float()
+        profiler.lap('to_tensor', t)
         steps = 0
         done = False
         i = 1
@@ -374,19 +598,24 @@ def actor_critic(alpha, seed=None):
 
             # select action from policy
             action, log_prob = ac.choose_action(state0)
+            t = profiler.now()
             v0 = cr(state0)
+            t = profiler.lap('critic_forward', t)
 
             # take the action
             state1, reward, done, _ = env.step(action)
 
             if args.render:
                 env.render()
+            t = profiler.lap('env_step', t)
 
             if done:
                 v1 = torch.tensor([0])
             else:
                 state1 = torch.from_numpy(state1).float()
+                t = profiler.lap('to_tensor', t)
                 v1 = cr(state1)
+                t = profiler.lap('critic_forward', t)
 
             target = reward + gamma * v1
 
@@ -394,16 +623,325 @@ def actor_critic(alpha, seed=None):
             steps += 1
             ac.backprop(log_prob, target, v0, i)
             cr.backprop(log_prob, target, v0, i)
+            t = profiler.lap('backprop', t)
+            if trajectory is not None:
+                trajectory.record(state0.numpy(), action, reward, done,
+                                  log_prob.item())
+                profiler.lap('record', t)
             i *= gamma
             state0 = state1
 
 
         scores.append(steps)
+        if trajectory is not None:
+            trajectory.end_episode()
+
+        # log results
+        t = profiler.now()
+        if recorder is not None:
+            recorder.record(cell, episode, steps,
+                            duration=time.perf_counter() - start)
+        profiler.lap('logging', t)
+        profiler.count('steps', steps)
+        profiler.end_episode()
+
+    profiler.end_run(name)
+
+    if trajectory is not None:
+        trajectory.close()
+
+    if args.export is not None:
+        export_policy(args.export, ac.actor_layers(), env=args.env,
+                      agent='bootstrap_ac', alpha=alpha, seed=args.seed,
+                      episodes=args.episodes)
+        export_policy('{}_critic{}'.format(*os.path.splitext(args.export)),
+                      cr.critic_layers(), output='linear', env=args.env,
+                      agent='bootstrap_ac', seed=args.seed,
+                      episodes=args.episodes)
+
+
+def replay_update(ac, cr, target, buffer):
+    '''Updates the actor and the critic on a minibatch of the replay
+    buffer, off-policy. With rho = pi(a|s) / mu(a|s), the ratio of the
+    current policy to the policy that played the transition:
+
+        critic  V(s) moves towards V(s) + min(1, rho) delta (V-trace)
+        actor   -min(truncation, rho) delta log pi(a|s)
+
+    where delta = r + gamma V'(s') - V(s) and V' is the target critic, a
+    slowly updated copy of the critic that keeps the bootstrapped targets
+    of the large critic from diverging. Truncating rho bounds the
+    variance of the update as in ACER (Wang et al., 2017); ACER also adds
+    a bias correction term, which needs Q-values that this critic does
+    not have. Every loss is weighted by the importance-sampling weights of
+    prioritized replay, and the priorities are updated with |delta|.
+
+    Output:
+    mean loss of the actor and of the critic'''
+
+    batch = buffer.sample(args.batch_size)
+    states = torch.from_numpy(batch['states'])
+    next_states = torch.from_numpy(batch['next_states'])
+    actions = torch.from_numpy(batch['actions'])
+    rewards = torch.from_numpy(batch['rewards'])
+    not_done = torch.from_numpy(~batch['dones']).float()
+    weights = torch.from_numpy(batch['weights'])
+
+    probs = ac(states)
+    log_probs = torch.log(probs.gather(1, actions.unsqueeze(1)).squeeze(1))
+    values = cr.values(states)
+    with torch.no_grad():
+        next_values = target.values(next_states)
+        delta = rewards + args.gamma * not_done * next_values - values
+        behaviour = torch.from_numpy(batch['probs']).gather(
+            1, actions.unsqueeze(1)).squeeze(1)
+        rho = probs.gather(1, actions.unsqueeze(1)).squeeze(1) / behaviour
+        targets = values + torch.clamp(rho, max=1.) * delta
+
+    actor_loss = -(weights * torch.clamp(rho, max=args.truncation) * delta
+                   * log_probs).mean()
+    critic_loss = (weights * F.smooth_l1_loss(values, targets,
+                                              reduction='none')).mean()
+
+    ac.optimizer.zero_grad()
+    actor_loss.backward()
+    ac.optimizer.step()
+    cr.optimizer.zero_grad()
+    critic_loss.backward()
+    cr.optimizer.step()
+
+    with torch.no_grad():
+        for p, target_p in zip(cr.parameters(), target.parameters()):
+            target_p.lerp_(p, args.target_update)
+
+    buffer.update_priorities(batch['indices'], delta.numpy())
+
+    return actor_loss.item(), critic_loss.item()
+
+
+def replay_actor_critic(alpha, seed=None, compiled=None):
+    '''Actor-critic learning from a replay buffer (see --replay). The
+    agent plays with its current policy and keeps every transition, with
+    the probabilities of the actions it played, then every
+    args.train_every steps does args.replay_updates updates on minibatches
+    of args.batch_size transitions (see replay_update).'''
+
+    gamma = args.gamma
+
+    assert 0 <= gamma <= 1
+    assert alpha > 0
+
+    env = gym.make(args.env)
+    env.seed(args.seed)
+
+    input_dim = env.observation_space.shape[0]
+    output_dim = env.action_space.n
+
+    ac = Actor(input_dim, output_dim, alpha)
+    for group in ac.optimizer.param_groups:
+        group['lr'] = args.replay_alpha
+    cr = Critic(input_dim, output_dim, alpha)
+    ac.profiler = profiler
+    if compiled is not None:
+        ac.use_compiled(compiled['actor'])
+        cr.use_compiled(compiled['critic'])
+    target = copy.deepcopy(cr)
+
+    if args.replay == 'prioritized':
+        buffer = PrioritizedReplayBuffer(
+            args.replay_capacity, input_dim, output_dim, args.seed,
+            args.priority_exponent, args.importance_exponent)
+    else:
+        buffer = ReplayBuffer(args.replay_capacity, input_dim, output_dim,
+                              args.seed)
+
+    name = 'ac_{}_a{}'.format(args.replay, alpha)
+    if recorder is not None:
+        cell = recorder.cell(name)
+    trajectory = new_trajectory(input_dim, 'replay_ac', alpha)
+
+    total_steps = 0
+    for episode in range(args.episodes):
+
+        # reset environment and episode reward
+        start = time.perf_counter()
+        t = profiler.now()
+        state0 = env.reset()
+        t = profiler.lap('env_reset', t)
+        steps = 0
+        done = False
+        losses = []
+        while not done:
+
+            # select action from the current policy
+            with torch.no_grad():
+                probs = ac(torch.from_numpy(state0).float())
+                action = Categorical(probs).sample().item()
+            t = profiler.lap('actor_forward', t)
+
+            # take the action
+            state1, reward, done, _ = env.step(action)
+
+            if args.render:
+                env.render()
+            t = profiler.lap('env_step', t)
+
+            buffer.add(state0, action, reward, state1, done, probs.numpy())
+            if trajectory is not None:
+                trajectory.record(state0, action, reward, done,
+                                  np.log(probs[action].item()))
+            steps += 1
+            total_steps += 1
+            state0 = state1
+            t = profiler.lap('replay_add', t)
+
+            if (total_steps % args.train_every == 0
+                    and len(buffer) >= args.batch_size):
+                for _ in range(args.replay_updates):
+                    losses.append(replay_update(ac, cr, target, buffer))
+                t = profiler.lap('backprop', t)
+
+        if trajectory is not None:
+            trajectory.end_episode()
 
         # log results
-        if episode % args.update_every == 0:
-            print('Episode {}\tLast reward: {:.2f}\tAverage reward: {:.2f}'.format(
-                  episode, steps, np.mean(scores[-args.update_every:])))
+        if recorder is not None:
+            loss = np.sum(losses) if losses else np.nan
+            recorder.record(cell, episode, steps, loss,
+                            duration=time.perf_counter() - start)
+        profiler.lap('logging', t)
+        profiler.count('steps', steps)
+        profiler.end_episode()
+
+    profiler.end_run(name)
+
+    if trajectory is not None:
+        trajectory.close()
+
+    if args.export is not None:
+        export_policy(args.export, ac.actor_layers(), env=args.env,
+                      agent='replay_ac', alpha=alpha, seed=args.seed,
+                      episodes=args.episodes)
+        export_policy('{}_critic{}'.format(*os.path.splitext(args.export)),
+                      cr.critic_layers(), output='linear', env=args.env,
+                      agent='replay_ac', seed=args.seed,
+                      episodes=args.episodes)
+
+
+# #############################################################################
+#
+# Offline
+#
+# #############################################################################
+
+
+def tuning_step(input_dim, output_dim, compiled=None):
+    '''Function playing an episode of TUNING_STEPS random states with the
+    per-step actor-critic, updating on every step, timed to tune the
+    threads (see threads.py).'''
+
+    ac = Actor(input_dim, output_dim, None)
+    cr = Critic(input_dim, output_dim, None)
+    if compiled is not None:
+        ac.use_compiled(compiled['actor'])
+        cr.use_compiled(compiled['critic'])
+    states = torch.from_numpy(np.random.default_rng(0).standard_normal(
+        (TUNING_STEPS + 1, input_dim)).astype(np.float32))
+
+    def step():
+        for state0, state1 in zip(states[:-1], states[1:]):
+            _, log_prob = ac.choose_action(state0)
+            v0 = cr(state0)
+            target = 1. + args.gamma * cr(state1)
+            ac.backprop(log_prob, target, v0, 1.)
+            cr.backprop(log_prob, target, v0, 1.)
+
+    return step
+
+
+def new_trajectory(input_dim, agent, alpha):
+    '''Recorder of the trajectories of the run in args.record, or None.'''
+
+    if args.record is None:
+        return None
+
+    return TrajectoryRecorder(args.record, input_dim, config=dict(
+        env=args.env, agent=agent, alpha=alpha, gamma=args.gamma,
+        seed=args.seed, episodes=args.episodes))
+
+
+def offline_critic(folder):
+    '''Trains a critic on the trajectories recorded in folder (see
+    --record) without playing: TD(0) on shuffled minibatches of
+    args.batch_size steps, towards a target critic updated like in
+    replay_update. After every epoch, reports the mean TD loss, the mean
+    absolute error of the values against the discounted returns of the
+    trajectories, and the number of steps trained on per second.
+
+    Output:
+    the trained critic'''
+
+    gamma = args.gamma
+    dataset = TrajectoryDataset(folder)
+    print('{}: {} steps, {} episodes, mean length {:.1f}'.format(
+        folder, len(dataset), dataset.n_episodes, dataset.lengths().mean()))
+
+    cr = Critic(dataset.meta['obs_dim'], 1, None)
+    target = copy.deepcopy(cr)
+    returns = dataset.returns(gamma)
+
+    for epoch in range(args.offline_epochs):
+        start = time.perf_counter()
+        losses = []
+        for batch in dataset.batches(args.batch_size, shuffle=True,
+                                     seed=epoch):
+            t = profiler.now()
+            states = torch.tensor(batch['obs'])
+            next_states = torch.tensor(batch['next_obs'])
+            rewards = torch.tensor(batch['reward'])
+            not_done = torch.tensor(~(batch['done'] | batch['last'])).float()
+            t = profiler.lap('to_tensor', t)
+
+            values = cr.values(states)
+            with torch.no_grad():
+                targets = rewards + gamma * not_done * target.values(
+                    next_states)
+            loss = F.smooth_l1_loss(values, targets)
+
+            cr.optimizer.zero_grad()
+            loss.backward()
+            cr.optimizer.step()
+            with torch.no_grad():
+                for p, target_p in zip(cr.parameters(), target.parameters()):
+                    target_p.lerp_(p, args.target_update)
+            losses.append(loss.item())
+            profiler.lap('backprop', t)
+        duration = time.perf_counter() - start
+
+        # sequential minibatches are views of the recorded arrays
+        errors = []
+        with torch.no_grad():
+            for start in range(0, len(dataset), args.batch_size):
+                batch = dataset[start:start + args.batch_size]
+                values = cr.values(torch.tensor(batch['obs'])).numpy()
+                errors.append(np.abs(
+                    values - returns[start:start + len(values)]))
+        profiler.count('steps', len(dataset))
+        profiler.end_episode()
+
+        print('Epoch {}\tTD loss: {:.4f}\tValue error: {:.2f}\t'
+              'Steps/s: {:.0f}'.format(epoch, np.mean(losses),
+                                       np.concatenate(errors).mean(),
+                                       len(dataset) / duration))
+
+    profiler.end_run('offline_critic')
+
+    if args.export is not None:
+        export_policy(args.export, cr.critic_layers(), output='linear',
+                      agent='offline_critic', trajectories=folder,
+                      epochs=args.offline_epochs)
+
+    return cr
 
 
 # #############################################################################
@@ -413,9 +951,13 @@ def actor_critic(alpha, seed=None):
 # #############################################################################
 
 
-# global variables
-args = get_arguments()
+# global variables, args is set by main
+args = None
 eps = np.finfo(np.float32).eps.item()
+# per-episode metrics of the training runs, see metrics.py
+recorder = None
+# timers of the phases of the training loop, see profiler.py
+profiler = NULL_PROFILER
 
 
 def save(objects, filename):
@@ -467,7 +1009,9 @@ def runs(agent, alphas):
 
 
 def main():
-    global args
+    global args, recorder, profiler
+
+    args = get_arguments()
 
     # sets the seed for random experiments
     np.random.seed(args.seed)
@@ -487,7 +1031,35 @@ def main():
         # steps_rf = runs(reinforce, alphas_t, [0])
         # steps_ac = runs(actor_critic, alphas_t, alphas_w)
         # reinforce(alpha=0.01)
-        actor_critic(0.001)
+        env = gym.make(args.env)
+        input_dim = env.observation_space.shape[0]
+        output_dim = env.action_space.n
+        env.close()
+        compiled = None
+        if args.compile != 'eager':
+            compiled = warm_up(args.compile, input_dim, output_dim)
+        # the tuning step does not change the random numbers of the run
+        with torch.random.fork_rng():
+            configure_threads(
+                args.threads, step=tuning_step(input_dim, output_dim, compiled)
+                if args.threads == 'tune' else None,
+                verbose=args.verbose or args.threads == 'tune')
+        recorder = MetricsRecorder(
+            metrics_path(SAVED_MODELS_FOLDER, NOW + '_'),
+            console_interval=args.log_interval)
+        if args.memprof:
+            profiler = MemoryProfiler(timing=args.profile)
+        elif args.profile:
+            profiler = Profiler()
+        if args.offline is not None:
+            offline_critic(args.offline)
+        elif args.replay == 'none':
+            actor_critic(0.001, compiled=compiled)
+        else:
+            replay_actor_critic(0.001, compiled=compiled)
+        recorder.close()
+        if args.profile or args.memprof:
+            profiler.export(os.path.join(SAVED_MODELS_FOLDER, NOW + '_'))
         # actor_critic_original(0.01, 0.01)
         # save([steps_rf, steps_ac, args], 'steps')
 
@@ -0,0 +1,113 @@
+'''Environments stepped in a worker process, for pipelined rollouts.
+
+An EnvGroup holds the gym environments of several runs in a child process.
+Commands are sent without waiting for them, step_async and reset_async,
+and their results are collected later with wait, so the parent process
+can compute the actions of another group of runs in the meantime (see
+async_ensemble_run in HW03Q02.py):
+
+    group.step_async(actions, active)
+    ...                                   # the environments step meanwhile
+    states, rewards, dones = group.wait()
+
+Every environment is created and seeded in the worker as it would be in
+the parent, so a run plays the same episodes. The worker keeps the time it
+spends stepping and waiting for commands, returned by close, to check that
+neither side of the pipeline is idle.'''
+
+import time
+import multiprocessing
+
+import numpy as np
+
+
+def env_worker(conn, env_id, seeds):
+    '''Loop of the worker process of an EnvGroup.'''
+
+    import gym
+
+    envs = [gym.make(env_id) for _ in seeds]
+    for env, seed in zip(envs, seeds):
+        env.seed(seed)
+    conn.send((envs[0].observation_space.shape[0], envs[0].action_space.n))
+
+    states = np.zeros((len(envs), envs[0].observation_space.shape[0]))
+    busy = idle = 0.
+    start = None
+    while True:
+        command, data = conn.recv()
+        now = time.perf_counter()
+        # from the first command on
+        if start is not None:
+            idle += now - start
+
+        if command == 'reset':
+            for run, env in enumerate(envs):
+                states[run] = env.reset()
+            result = states
+        elif command == 'step':
+            actions, active = data
+            rewards = np.zeros(len(envs))
+            dones = np.zeros(len(envs), dtype=bool)
+            for run in np.flatnonzero(active):
+                states[run], rewards[run], dones[run], _ = envs[run].step(
+                    actions[run])
+            result = states, rewards, dones
+        else:
+            for env in envs:
+                env.close()
+            conn.send((busy, idle))
+            conn.close()
+            return
+
+        conn.send(result)
+        start = time.perf_counter()
+        busy += start - now
+
+
+class EnvGroup():
+    '''Environments of several runs, stepped in a worker process.
+
+    Input:
+    env_id : id of the gym environment
+    seeds  : seeds of the environments, one per run'''
+
+    def __init__(self, env_id, seeds):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=env_worker, args=(child, env_id, list(seeds)), daemon=True)
+        self.process.start()
+        child.close()
+
+        self.n_envs = len(seeds)
+        self.input_dim, self.output_dim = self.conn.recv()
+
+    def reset_async(self):
+        '''Resets every environment. The states are returned by wait.'''
+
+        self.conn.send(('reset', None))
+
+    def step_async(self, actions, active):
+        '''Steps the environments of the active runs with their actions.
+        The states, rewards and dones of every run, 0 for the inactive
+        ones, are returned by wait.'''
+
+        self.conn.send(('step', (actions, active)))
+
+    def wait(self):
+        '''Result of the last command, once the worker is done with it.'''
+
+        return self.conn.recv()
+
+    def close(self):
+        '''Stops the worker.
+
+        Output:
+        seconds the worker spent stepping, and waiting for commands'''
+
+        self.conn.send(('close', None))
+        stats = self.conn.recv()
+        self.process.join()
+        self.conn.close()
+
+        return stats
@@ -0,0 +1,341 @@
+'''Throughput of the CartPole learners.
+
+Every learner is trained --runs times, with the seeds 0, 1, ..., in a fresh
+interpreter, headless, with the timers of --profile (see profiler.py):
+
+    HW03Q02 torch      Policy (policy.py), rf and ac
+    HW03Q02 numpy      NumpyPolicy (numpy_policy.py), rf and ac
+    HW03Q02 tiles      TileCodingPolicy (tile_coding.py), rf and ac
+    bootstrap          Actor and Critic of HW03Q02_torch_bootstrap.py
+    TF                 policy and v_hat of HW03Q02_tf.py, skipped when
+                       TensorFlow is not installed
+
+and for every learner the suite measures:
+
+    steps/s        environment steps per second of training, from the
+                   durations of the episodes in the metrics
+    updates/s      gradient steps per second of training, from the laps of
+                   the update phases of the profile
+    latency        percentiles of the time to choose an action, from the
+                   laps of the action phases of the Chrome trace
+    train time     seconds of training of a run
+    to score       environment steps until the mean length of the last
+                   SCORE_WINDOW episodes reaches the target score, median
+                   of the runs that reach it
+    peak memory    peak resident memory of the process, which trains rf and
+                   ac one after the other for HW03Q02
+
+The medians over the runs are printed as a table and saved with the
+machine as JSON:
+
+    python backend_benchmark.py --runs 3 --episodes 300'''
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+from datetime import datetime
+
+import numpy as np
+
+from metrics import read
+from checkpoint import atomic_write
+from regression import WRAPPER, machine
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+NOW = "{0:%Y-%m-%dT%H-%M-%S}".format(datetime.now())
+OUTPUT = os.path.join(FOLDER, 'data', NOW + '_benchmark.json')
+RUNS = 3
+EPISODES = 200
+TARGET_SCORE = 150
+SCORE_WINDOW = 10
+PERCENTILES = [50, 90, 99]
+
+
+# #############################################################################
+#
+# Parser
+#
+# #############################################################################
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description='Compares the throughput of the CartPole learners.')
+    parser.add_argument('-n', '--runs', type=int, default=RUNS,
+                        help='Number of runs of every learner, with the seeds '
+                        '0 to runs - 1. Default: ' + str(RUNS))
+    parser.add_argument('-e', '--episodes', type=int, default=EPISODES,
+                        help='Number of episodes of every run. Default: '
+                        + str(EPISODES))
+    parser.add_argument('--target', type=float, default=TARGET_SCORE,
+                        help='Mean length of the last {} episodes to reach. '
+                        'Default: {}'.format(SCORE_WINDOW, TARGET_SCORE))
+    parser.add_argument('-c', '--cases', type=str, default=None, nargs='*',
+                        help='Cases to run, by name, e.g. "HW03Q02 numpy". '
+                        'Default: all the cases.')
+    parser.add_argument('-o', '--output', type=str, default=OUTPUT,
+                        help='JSON file where the results are saved. '
+                        'Default: ' + os.path.relpath(OUTPUT, FOLDER))
+
+    return parser.parse_args()
+
+
+# #############################################################################
+#
+# Cases
+#
+# #############################################################################
+
+
+def cases(episodes):
+    '''name, command line, modules needed, and for every learner, by the
+    prefix of its runs in the metrics: its name, the phases of choosing an
+    action and the phases of an update.'''
+
+    common = ['-e', str(episodes), '--threads', '1', '--log_interval', '3600',
+              '--profile']
+    q02 = ['HW03Q02.py', '-n', '1', '--alphas', '0.01'] + common
+
+    def q02_learners(name):
+        return {agent: ('{} {}'.format(name, agent),
+                        ['to_tensor', 'forward', 'sample'], ['backprop'])
+                for agent in ['rf', 'ac']}
+
+    return [
+        ('HW03Q02 torch', q02 + ['-s', '32', '--backend', 'torch'],
+         ['torch', 'gym'], q02_learners('Policy torch')),
+        ('HW03Q02 numpy', q02 + ['-s', '32', '--backend', 'numpy'],
+         ['gym'], q02_learners('Policy numpy')),
+        ('HW03Q02 tiles', q02 + ['-s', '8', '--backend', 'tiles'],
+         ['gym'], q02_learners('Policy tiles')),
+        ('bootstrap', ['HW03Q02_torch_bootstrap.py'] + common,
+         ['torch', 'gym'], {'ac': ('Actor/Critic ac',
+                                   ['actor_forward', 'sample'],
+                                   ['backprop'])}),
+        ('TF', ['HW03Q02_tf.py'] + common, ['tensorflow', 'gym'],
+         {'ac': ('policy/v_hat ac', ['forward', 'sample'],
+                 ['apply_gradients'])}),
+    ]
+
+
+# #############################################################################
+#
+# Measures
+#
+# #############################################################################
+
+
+def steps_to_score(lengths, target):
+    '''Environment steps played until the mean length of the last
+    SCORE_WINDOW episodes reaches target, or None.'''
+
+    lengths = np.asarray(lengths)
+    if len(lengths) < SCORE_WINDOW:
+        return None
+    means = np.convolve(lengths, np.ones(SCORE_WINDOW) / SCORE_WINDOW,
+                        'valid')
+    reached = np.flatnonzero(means >= target)
+    if not len(reached):
+        return None
+
+    return int(lengths[:reached[0] + SCORE_WINDOW].sum())
+
+
+def episodes_of(folder):
+    '''Lengths and durations of the training episodes of every run, by the
+    prefix of the run (the agent), from the metrics written in folder.'''
+
+    runs = {}
+    for path in sorted(glob.glob(os.path.join(folder, '**', '*metrics.*.jsonl'),
+                                 recursive=True)):
+        for row in read(path):
+            # evaluations are not training episodes
+            if '/' not in row['cell']:
+                run = runs.setdefault(row['cell'], ([], []))
+                run[0].append(row['length'])
+                run[1].append(row['duration'])
+
+    return {cell.split('_')[0]: run for cell, run in runs.items()}
+
+
+def laps_of(folder):
+    '''Calls of every phase per run, and the durations (ns) of every lap of
+    every phase per run, from the profile and the trace written in folder.'''
+
+    with open(glob.glob(os.path.join(folder, 'data', '*profile.json'))[0]) as f:
+        profile = json.load(f)
+    with open(glob.glob(os.path.join(folder, 'data', '*trace.json'))[0]) as f:
+        events = json.load(f)['traceEvents']
+
+    durations = {}
+    for event in events:
+        durations.setdefault(event['name'], []).append(1e3 * event['dur'])
+
+    # the runs are played one after the other, so the laps of a phase are
+    # split between the runs by the number of calls of every run
+    calls, laps = {}, {}
+    offsets = dict.fromkeys(durations, 0)
+    for run in profile['runs']:
+        agent = run['name'].split('_')[0]
+        totals = np.sum(run['episode_calls'], axis=0, dtype=np.int64)
+        calls[agent] = dict(zip(profile['phases'], totals.tolist()))
+        laps[agent] = {}
+        for phase, count in calls[agent].items():
+            start = offsets.get(phase, 0)
+            laps[agent][phase] = durations.get(phase, [])[start:start + count]
+            offsets[phase] = start + count
+
+    return calls, laps
+
+
+def action_latencies(laps, phases):
+    '''Time (us) to choose every action: the sum of the laps of the action
+    phases, which are all lapped once per action.'''
+
+    phases = [phase for phase in phases if laps.get(phase)]
+    counts = {len(laps[phase]) for phase in phases}
+    if len(counts) != 1:
+        return np.zeros(0)
+
+    return np.sum([laps[phase] for phase in phases], axis=0) / 1e3
+
+
+def run_learners(argv, seed, learners, target):
+    '''Trains the learners of a case once.
+
+    Output:
+    dictionary of the measures of every learner, wall time of the process
+    and its peak memory (MB)'''
+
+    env = dict(os.environ, MPLBACKEND='Agg', CUDA_VISIBLE_DEVICES='')
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, 'data'))
+        stats_path = os.path.join(folder, 'stats.json')
+        code = WRAPPER.format(
+            folder=FOLDER, stats_path=stats_path,
+            argv=[os.path.join(FOLDER, argv[0])] + argv[1:]
+            + ['--seed', str(seed)])
+
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, '-c', code], cwd=folder,
+                                 env=env, capture_output=True, text=True)
+        wall_time = time.perf_counter() - start
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr[-2000:])
+
+        with open(stats_path) as f:
+            # kB on Linux, bytes on macOS
+            peak = json.load(f) / (2**20 if sys.platform == 'darwin'
+                                   else 2**10)
+        episodes = episodes_of(folder)
+        calls, laps = laps_of(folder)
+
+    measures = {}
+    for agent, (_, action_phases, update_phases) in learners.items():
+        lengths, durations = episodes[agent]
+        seconds = sum(durations)
+        measures[agent] = {
+            'steps_per_sec': sum(lengths) / seconds,
+            'updates_per_sec': sum(calls[agent].get(phase, 0)
+                                   for phase in update_phases) / seconds,
+            'latencies_us': action_latencies(laps[agent],
+                                             action_phases).tolist(),
+            'train_time': seconds,
+            'steps_to_score': steps_to_score(lengths, target),
+        }
+
+    return measures, wall_time, peak
+
+
+def summary(runs):
+    '''Medians of the measures of the runs of a learner.'''
+
+    latencies = np.concatenate([run['latencies_us'] for run in runs])
+    reached = [run['steps_to_score'] for run in runs
+               if run['steps_to_score'] is not None]
+
+    result = {key: float(np.median([run[key] for run in runs]))
+              for key in ['steps_per_sec', 'updates_per_sec', 'train_time',
+                          'wall_time', 'peak_rss']}
+    result.update({
+        'latency_us': {'p{}'.format(p): (float(np.percentile(latencies, p))
+                                         if len(latencies) else None)
+                       for p in PERCENTILES},
+        'steps_to_score': float(np.median(reached)) if reached else None,
+        'runs_reaching_score': len(reached),
+        'runs': len(runs),
+    })
+
+    return result
+
+
+# #############################################################################
+#
+# Main
+#
+# #############################################################################
+
+
+def main():
+    args = get_arguments()
+
+    results = {}
+    for name, argv, modules, learners in cases(args.episodes):
+        if args.cases is not None and name not in args.cases:
+            continue
+        missing = [m for m in modules if importlib.util.find_spec(m) is None]
+        if missing:
+            print('{}: skipped, {} not installed'.format(
+                name, ', '.join(missing)))
+            continue
+
+        print('{}: {}'.format(name, ' '.join(argv)))
+        runs = {agent: [] for agent in learners}
+        try:
+            for seed in range(args.runs):
+                measures, wall_time, peak = run_learners(argv, seed, learners,
+                                                         args.target)
+                for agent, measure in measures.items():
+                    measure.update(wall_time=wall_time, peak_rss=peak)
+                    runs[agent].append(measure)
+        except RuntimeError as error:
+            print('{}: FAILED to run\n{}'.format(name, error))
+            continue
+        for agent, (label, _, _) in learners.items():
+            results[label] = dict(summary(runs[agent]), case=name,
+                                  argv=argv)
+
+    print('\n{:<22}{:>9}{:>10}{:>22}{:>10}{:>12}{:>9}'.format(
+        'Learner', 'Steps/s', 'Updates/s', 'Latency p50/p90/p99',
+        'Train (s)', 'To score', 'Peak MB'))
+    for label, result in results.items():
+        latency = '/'.join('-' if v is None else '{:.0f}'.format(v)
+                           for v in result['latency_us'].values())
+        print('{:<22}{:>9.0f}{:>10.1f}{:>19} us{:>10.1f}{:>12}{:>9.0f}'.format(
+            label, result['steps_per_sec'], result['updates_per_sec'],
+            latency, result['train_time'],
+            '-' if result['steps_to_score'] is None else '{:.0f} ({}/{})'.format(
+                result['steps_to_score'], result['runs_reaching_score'],
+                result['runs']),
+            result['peak_rss']))
+    print('Steps to a mean length of {:g} over {} episodes; the peak memory of '
+          'HW03Q02 is that of the process training rf and ac.'.format(
+              args.target, SCORE_WINDOW))
+
+    if args.output is not None:
+        atomic_write(args.output, lambda f: f.write(json.dumps({
+            'machine': machine(), 'runs': args.runs,
+            'episodes': args.episodes, 'target': args.target,
+            'score_window': SCORE_WINDOW, 'learners': results},
+            indent=2).encode()))
+        print('Results saved in {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+'''Incremental persistence of the HW03Q02 sweeps.
+
+A sweep is saved in its own folder:
+
+    <folder>/config.json            arguments of the sweep
+    <folder>/cells/<cell>.npy       steps per episode of every finished run
+    <folder>/states/<cell>.pickle   last state of the unfinished runs
+
+A cell is one (agent, hidden_size, alpha, run) combination. Every file is
+written to a temporary file first and then renamed, so a crash can never
+leave a partially written cell or state behind.'''
+
+import os
+import sys
+import json
+import pickle
+import tempfile
+
+import numpy as np
+
+# arguments that may change when a sweep is resumed
+RESUME_OVERRIDES = ['resume', 'load', 'render', 'verbose', 'compile',
+                    'checkpoint_every', 'log_interval', 'profile', 'workers',
+                    'eval_every', 'eval_episodes', 'eval_mode', 'export',
+                    'record', 'threads', 'async_rollouts', 'memprof',
+                    'cache', 'cache_size']
+
+
+# #############################################################################
+#
+# Atomic writes
+#
+# #############################################################################
+
+
+def atomic_write(path, write):
+    '''Calls write(f) on a temporary file and moves it to path.'''
+
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def atomic_pickle(obj, path):
+    atomic_write(path, lambda f: pickle.dump(obj, f))
+
+
+# #############################################################################
+#
+# Run states
+#
+# #############################################################################
+
+
+def get_rng_state(rng):
+    '''State of a numpy RandomState or Generator (gym uses both,
+    depending on its version).'''
+
+    if isinstance(rng, np.random.RandomState):
+        return rng.get_state()
+    return rng.bit_generator.state
+
+
+def set_rng_state(rng, state):
+    if isinstance(rng, np.random.RandomState):
+        rng.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+
+def save_run_state(path, model, env, scores):
+    '''Saves everything needed to continue a run after the last finished
+    episode: the weights and the optimizer of the model, the scores so far
+    and the random number generators.'''
+
+    state = {
+        'model': model.state_dict(),
+        'optimizer': model.optimizer.state_dict(),
+        'scores': list(scores),
+        'numpy_rng': np.random.get_state(),
+        'env_rng': get_rng_state(env.unwrapped.np_random),
+    }
+    # not imported by the numpy backend, whose model keeps its generator
+    if 'torch' in sys.modules:
+        import torch
+
+        state['torch_rng'] = torch.get_rng_state()
+    atomic_pickle(state, path)
+
+
+def load_run_state(path, model, env):
+    '''Restores a state saved by save_run_state in model and env.
+
+    Output:
+    list of the scores of the episodes already played, or an empty list
+    if there is no saved state'''
+
+    if not os.path.exists(path):
+        return []
+
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+
+    model.load_state_dict(state['model'])
+    model.optimizer.load_state_dict(state['optimizer'])
+    if 'torch_rng' in state:
+        import torch
+
+        torch.set_rng_state(state['torch_rng'])
+    np.random.set_state(state['numpy_rng'])
+    set_rng_state(env.unwrapped.np_random, state['env_rng'])
+
+    return state['scores']
+
+
+# #############################################################################
+#
+# Sweeps
+#
+# #############################################################################
+
+
+class SweepCheckpoint():
+    '''Folder holding the finished cells and the partial runs of a sweep.'''
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(os.path.join(folder, 'cells'), exist_ok=True)
+        os.makedirs(os.path.join(folder, 'states'), exist_ok=True)
+
+    @staticmethod
+    def cell_name(agent, hidden_size, alpha, run):
+        return '{}_h{}_a{}_r{}'.format(agent, hidden_size, alpha, run)
+
+    def save_config(self, config):
+        path = os.path.join(self.folder, 'config.json')
+        atomic_write(path, lambda f: f.write(
+            json.dumps(config, indent=2).encode()))
+
+    def load_config(self):
+        with open(os.path.join(self.folder, 'config.json')) as f:
+            return json.load(f)
+
+    def restore_args(self, args):
+        '''Replaces the arguments of the sweep in args, except those
+        that may change between sessions (see RESUME_OVERRIDES).'''
+
+        for key, value in self.load_config().items():
+            if key not in RESUME_OVERRIDES:
+                setattr(args, key, value)
+
+    def cell_path(self, *cell):
+        return os.path.join(self.folder, 'cells',
+                            self.cell_name(*cell) + '.npy')
+
+    def state_path(self, *cell):
+        return os.path.join(self.folder, 'states',
+                            self.cell_name(*cell) + '.pickle')
+
+    def is_done(self, *cell):
+        return os.path.exists(self.cell_path(*cell))
+
+    def save_cell(self, scores, *cell):
+        '''Saves the scores of a finished run and drops its partial state.'''
+
+        atomic_write(self.cell_path(*cell),
+                     lambda f: np.save(f, np.asarray(scores)))
+        if os.path.exists(self.state_path(*cell)):
+            os.remove(self.state_path(*cell))
+
+    def load_cell(self, *cell):
+        return np.load(self.cell_path(*cell))
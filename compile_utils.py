@@ -0,0 +1,135 @@
+'''Optional compiled execution for the small torch networks.
+
+The networks used in the CartPole experiments are tiny, so most of the time
+of a forward pass is spent in Python and in the torch dispatcher rather than
+in the arithmetic. Compiling the forward pass and the loss removes most of
+that overhead.
+
+Compilation is opt-in. The functions compiled here take the parameters as
+arguments, so a single compiled function is shared by every model built in
+the process and compilation is paid once, during the warm-up.
+
+torch is only imported when a function is compiled, so that the argument
+parsers can use COMPILE_MODES without paying for it.'''
+
+import time
+import warnings
+
+COMPILE_MODES = ['eager', 'script', 'inductor']
+
+# compiled functions, keyed by (function, requested mode)
+_compiled = {}
+
+
+# #############################################################################
+#
+# Compilation
+#
+# #############################################################################
+
+
+def _compile(fn, mode, dynamic):
+    import torch
+
+    if mode == 'inductor':
+        return torch.compile(fn, dynamic=dynamic)
+    if mode == 'script':
+        return torch.jit.script(fn)
+    return fn
+
+
+def _backward(output):
+    # the backward graph of torch.compile is only built on the
+    # first backward call, which is part of the warm-up as well
+    import torch
+
+    outputs = output if isinstance(output, (tuple, list)) else [output]
+    total = sum(o.sum() for o in outputs if o.requires_grad)
+    if torch.is_tensor(total):
+        total.backward()
+
+
+def _max_abs_diff(a, b):
+    if isinstance(a, (tuple, list)):
+        return max(_max_abs_diff(x, y) for x, y in zip(a, b))
+    return (a.detach() - b.detach()).abs().max().item()
+
+
+def compile_function(fn, mode, example_inputs, dynamic=False, atol=1e-5):
+    '''Compiles fn with the requested mode and warms it up.
+
+    Each entry of example_inputs is a tuple of arguments for fn. The
+    compiled function is called once per entry, forward and backward (which
+    triggers the actual compilation), and its output is compared to the
+    eager output. If the compilation fails or the outputs differ by more
+    than atol, the next cheaper mode is tried, down to eager execution.
+
+    Input:
+    fn             : function to compile, taking and returning tensors
+    mode           : one of COMPILE_MODES
+    example_inputs : list of argument tuples used for warm-up and parity
+    dynamic        : whether the input shapes change between calls
+
+    Output:
+    the compiled function and the mode actually used'''
+
+    key = (fn, mode)
+    if key in _compiled:
+        return _compiled[key]
+
+    modes = COMPILE_MODES[:COMPILE_MODES.index(mode) + 1][::-1]
+    for candidate in modes:
+        if candidate == 'eager':
+            break
+        try:
+            compiled = _compile(fn, candidate, dynamic)
+            diff = 0
+            for inputs in example_inputs:
+                output = compiled(*inputs)
+                diff = max(diff, _max_abs_diff(fn(*inputs), output))
+                _backward(output)
+        except Exception as error:
+            warnings.warn('Could not compile {} with {}: {}'.format(
+                fn.__name__, candidate, error))
+            continue
+        if diff > atol:
+            warnings.warn('Compiled {} ({}) differs from eager by {:.2e}, '
+                          'not using it.'.format(fn.__name__, candidate, diff))
+            continue
+        _compiled[key] = compiled, candidate
+        return _compiled[key]
+
+    _compiled[key] = fn, 'eager'
+    return _compiled[key]
+
+
+# #############################################################################
+#
+# Latency
+#
+# #############################################################################
+
+
+def latency(fn, inputs, repeats=1000):
+    '''Returns the average time in seconds of a call fn(*inputs).
+    Autograd is left enabled, as it is in the acting step.'''
+
+    # one call outside the timer so that lazy initialisations
+    # are not measured
+    fn(*inputs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(*inputs)
+    end = time.perf_counter()
+
+    return (end - start) / repeats
+
+
+def report_latency(name, eager_fn, eager_inputs, compiled_fn, compiled_inputs,
+                   mode):
+    '''Prints the per-call latency of the eager and compiled versions.'''
+
+    t_eager = latency(eager_fn, eager_inputs)
+    t_compiled = latency(compiled_fn, compiled_inputs)
+    print('{}: eager {:.1f} us/call, {} {:.1f} us/call ({:.2f}x)'.format(
+        name, 1e6 * t_eager, mode, 1e6 * t_compiled, t_eager / t_compiled))
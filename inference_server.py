@@ -0,0 +1,452 @@
+'''Local inference server of the exported policies (see policy_export.py).
+
+Clients connect with TCP on localhost or with a Unix socket. The server
+first sends the input and output dimensions (two uint32), then answers
+every state the client sends (input_dim float32) with an action (int32).
+Concurrent requests are grouped in micro-batches: the first request of a
+batch waits at most --max_wait_ms for others, up to --max_batch requests,
+and the whole batch goes through one forward pass. As a client waits for
+its action before sending its next state, a batch holding a request of
+every connected client does not wait any longer.
+
+    python inference_server.py serve data/models/rf_h32_a0.01_r0.npz
+    python inference_server.py bench --clients 16 --requests 2000
+
+The server prints the latency (p50, p99) of the requests it answered, its
+throughput and the average batch size every --report_interval seconds.
+bench is the load generator: every client thread sends its requests one
+after the other, and the latencies seen by the clients are reported.'''
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+
+import numpy as np
+
+from policy_export import ExportedPolicy
+
+HOST = '127.0.0.1'
+PORT = 5767
+MAX_BATCH = 32
+MAX_WAIT_MS = 1.0
+REPORT_INTERVAL = 10.0
+CLIENTS = 8
+REQUESTS = 1000
+
+HEADER = struct.Struct('<II')
+ACTION = struct.Struct('<i')
+
+
+# #############################################################################
+#
+# Parser
+#
+# #############################################################################
+
+
+def add_address_arguments(parser):
+    parser.add_argument('--host', type=str, default=HOST,
+                        help='Address of the TCP socket. Default: ' + HOST)
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='Port of the TCP socket. Default: ' + str(PORT))
+    parser.add_argument('--unix', type=str, default=None,
+                        help='Path of a Unix socket, used instead of TCP.')
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description='Serves an exported policy with micro-batching, or '
+        'benchmarks a running server.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Serves an exported policy.')
+    serve.add_argument('model', type=str,
+                       help='Policy saved by policy_export.export_policy.')
+    add_address_arguments(serve)
+    serve.add_argument('--max_batch', type=int, default=MAX_BATCH,
+                       help='Maximum number of requests of a forward pass. '
+                       'Default: ' + str(MAX_BATCH))
+    serve.add_argument('--max_wait_ms', type=float, default=MAX_WAIT_MS,
+                       help='Maximum time (ms) a request waits for others '
+                       'to fill its batch. Default: ' + str(MAX_WAIT_MS))
+    serve.add_argument('--stochastic', action='store_true',
+                       help='If this flag is set, the actions are sampled '
+                       'instead of being the most probable ones.')
+    serve.add_argument('--seed', type=int, default=None,
+                       help='Seed of the sampled actions.')
+    serve.add_argument('--report_interval', type=float,
+                       default=REPORT_INTERVAL,
+                       help='Seconds between two reports. Default: '
+                       + str(REPORT_INTERVAL))
+
+    bench = commands.add_parser('bench', help='Load generator.')
+    add_address_arguments(bench)
+    bench.add_argument('-c', '--clients', type=int, default=CLIENTS,
+                       help='Number of concurrent clients. Default: '
+                       + str(CLIENTS))
+    bench.add_argument('-n', '--requests', type=int, default=REQUESTS,
+                       help='Number of requests of every client. Default: '
+                       + str(REQUESTS))
+    bench.add_argument('--env', type=str, default=None,
+                       help='If set, every client plays episodes of this gym '
+                       'environment with the actions of the server, instead '
+                       'of sending random states.')
+    bench.add_argument('--seed', type=int, default=None,
+                       help='Seed of the states of the clients.')
+    bench.add_argument('-o', '--output', type=str, default=None,
+                       help='JSON file where the results are saved.')
+
+    return parser.parse_args()
+
+
+# #############################################################################
+#
+# Statistics
+#
+# #############################################################################
+
+
+def latency_summary(latencies, elapsed):
+    '''Percentiles (ms) of latencies (s) and throughput over elapsed
+    seconds.'''
+
+    latencies = np.asarray(latencies) * 1e3
+    if len(latencies) == 0:
+        return {'requests': 0, 'throughput': 0.}
+
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / max(elapsed, 1e-12),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+def format_summary(summary):
+    if summary['requests'] == 0:
+        return 'no requests'
+
+    return ('{requests} requests\t{throughput:.0f} req/s\t'
+            'p50 {p50_ms:.3f} ms\tp99 {p99_ms:.3f} ms\t'
+            'max {max_ms:.3f} ms').format(**summary)
+
+
+# #############################################################################
+#
+# Server
+#
+# #############################################################################
+
+
+class Request():
+    __slots__ = ['state', 'action', 'start', 'done']
+
+    def __init__(self, state):
+        self.state = state
+        self.action = None
+        self.start = time.perf_counter()
+        self.done = threading.Event()
+
+
+class MicroBatcher():
+    '''Groups the requests of the connection threads and answers them with
+    one forward pass per batch, in a thread of its own.
+
+    Input:
+    policy    : ExportedPolicy
+    max_batch : maximum number of requests of a batch
+    max_wait  : maximum time (s) the first request of a batch waits
+    greedy    : if False, the actions are sampled
+    seed      : seed of the sampled actions'''
+
+    def __init__(self, policy, max_batch, max_wait, greedy=True, seed=None):
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.greedy = greedy
+        self.rng = np.random.default_rng(seed)
+
+        self.requests = queue.Queue()
+        self.clients = 0
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.batches = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def connect(self, n=1):
+        '''Counts the connected clients, n = -1 when one leaves.'''
+
+        with self.lock:
+            self.clients += n
+
+    def submit(self, state):
+        '''Action of state, blocks until its batch is done.'''
+
+        request = Request(state)
+        self.requests.put(request)
+        request.done.wait()
+
+        return request.action
+
+    def _batch(self):
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        # every client has at most one request in flight
+        size = max(min(self.max_batch, self.clients), 1)
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=timeout)
+                             if timeout > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            batch = self._batch()
+            if not batch:
+                continue
+
+            states = np.stack([request.state for request in batch])
+            actions = self.policy.act(states, self.greedy, self.rng).tolist()
+
+            end = time.perf_counter()
+            for request, action in zip(batch, actions):
+                request.action = action
+                request.done.set()
+            with self.lock:
+                self.latencies.extend(end - request.start for request in batch)
+                self.batches.append(len(batch))
+
+    def report(self, elapsed):
+        '''Summary of the requests answered since the last report.'''
+
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+            batches, self.batches = self.batches, []
+
+        summary = latency_summary(latencies, elapsed)
+        summary['mean_batch'] = float(np.mean(batches)) if batches else 0.
+
+        return summary
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def recv_exactly(sock, size):
+    '''Reads size bytes, or returns None if the connection is closed.'''
+
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+
+    return bytes(data)
+
+
+class Handler(socketserver.BaseRequestHandler):
+    '''Connection of one client, answered in a thread of its own.'''
+
+    def handle(self):
+        batcher = self.server.batcher
+        policy = batcher.policy
+        if self.server.address_family != socket.AF_UNIX:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.request.sendall(HEADER.pack(policy.input_dim, policy.output_dim))
+        size = 4 * policy.input_dim
+        batcher.connect()
+        try:
+            while True:
+                data = recv_exactly(self.request, size)
+                if data is None:
+                    return
+                action = batcher.submit(np.frombuffer(data, dtype=np.float32))
+                self.request.sendall(ACTION.pack(action))
+        finally:
+            batcher.connect(-1)
+
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # clients of a benchmark connect at once
+    request_queue_size = 128
+
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(args):
+    policy = ExportedPolicy(args.model)
+    batcher = MicroBatcher(policy, args.max_batch, args.max_wait_ms / 1e3,
+                           not args.stochastic, args.seed)
+
+    if args.unix is not None:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        server = UnixServer(args.unix, Handler)
+        address = args.unix
+    else:
+        server = TCPServer((args.host, args.port), Handler)
+        address = '{}:{}'.format(args.host, args.port)
+    server.batcher = batcher
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print('Serving {} on {}, max batch {}, max wait {} ms'.format(
+        args.model, address, args.max_batch, args.max_wait_ms))
+
+    # stops on Ctrl-C or on SIGTERM, with a last report
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+
+    last = time.perf_counter()
+    try:
+        while True:
+            done = stopped.wait(args.report_interval)
+            now = time.perf_counter()
+            summary = batcher.report(now - last)
+            last = now
+            if summary['requests']:
+                print('{}\tmean batch {:.1f}'.format(
+                    format_summary(summary), summary['mean_batch']),
+                    flush=True)
+            if done:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+        if args.unix is not None and os.path.exists(args.unix):
+            os.remove(args.unix)
+
+
+# #############################################################################
+#
+# Load generator
+#
+# #############################################################################
+
+
+def connect(args):
+    '''Connected socket and the (input_dim, output_dim) of the policy.'''
+
+    if args.unix is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(args.unix)
+    else:
+        sock = socket.create_connection((args.host, args.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return sock, HEADER.unpack(recv_exactly(sock, HEADER.size))
+
+
+def client(args, seed, latencies, barrier):
+    '''Sends args.requests requests and appends their latencies.'''
+
+    try:
+        sock, (input_dim, _) = connect(args)
+        rng = np.random.default_rng(seed)
+        if args.env is not None:
+            import gym
+            env = gym.make(args.env)
+            env.seed(int(rng.integers(2**31)))
+            state = env.reset()
+    except BaseException:
+        # the other clients must not wait for this one
+        barrier.abort()
+        raise
+
+    barrier.wait()
+    with sock:
+        for _ in range(args.requests):
+            if args.env is None:
+                state = rng.normal(scale=0.5, size=input_dim)
+            data = np.asarray(state, dtype=np.float32).tobytes()
+
+            start = time.perf_counter()
+            sock.sendall(data)
+            action, = ACTION.unpack(recv_exactly(sock, ACTION.size))
+            latencies.append(time.perf_counter() - start)
+
+            if args.env is not None:
+                state, _, done, _ = env.step(action)
+                if done:
+                    state = env.reset()
+
+
+def bench(args):
+    seeds = np.random.SeedSequence(args.seed).generate_state(args.clients)
+    latencies = [[] for _ in range(args.clients)]
+    # the clients start together once they are all connected
+    barrier = threading.Barrier(args.clients + 1)
+    threads = [threading.Thread(target=client,
+                                args=(args, int(seed), lat, barrier))
+               for seed, lat in zip(seeds, latencies)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = latency_summary(np.concatenate(latencies), elapsed)
+    summary['clients'] = args.clients
+    print('{} clients\t{}'.format(args.clients, format_summary(summary)))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    return summary
+
+
+# #############################################################################
+#
+# Main
+#
+# #############################################################################
+
+
+def main():
+    args = get_arguments()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        bench(args)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit()
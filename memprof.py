@@ -0,0 +1,345 @@
+'''Opt-in memory instrumentation of the training loops (see --memprof).
+
+MemoryProfiler is a Profiler (profiler.py) that also follows the memory,
+so the loops need nothing more than their laps:
+
+    lap          the memory allocated by Python and numpy (tracemalloc)
+                 since the previous lap is added to the phase
+    end_episode  the traced memory and the resident memory (RSS) of the
+                 process are recorded
+    end_run      the memory allocated by every line of code, from a
+                 tracemalloc snapshot, is compared with the end of the
+                 previous run, and the largest growths are kept with the
+                 file and the line that allocated them, together with the
+                 peaks of the run
+
+The report gives the net allocation of every phase, the growth of every
+run (whose name starts with its agent, e.g. ac_h32_a0.01_r0) and of
+every agent, and flags the runs whose memory grows across episodes: more
+than GROWTH_SHARE of the episodes end with more memory than the previous
+one, and the run grows by more than GROWTH_BYTES (RSS_GROWTH_BYTES for
+the RSS). Growth from one run to the next of a sweep is flagged the same
+way. The memory of the profiler itself is left out.
+
+tracemalloc does not see the tensors of torch and TensorFlow on the CPU,
+nor the graphs of autograd: they show in the RSS. The statistics of the
+CUDA allocator of torch, and of the GPU memory of TensorFlow, are added
+when they are used. tracemalloc slows Python down, so the times of a
+memory profile are not comparable with those of --profile.'''
+
+import gc
+import os
+import sys
+import json
+import heapq
+import resource
+import tracemalloc
+
+import numpy as np
+
+import profiler
+from profiler import Profiler
+
+# frames kept per allocation by tracemalloc
+FRAMES = 1
+TOP_SITES = 5
+# episodes at the start of a run that are not tested for growth, while the
+# buffers and the optimizer states are allocated
+WARMUP_SHARE = 0.1
+MIN_EPISODES = 10
+MIN_RUNS = 5
+GROWTH_SHARE = 0.8
+# the RSS grows by pages and by arenas of the allocator
+GROWTH_BYTES = 2**16
+RSS_GROWTH_BYTES = 2**22
+MB = 2**20
+
+
+def rss():
+    '''Resident memory of the process in bytes, or its peak where the
+    current one cannot be read.'''
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    '''Peak resident memory of the process in bytes.'''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def framework_memory():
+    '''Allocator statistics of torch (CUDA) and TensorFlow (GPU) when they
+    are imported and use a GPU, in bytes.'''
+
+    stats = {}
+    if 'torch' in sys.modules:
+        import torch
+
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            stats['torch_cuda_allocated'] = torch.cuda.memory_allocated()
+            stats['torch_cuda_peak'] = torch.cuda.max_memory_allocated()
+            stats['torch_cuda_reserved'] = torch.cuda.memory_reserved()
+            torch.cuda.reset_peak_memory_stats()
+    if 'tensorflow' in sys.modules:
+        import tensorflow as tf
+
+        if tf.config.list_logical_devices('GPU'):
+            info = tf.config.experimental.get_memory_info('GPU:0')
+            stats['tf_gpu_allocated'] = info['current']
+            stats['tf_gpu_peak'] = info['peak']
+
+    return stats
+
+
+def monotonic_growth(series, min_length=MIN_EPISODES,
+                     min_bytes=GROWTH_BYTES):
+    '''Whether series grows steadily: more than GROWTH_SHARE of its steps
+    increase, by more than min_bytes in total, after the first
+    WARMUP_SHARE of it.'''
+
+    series = np.asarray(series, dtype=np.float64)
+    series = series[int(WARMUP_SHARE * len(series)):]
+    if len(series) < min_length:
+        return False
+    diffs = np.diff(series)
+
+    return bool(np.mean(diffs > 0) > GROWTH_SHARE
+                and series[-1] - series[0] > min_bytes)
+
+
+def growth_per_episode(series):
+    '''Slope of the least squares line of series, in bytes per episode.'''
+
+    if len(series) < 2:
+        return 0.
+
+    return float(np.polyfit(np.arange(len(series)), series, 1)[0])
+
+
+class MemoryProfiler(Profiler):
+    '''Input:
+    timing : if True, the times are exported as with --profile, with the
+             Chrome trace'''
+
+    def __init__(self, timing=False):
+        super().__init__(trace=timing)
+        self.timing = timing
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(FRAMES)
+        # net and positive allocations of every phase, in bytes
+        self.net = []
+        self.allocated = []
+        self.last_traced = tracemalloc.get_traced_memory()[0]
+        # traced memory and RSS of the profiler itself, left out of the
+        # episodes and of the runs
+        self.own = 0
+        self.own_rss = 0
+
+        # (traced, rss) at the end of the episodes of the current run
+        self.episode_memory = []
+        self.memory_runs = []
+        self.sites = self.site_memory()
+
+    @staticmethod
+    def site_memory():
+        '''Bytes and blocks allocated by every line of code, except those
+        of the profilers. Only these totals are kept: a whole snapshot
+        would add tens of MB to the RSS for every run.'''
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, module.__file__)
+            for module in [tracemalloc, profiler, sys.modules[__name__]]])
+
+        return {'{}:{}'.format(stat.traceback[0].filename,
+                               stat.traceback[0].lineno):
+                (stat.size, stat.count)
+                for stat in snapshot.statistics('lineno')}
+
+    def lap(self, phase, start):
+        super().lap(phase, start)
+
+        traced = tracemalloc.get_traced_memory()[0]
+        while len(self.net) < len(self.phases):
+            self.net.append(0)
+            self.allocated.append(0)
+        idx = self.phase_ids[phase]
+        delta = traced - self.last_traced
+        self.net[idx] += delta
+        self.allocated[idx] += max(delta, 0)
+        self.last_traced = traced
+
+        # the time spent measuring the memory is not part of the next phase
+        return self.now()
+
+    def end_episode(self):
+        traced = tracemalloc.get_traced_memory()[0]
+        super().end_episode()
+        self.episode_memory.append((traced - self.own, rss() - self.own_rss))
+        self.last_traced = tracemalloc.get_traced_memory()[0]
+        self.own += self.last_traced - traced
+
+    def end_run(self, name):
+        '''Aggregates the memory of the run that just finished, as well as
+        its times.'''
+
+        if any(self.episode_calls):
+            self.end_episode()
+        # the garbage of the run is the run's, that of the profiler is not
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0]
+        rss_start = rss()
+        super().end_run(name)
+
+        sites = self.site_memory()
+        growth = heapq.nlargest(
+            TOP_SITES, ((size - self.sites.get(site, (0, 0))[0],
+                         count - self.sites.get(site, (0, 0))[1], site)
+                        for site, (size, count) in sites.items()))
+        self.sites = sites
+
+        memory = np.array(self.episode_memory, dtype=np.int64).reshape(-1, 2)
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        self.memory_runs.append({
+            'name': name,
+            'agent': name.split('_')[0],
+            'episode_traced': memory[:, 0].tolist(),
+            'episode_rss': memory[:, 1].tolist(),
+            'traced_end': traced - self.own,
+            'rss_end': rss_start - self.own_rss,
+            'traced_peak': traced_peak,
+            'rss_peak': (int(memory[:, 1].max()) if len(memory)
+                         else rss_start - self.own_rss),
+            'process_rss_peak': peak_rss(),
+            'framework': framework_memory(),
+            'top_sites': [{'site': site, 'size_diff': size,
+                           'count_diff': count}
+                          for size, count, site in growth
+                          if size > 0],
+            'traced_growth': growth_per_episode(memory[:, 0]),
+            'rss_growth': growth_per_episode(memory[:, 1]),
+            'traced_monotonic': monotonic_growth(memory[:, 0]),
+            'rss_monotonic': monotonic_growth(memory[:, 1],
+                                              min_bytes=RSS_GROWTH_BYTES),
+        })
+        self.episode_memory = []
+        gc.collect()
+        self.last_traced = tracemalloc.get_traced_memory()[0]
+        self.own += self.last_traced - traced
+        self.own_rss += rss() - rss_start
+
+    # #########################################################################
+    # Exports
+    # #########################################################################
+
+    def phase_memory(self):
+        '''Allocations of every phase, as a list of dictionaries.'''
+
+        _, calls = self.totals()
+
+        return [{
+            'phase': phase,
+            'calls': int(calls[idx]),
+            'net_bytes': int(self.net[idx]) if idx < len(self.net) else 0,
+            'allocated_bytes': (int(self.allocated[idx])
+                                if idx < len(self.allocated) else 0),
+        } for idx, phase in enumerate(self.phases)]
+
+    def agents(self):
+        '''Growth of the traced memory and of the RSS of every agent, summed
+        over its runs, and the number of its runs flagged.'''
+
+        agents = {}
+        for run in self.memory_runs:
+            agent = agents.setdefault(run['agent'], {
+                'runs': 0, 'traced_growth': 0., 'rss_growth': 0.,
+                'flagged': 0})
+            agent['runs'] += 1
+            agent['traced_growth'] += run['traced_growth'] * len(
+                run['episode_traced'])
+            agent['rss_growth'] += run['rss_growth'] * len(run['episode_rss'])
+            agent['flagged'] += run['traced_monotonic'] or run['rss_monotonic']
+
+        return agents
+
+    def across_runs(self):
+        '''Whether the traced memory and the RSS at the end of the runs grow
+        from one run to the next.'''
+
+        return {
+            'traced_monotonic': monotonic_growth(
+                [run['traced_end'] for run in self.memory_runs], MIN_RUNS),
+            'rss_monotonic': monotonic_growth(
+                [run['rss_end'] for run in self.memory_runs], MIN_RUNS,
+                RSS_GROWTH_BYTES),
+        }
+
+    def print_memory(self):
+        print('{:<16}{:>12}{:>14}{:>16}'.format(
+            'Phase', 'Calls', 'Net (MB)', 'Allocated (MB)'))
+        for row in sorted(self.phase_memory(),
+                          key=lambda r: -r['allocated_bytes']):
+            print('{:<16}{:>12}{:>14.3f}{:>16.3f}'.format(
+                row['phase'], row['calls'], row['net_bytes'] / MB,
+                row['allocated_bytes'] / MB))
+
+        for run in self.memory_runs:
+            flags = [label for label, key in [('traced', 'traced_monotonic'),
+                                              ('RSS', 'rss_monotonic')]
+                     if run[key]]
+            print('Run {}: {} episodes, traced {:.1f} MB (peak {:.1f}), '
+                  '{:+.1f} kB/episode, RSS {:.1f} MB (peak {:.1f}), '
+                  '{:+.1f} kB/episode{}'.format(
+                      run['name'], len(run['episode_traced']),
+                      run['traced_end'] / MB, run['traced_peak'] / MB,
+                      run['traced_growth'] / 1024, run['rss_end'] / MB,
+                      run['rss_peak'] / MB, run['rss_growth'] / 1024,
+                      '  GROWING ({})'.format(', '.join(flags))
+                      if flags else ''))
+            for name, value in run['framework'].items():
+                print('  {}: {:.1f} MB'.format(name, value / MB))
+            for site in run['top_sites']:
+                print('  {:+10.1f} kB {:+8} blocks  {}'.format(
+                    site['size_diff'] / 1024, site['count_diff'],
+                    site['site']))
+
+        for agent, total in self.agents().items():
+            print('Agent {}: {} runs, traced {:+.1f} MB, RSS {:+.1f} MB over '
+                  'the episodes, {} runs growing'.format(
+                      agent, total['runs'], total['traced_growth'] / MB,
+                      total['rss_growth'] / MB, total['flagged']))
+        across = self.across_runs()
+        if across['traced_monotonic'] or across['rss_monotonic']:
+            print('Memory GROWING from run to run (traced: {}, RSS: {})'.format(
+                across['traced_monotonic'], across['rss_monotonic']))
+        print('Peak RSS of the process: {:.1f} MB'.format(peak_rss() / MB))
+
+    def save_memory(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'phases': self.phase_memory(),
+                'runs': self.memory_runs,
+                'agents': self.agents(),
+                'across_runs': self.across_runs(),
+                'process_rss_peak': peak_rss(),
+            }, f)
+
+    def export(self, prefix):
+        '''Prints the memory report and saves <prefix>memory.json, and the
+        times as Profiler.export if timing is set.'''
+
+        if self.timing:
+            super().export(prefix)
+        self.print_memory()
+        self.save_memory(prefix + 'memory.json')
+        print('Memory profile saved to {}memory.json'.format(prefix))
@@ -0,0 +1,204 @@
+'''Low-overhead stream of per-episode metrics.
+
+The training loops call MetricsRecorder.record once per episode, which
+only writes one row in a preallocated ring buffer. A background thread
+moves the rows to a line-delimited JSON file and prints a short summary
+at most every console_interval seconds.
+
+Every process writes its own file (the pid is part of the name), so
+parallel workers never share a file. The files of a sweep can be merged
+with merge, or from the command line:
+
+    python metrics.py merged.jsonl data/<sweep>/metrics.*.jsonl'''
+
+import os
+import sys
+import json
+import time
+import threading
+
+import numpy as np
+
+EPISODE_DTYPE = np.dtype([
+    ('cell', 'i4'),
+    ('episode', 'i4'),
+    ('length', 'i4'),
+    ('loss', 'f4'),
+    ('entropy', 'f4'),
+    ('duration', 'f8'),
+    ('time', 'f8'),
+])
+
+CAPACITY = 4096
+FLUSH_INTERVAL = 1.0
+CONSOLE_INTERVAL = 10.0
+
+
+# #############################################################################
+#
+# Recorder
+#
+# #############################################################################
+
+
+class MetricsRecorder():
+    '''Ring buffer of per-episode metrics flushed by a background thread.
+
+    Input:
+    path             : line-delimited JSON file, or None to only print the
+                       console summaries
+    capacity         : number of rows of the ring buffer
+    flush_interval   : seconds between two flushes of the buffer
+    console_interval : minimum number of seconds between two summaries'''
+
+    def __init__(self, path, capacity=CAPACITY, flush_interval=FLUSH_INTERVAL,
+                 console_interval=CONSOLE_INTERVAL):
+        self.buffer = np.zeros(capacity, dtype=EPISODE_DTYPE)
+        self.capacity = capacity
+        # rows [tail, head) are not flushed yet
+        self.head = 0
+        self.tail = 0
+
+        self.cells = []
+        self.cell_ids = {}
+
+        self.file = open(path, 'a') if path is not None else None
+        self.flush_interval = flush_interval
+        self.console_interval = console_interval
+        self.last_console = time.time()
+        self.summary = {}
+
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def cell(self, name):
+        '''Identifier of a cell (e.g. one run of a sweep), to be passed to
+        record.'''
+
+        if name not in self.cell_ids:
+            self.cell_ids[name] = len(self.cells)
+            self.cells.append(name)
+
+        return self.cell_ids[name]
+
+    def record(self, cell, episode, length, loss=np.nan, entropy=np.nan,
+               duration=np.nan):
+        '''Adds the metrics of one episode. This is the only call made
+        from the training loop.'''
+
+        if self.head - self.tail >= self.capacity:
+            # the background thread is late, flush from here
+            self.flush()
+
+        self.buffer[self.head % self.capacity] = (
+            cell, episode, length, loss, entropy, duration, time.time())
+        self.head += 1
+
+    def _rows(self):
+        head = self.head
+        idx = np.arange(self.tail, head) % self.capacity
+        rows = self.buffer[idx]
+        self.tail = head
+
+        return rows
+
+    def flush(self):
+        with self.lock:
+            rows = self._rows()
+            if len(rows) == 0:
+                return
+
+            if self.file is not None:
+                lines = []
+                for row in rows:
+                    line = {name: row[name].item() for name in EPISODE_DTYPE.names}
+                    line['cell'] = self.cells[line['cell']]
+                    lines.append(json.dumps(line) + '\n')
+                self.file.write(''.join(lines))
+                self.file.flush()
+
+            self._update_summary(rows)
+
+    def _update_summary(self, rows):
+        for cell in np.unique(rows['cell']):
+            cell_rows = rows[rows['cell'] == cell]
+            summary = self.summary.setdefault(cell, [0, 0, 0.0, 0.0])
+            summary[0] = cell_rows['episode'][-1]
+            summary[1] += len(cell_rows)
+            summary[2] += cell_rows['length'].sum()
+            summary[3] += np.nansum(cell_rows['duration'])
+
+    def print_summary(self):
+        '''Prints, for every cell updated since the last summary, the last
+        episode, and the average length and the rate of the episodes since
+        then. The rate comes from the durations of the episodes of the cell,
+        '-' when they were not recorded.'''
+
+        for cell, (episode, count, total, seconds) in sorted(
+                self.summary.items()):
+            print('{}\tEpisode {}\tAverage length: {:.2f}\t'
+                  'Episodes/s: {}'.format(
+                      self.cells[cell], episode, total / count,
+                      '{:.1f}'.format(count / seconds) if seconds > 0
+                      else '-'))
+        self.summary = {}
+        self.last_console = time.time()
+
+    def _loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+            if time.time() - self.last_console >= self.console_interval:
+                self.print_summary()
+
+    def close(self):
+        '''Stops the background thread and writes the remaining rows.'''
+
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+        if self.summary:
+            self.print_summary()
+        if self.file is not None:
+            self.file.close()
+
+
+# #############################################################################
+#
+# Merging
+#
+# #############################################################################
+
+
+def read(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def merge(paths, out_path):
+    '''Merges the files of several workers, sorted by cell and episode.'''
+
+    rows = []
+    for path in paths:
+        rows.extend(read(path))
+    rows.sort(key=lambda row: (row['cell'], row['episode']))
+
+    with open(out_path, 'w') as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+
+    return len(rows)
+
+
+def metrics_path(folder, prefix=''):
+    '''File of the current process in folder.'''
+
+    return os.path.join(folder, '{}metrics.{}.jsonl'.format(prefix, os.getpid()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python metrics.py OUTPUT INPUT [INPUT ...]')
+        sys.exit(1)
+    print('Merged {} rows'.format(merge(sys.argv[2:], sys.argv[1])))
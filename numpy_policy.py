@@ -0,0 +1,356 @@
+'''Policy of the HW03Q02 agents written with numpy only (see --backend).
+
+For CartPole-sized networks, the time of a step with torch is spent in
+the framework (tensor creation, dispatch, autograd bookkeeping) rather
+than in the arithmetic. NumpyPolicy computes the same network, a ReLU
+hidden layer followed by a softmax policy head and a value head, with
+hand-written forward and backward passes:
+
+    h      = relu(hidden_w x + hidden_b)
+    probs  = softmax(action_w h + action_b)
+    value  = value_w h + value_b
+
+The parameters are views of one flat float32 array, and so are their
+gradients, so the Adam update is a few operations on whole arrays. The
+losses, the initialisation and Adam are those of Policy (policy.py), so
+the learning curves are the same in distribution; the random numbers
+are not the same as torch, so a seeded run does not give the same steps.
+
+This module only imports numpy: a sweep with --backend numpy never
+imports torch.'''
+
+import numpy as np
+
+from profiler import NULL_PROFILER
+
+eps = np.finfo(np.float32).eps.item()
+# defaults of torch.optim.Adam
+BETAS = (0.9, 0.999)
+ADAM_EPS = 1e-8
+
+
+# #############################################################################
+#
+# Rewards
+#
+# #############################################################################
+
+
+def discount_rewards(rewards, gamma):
+    '''Discounted return of every step, as an array.'''
+
+    returns = np.zeros(len(rewards))
+    R = 0.
+    for t in reversed(range(len(rewards))):
+        R = rewards[t] + gamma * R
+        returns[t] = R
+
+    return returns
+
+
+def smooth_l1(diff):
+    '''Smooth L1 loss of every element of diff, and its gradient.'''
+
+    absolute = np.abs(diff)
+    loss = np.where(absolute < 1, 0.5 * diff ** 2, absolute - 0.5)
+
+    return loss, np.clip(diff, -1, 1)
+
+
+# #############################################################################
+#
+# Optimizer
+#
+# #############################################################################
+
+
+class Adam():
+    '''Adam on a flat parameter array, updated in place, as
+    torch.optim.Adam without weight decay.
+
+    Input:
+    params : flat float32 array of the parameters
+    lr     : learning rate'''
+
+    def __init__(self, params, lr, betas=BETAS, eps=ADAM_EPS):
+        self.params = params
+        self.lr = lr
+        self.betas = betas
+        self.eps = eps
+        self.m = np.zeros_like(params)
+        self.v = np.zeros_like(params)
+        self.t = 0
+        # preallocated intermediate
+        self.denom = np.zeros_like(params)
+
+    def step(self, grads):
+        '''Updates the parameters with their gradients grads.'''
+
+        beta1, beta2 = self.betas
+        self.t += 1
+
+        self.m *= beta1
+        self.m += (1 - beta1) * grads
+        self.v *= beta2
+        self.v += (1 - beta2) * grads * grads
+
+        bias_correction1 = 1 - beta1 ** self.t
+        bias_correction2 = 1 - beta2 ** self.t
+        np.sqrt(self.v, out=self.denom)
+        self.denom /= np.sqrt(bias_correction2)
+        self.denom += self.eps
+        self.params -= (self.lr / bias_correction1) * self.m / self.denom
+
+    def state_dict(self):
+        return {'m': self.m.copy(), 'v': self.v.copy(), 't': self.t}
+
+    def load_state_dict(self, state):
+        self.m[:] = state['m']
+        self.v[:] = state['v']
+        self.t = state['t']
+
+
+# #############################################################################
+#
+# Model
+#
+# #############################################################################
+
+
+class NumpyPolicy():
+    '''Same interface as Policy (policy.py), for one_run.
+
+    Input:
+    seed : (optional) seed of the initialisation and of the sampling of
+           the actions'''
+
+    def __init__(self, agent, input_dim, output_dim, hidden_size, alpha,
+                 gamma, seed=None):
+        shapes = [('hidden_w', (hidden_size, input_dim)),
+                  ('hidden_b', (hidden_size,)),
+                  ('action_w', (output_dim, hidden_size)),
+                  ('action_b', (output_dim,)),
+                  ('value_w', (1, hidden_size)),
+                  ('value_b', (1,))]
+        size = sum(int(np.prod(shape)) for _, shape in shapes)
+        self.params = np.zeros(size, dtype=np.float32)
+        self.grads = np.zeros(size, dtype=np.float32)
+
+        # every parameter and its gradient are views of the flat arrays
+        offset = 0
+        for name, shape in shapes:
+            end = offset + int(np.prod(shape))
+            setattr(self, name, self.params[offset:end].reshape(shape))
+            setattr(self, 'd_' + name, self.grads[offset:end].reshape(shape))
+            offset = end
+
+        # initialised as torch.nn.Linear, uniform in +-1 / sqrt(fan_in)
+        self.rng = np.random.default_rng(seed)
+        for w, b in [(self.hidden_w, self.hidden_b),
+                     (self.action_w, self.action_b),
+                     (self.value_w, self.value_b)]:
+            bound = 1 / np.sqrt(w.shape[1])
+            w[:] = self.rng.uniform(-bound, bound, w.shape)
+            b[:] = self.rng.uniform(-bound, bound, b.shape)
+
+        self.optimizer = Adam(self.params, alpha)
+        self.gamma = gamma
+        self.agent = agent
+
+        # one entry per step: [log_prob, value, probs], as in Policy, and
+        # what the backward pass needs
+        self.actions = []
+        self.rewards = []
+        self.inputs = []
+        self.hiddens = []
+        self.choices = []
+
+        self.profiler = NULL_PROFILER
+
+        if agent == 'ac':
+            self.backprop = self.backprop_ac
+        else:
+            self.backprop = self.backprop_rf
+
+    def forward(self, x):
+        '''Action probabilities, values and hidden activations of states x
+        of shape (input_dim,) or (batch, input_dim).'''
+
+        h = x @ self.hidden_w.T
+        h += self.hidden_b
+        np.maximum(h, 0, out=h)
+
+        logits = h @ self.action_w.T
+        logits += self.action_b
+        logits -= logits.max(axis=-1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=-1, keepdims=True)
+
+        value = h @ self.value_w[0] + self.value_b[0]
+
+        return probs, value, h
+
+    def actor_weights(self):
+        '''Weights and biases of the actor, to export it (see
+        policy_export.save_network).'''
+
+        return ([self.hidden_w.copy(), self.action_w.copy()],
+                [self.hidden_b.copy(), self.action_b.copy()])
+
+    def choose_action(self, state):
+        t = self.profiler.now()
+        x = np.asarray(state, dtype=np.float32)
+        probs, value, h = self.forward(x)
+        t = self.profiler.lap('forward', t)
+
+        # inverse transform sampling
+        action = min(int((probs.cumsum() < self.rng.random()).sum()),
+                     len(probs) - 1)
+
+        self.actions.append([np.log(probs[action]), value, probs])
+        self.inputs.append(x)
+        self.hiddens.append(h)
+        self.choices.append(action)
+        self.profiler.lap('sample', t)
+
+        return action
+
+    def bootstrap(self, state):
+        '''Value of state estimated by the critic.'''
+
+        _, value, _ = self.forward(np.asarray(state, dtype=np.float32))
+
+        return value.item()
+
+    def evaluate(self, envs, greedy=True, generator=None):
+        '''Same as Policy.evaluate, generator being a numpy Generator.'''
+
+        states = np.array([env.reset() for env in envs], dtype=np.float32)
+        steps = np.zeros(len(envs), dtype=int)
+        active = np.ones(len(envs), dtype=bool)
+
+        while active.any():
+            playing = np.flatnonzero(active)
+            probs, _, _ = self.forward(states[playing])
+            if greedy:
+                actions = probs.argmax(-1)
+            else:
+                uniforms = generator.random((len(playing), 1))
+                actions = np.minimum((probs.cumsum(-1) < uniforms).sum(-1),
+                                     probs.shape[1] - 1)
+
+            for run, action in zip(playing, actions.tolist()):
+                states[run], _, done, _ = envs[run].step(action)
+                steps[run] += 1
+                if done:
+                    active[run] = False
+
+        return steps
+
+    def update(self, weights, value_targets=None):
+        '''One Adam step on the steps in the buffers, for the loss
+
+            -sum(weights * log_probs) + sum(smooth_l1(values, value_targets))
+
+        the second term only if value_targets is given.
+
+        Output:
+        the loss'''
+
+        x = np.array(self.inputs)
+        h = np.array(self.hiddens)
+        probs = np.array([p for _, _, p in self.actions])
+        values = np.array([v for _, v, _ in self.actions])
+        steps = np.arange(len(self.choices))
+        actions = np.array(self.choices)
+        weights = weights.astype(np.float32)
+
+        # gradient of the loss with respect to the logits and the values
+        loss = -(np.log(probs[steps, actions]) * weights).sum()
+        d_logits = probs * weights[:, None]
+        d_logits[steps, actions] -= weights
+        if value_targets is None:
+            d_values = np.zeros(len(steps), dtype=np.float32)
+        else:
+            value_losses, d_values = smooth_l1(
+                values - value_targets.astype(np.float32))
+            loss += value_losses.sum()
+
+        # backward pass through the heads and the hidden layer
+        self.d_action_w[:] = d_logits.T @ h
+        self.d_action_b[:] = d_logits.sum(0)
+        self.d_value_w[0] = d_values @ h
+        self.d_value_b[0] = d_values.sum()
+        d_h = d_logits @ self.action_w + d_values[:, None] * self.value_w
+        d_h *= h > 0
+        self.d_hidden_w[:] = d_h.T @ x
+        self.d_hidden_b[:] = d_h.sum(0)
+
+        self.optimizer.step(self.grads)
+
+        return float(loss)
+
+    def normalised_returns(self):
+        returns = discount_rewards(self.rewards, self.gamma)
+
+        return (returns - returns.mean()) / (returns.std(ddof=1) + eps)
+
+    def backprop_segment(self, next_value):
+        '''Same as Policy.backprop_segment.'''
+
+        returns = discount_rewards(self.rewards + [next_value],
+                                   self.gamma)[:-1]
+        if self.agent == 'ac':
+            values = np.array([v for _, v, _ in self.actions])
+            weights = returns - values
+        else:
+            weights = returns
+        entropy = self.entropy()
+        loss = self.update(weights, returns)
+        self.forget()
+
+        return loss, entropy
+
+    def forget(self):
+        '''Empties the buffers of the episode without learning from it.'''
+
+        del self.rewards[:]
+        del self.actions[:]
+        del self.inputs[:]
+        del self.hiddens[:]
+        del self.choices[:]
+
+    def entropy(self):
+        '''Average entropy of the policy over the current episode.'''
+
+        probs = np.array([p for _, _, p in self.actions])
+
+        return float(-(probs * np.log(probs + eps)).sum(-1).mean())
+
+    def backprop_rf(self):
+        '''Same as Policy.backprop_rf: the value head is not trained.'''
+
+        entropy = self.entropy()
+        loss = self.update(self.normalised_returns())
+        self.forget()
+
+        return loss, entropy
+
+    def backprop_ac(self):
+        '''Same as Policy.backprop_ac.'''
+
+        returns = self.normalised_returns()
+        values = np.array([v for _, v, _ in self.actions])
+        entropy = self.entropy()
+        loss = self.update(returns - values, returns)
+        self.forget()
+
+        return loss, entropy
+
+    def state_dict(self):
+        return {'params': self.params.copy(),
+                'rng': self.rng.bit_generator.state}
+
+    def load_state_dict(self, state):
+        self.params[:] = state['params']
+        self.rng.bit_generator.state = state['rng']
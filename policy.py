@@ -0,0 +1,503 @@
+'''Policy network of the HW03Q02 agents (reinforce and actor-critic).
+
+Kept apart from HW03Q02.py so that torch is only imported when a sweep is
+trained, and not when saved results are loaded and plotted.'''
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from torch.distributions import Categorical
+
+from compile_utils import compile_function, report_latency
+from profiler import NULL_PROFILER
+
+eps = np.finfo(np.float32).eps.item()
+
+
+# #############################################################################
+#
+# Rewards
+#
+# #############################################################################
+
+
+def discount_rewards(rewards, gamma):
+    returns = []
+    R = 0
+
+    # calculate discounted rewards from inversed array
+    for r in rewards[::-1]:
+        # calculate the discounted value
+        R = r + gamma * R
+        returns.append(R)
+
+    # the list is once again in the correct order
+    return returns[::-1]
+
+
+# #############################################################################
+#
+# Model
+#
+# #############################################################################
+
+
+def policy_forward(x, hidden_w, hidden_b, action_w, action_b, value_w, value_b):
+    '''Forward pass of Policy written in terms of its parameters, so that
+    it can be compiled once and shared by every model of the sweep.'''
+
+    x = F.relu(F.linear(x, hidden_w, hidden_b))
+
+    action_prob = F.softmax(F.linear(x, action_w, action_b), dim=-1)
+    value = F.linear(x, value_w, value_b)
+
+    return action_prob, value
+
+
+def rf_loss(log_probs, returns):
+    '''Reinforce loss (negative log-likelihood weighted by the returns).'''
+
+    return -(log_probs * returns).sum()
+
+
+def ac_loss(log_probs, values, returns):
+    '''Actor-critic loss: the policy is weighted by the advantage and the
+    critic is trained with the L1 smooth loss.'''
+
+    advantages = returns - values.detach()
+    policy_loss = -(log_probs * advantages).sum()
+    value_loss = F.smooth_l1_loss(values, returns, reduction='sum')
+
+    return policy_loss + value_loss
+
+
+class Policy(nn.Module):
+    def __init__(self, agent, input_dim, output_dim, hidden_size, alpha,
+                 gamma):
+        super(Policy, self).__init__()
+
+        self.hidden = nn.Linear(input_dim, hidden_size)
+
+        # actor
+        self.action_head = nn.Linear(hidden_size, output_dim)
+
+        # critic
+        self.value_head = nn.Linear(hidden_size, 1)
+
+        self.actions = []
+        self.rewards = []
+
+        self.optimizer = torch.optim.Adam(self.parameters(), lr=alpha)
+        self.gamma = gamma
+        self.agent = agent
+
+        # compiled functions, see use_compiled
+        self.forward_fn = None
+        self.params = None
+
+        self.profiler = NULL_PROFILER
+
+        if agent == 'ac':
+            self.backprop = self.backprop_ac
+            self.loss_fn = ac_loss
+        else:
+            self.backprop = self.backprop_rf
+            self.loss_fn = rf_loss
+
+    def forward(self, x):
+
+        x = F.relu(self.hidden(x))
+
+        action_prob = F.softmax(self.action_head(x), dim=-1)
+        value = self.value_head(x)
+
+        return action_prob, value
+
+    def actor_layers(self):
+        '''Layers of the actor, to export it (see policy_export.py).'''
+
+        return [self.hidden, self.action_head]
+
+    def actor_weights(self):
+        '''Weights and biases of the actor, to export it (see
+        policy_export.save_network).'''
+
+        layers = self.actor_layers()
+
+        return ([layer.weight.detach().cpu().numpy() for layer in layers],
+                [layer.bias.detach().cpu().numpy() for layer in layers])
+
+    def use_compiled(self, forward_fn, loss_fn):
+        '''Routes the acting step and the loss through compiled versions
+        of policy_forward and of the loss (see warm_up).'''
+
+        self.forward_fn = forward_fn
+        self.loss_fn = loss_fn
+        self.params = tuple(self.parameters())
+
+    def choose_action(self, state):
+        t = self.profiler.now()
+        state = torch.from_numpy(state).float()
+        t = self.profiler.lap('to_tensor', t)
+
+        if self.forward_fn is None:
+            probs, value = self(state)
+        else:
+            probs, value = self.forward_fn(state, *self.params)
+        t = self.profiler.lap('forward', t)
+
+        # get categorical distribution from probabilities
+        # and sample an action
+        distr = Categorical(probs)
+        action = distr.sample()
+
+        # save to action buffer
+        self.actions.append([distr.log_prob(action), value, probs])
+        action = action.item()
+        self.profiler.lap('sample', t)
+
+        return action
+
+    def bootstrap(self, state):
+        '''Value of state estimated by the critic, without gradient.'''
+
+        with torch.no_grad():
+            state = torch.from_numpy(state).float()
+            if self.forward_fn is None:
+                _, value = self(state)
+            else:
+                _, value = self.forward_fn(state, *self.params)
+
+        return value.item()
+
+    def evaluate(self, envs, greedy=True, generator=None):
+        '''Plays one episode in every environment of envs with the current
+        policy, without gradient and without learning. The environments are
+        stepped together, with one batched forward pass per step.
+
+        Input:
+        envs      : environments, already seeded
+        greedy    : if True, the most probable action is played, otherwise
+                    the action is sampled
+        generator : torch.Generator used to sample the actions, so that
+                    the evaluation does not change the random state of the
+                    training
+
+        Output:
+        array with the number of steps of every episode'''
+
+        states = np.array([env.reset() for env in envs], dtype=np.float32)
+        steps = np.zeros(len(envs), dtype=int)
+        active = np.ones(len(envs), dtype=bool)
+
+        with torch.no_grad():
+            while active.any():
+                playing = np.flatnonzero(active)
+                probs, _ = self(torch.from_numpy(states[playing]))
+                if greedy:
+                    actions = probs.argmax(-1)
+                else:
+                    actions = torch.multinomial(probs, 1,
+                                                generator=generator)[:, 0]
+
+                for run, action in zip(playing, actions.tolist()):
+                    states[run], _, done, _ = envs[run].step(action)
+                    steps[run] += 1
+                    if done:
+                        active[run] = False
+
+        return steps
+
+    def backprop_segment(self, next_value):
+        '''Updates the model on the steps played since the last update, a
+        segment of the episode. The returns are truncated at the end of the
+        segment and bootstrapped with next_value, the value of the state
+        reached (0 at the end of the episode), so the memory and the time
+        of an update only depend on the length of the segment.
+
+        The returns are not normalised, as they are also the targets of the
+        critic. With reinforce, the critic is trained but only used for the
+        bootstrap, not as a baseline.'''
+
+        returns = discount_rewards(self.rewards + [next_value], self.gamma)
+        returns = torch.tensor(returns[:-1])
+
+        log_probs = torch.stack([log_prob for log_prob, _, _ in self.actions])
+        values = torch.cat([value for _, value, _ in self.actions])
+        if self.agent == 'ac':
+            loss = self.loss_fn(log_probs, values, returns)
+        else:
+            loss = (self.loss_fn(log_probs, returns)
+                    + F.smooth_l1_loss(values, returns, reduction='sum'))
+        entropy = self.entropy()
+
+        # backprop
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+
+        # reset buffers
+        del self.rewards[:]
+        del self.actions[:]
+
+        return loss.item(), entropy
+
+    def forget(self):
+        '''Empties the buffers of the episode without learning from it.'''
+
+        del self.rewards[:]
+        del self.actions[:]
+
+    def entropy(self):
+        '''Average entropy of the policy over the current episode.'''
+
+        with torch.no_grad():
+            probs = torch.stack([p for _, _, p in self.actions])
+            entropy = -(probs * torch.log(probs + eps)).sum(-1).mean()
+
+        return entropy.item()
+
+    def backprop_rf(self):
+        '''Calculate losses and do gradient backpropagation.
+        This code for the reinforce method complety ignores the
+        value branch of the network, and back propagates over
+        the policy.'''
+
+        # discount rewards and normalise returns
+        returns = discount_rewards(self.rewards, self.gamma)
+        returns = torch.tensor(returns)
+        returns = (returns - returns.mean()) / (returns.std() + eps)
+
+        # actor loss (negative log-likelihood)
+        log_probs = torch.stack([log_prob for log_prob, _, _ in self.actions])
+        loss = self.loss_fn(log_probs, returns)
+        entropy = self.entropy()
+
+        # backprop
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+
+        # reset buffers
+        del self.rewards[:]
+        del self.actions[:]
+
+        return loss.item(), entropy
+
+    def backprop_ac(self):
+        '''Calculate losses and do gradient backpropagation
+        for the actor-critic (reinforce with baseline) method.'''
+
+        # discount rewards and normalise returns
+        returns = discount_rewards(self.rewards, self.gamma)
+        returns = torch.tensor(returns)
+        returns = (returns - returns.mean()) / (returns.std() + eps)
+
+        # actor loss weighted by the advantage and critic loss
+        log_probs = torch.stack([log_prob for log_prob, _, _ in self.actions])
+        values = torch.cat([value for _, value, _ in self.actions])
+        loss = self.loss_fn(log_probs, values, returns)
+        entropy = self.entropy()
+
+        # backprop
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+
+        # reset buffers
+        del self.rewards[:]
+        del self.actions[:]
+
+        return loss.item(), entropy
+
+
+def warm_up(mode, sizes, input_dim, output_dim):
+    '''Compiles policy_forward and the losses before the first episode,
+    so that compilation time is not counted in the runs.
+
+    Output:
+    dictionary with the compiled forward pass and the compiled loss of
+    each agent, to be passed to Policy.use_compiled'''
+
+    models = [Policy('rf', input_dim, output_dim, size, 1, 1) for size in sizes]
+    params = [tuple(model.parameters()) for model in models]
+    state = torch.rand(input_dim)
+
+    forward, forward_mode = compile_function(
+        policy_forward, mode, [(state,) + p for p in params])
+
+    # the losses see a different episode length at every call
+    lengths = [8, 9, 200]
+    losses = {}
+    losses['rf'], rf_mode = compile_function(
+        rf_loss, mode,
+        [(torch.rand(n, requires_grad=True), torch.rand(n))
+         for n in lengths],
+        dynamic=True)
+    losses['ac'], ac_mode = compile_function(
+        ac_loss, mode,
+        [(torch.rand(n, requires_grad=True), torch.rand(n, requires_grad=True),
+          torch.rand(n)) for n in lengths],
+        dynamic=True)
+
+    print('Compiled forward: {}, reinforce loss: {}, actor-critic loss: {}'.format(
+        forward_mode, rf_mode, ac_mode))
+    report_latency('Policy forward', models[0], (state,),
+                   forward, (state,) + params[0], forward_mode)
+
+    return {'forward': forward, 'rf': losses['rf'], 'ac': losses['ac']}
+
+# #############################################################################
+#
+# Ensemble
+#
+# #############################################################################
+
+
+def ensemble_forward(x, hidden_w, hidden_b, action_w, action_b, value_w,
+                     value_b):
+    '''Forward pass of R stacked Policies, each on its own state.
+
+    Input:
+    x         : states of shape (R, input_dim)
+    parameters: parameters of Policy stacked along a first dimension of
+                size R, e.g. hidden_w of shape (R, hidden_size, input_dim)
+
+    Output:
+    action probabilities of shape (R, output_dim) and values of shape (R,)'''
+
+    x = F.relu(torch.baddbmm(hidden_b.unsqueeze(1), x.unsqueeze(1),
+                             hidden_w.transpose(1, 2)))
+
+    action_prob = F.softmax(torch.baddbmm(
+        action_b.unsqueeze(1), x, action_w.transpose(1, 2)), dim=-1)
+    value = torch.baddbmm(value_b.unsqueeze(1), x, value_w.transpose(1, 2))
+
+    return action_prob.squeeze(1), value.reshape(-1)
+
+
+class EnsemblePolicy(nn.Module):
+    '''R independent runs of Policy trained with batched kernels.
+
+    The parameters of the runs are stacked along a first dimension and
+    initialised as Policy would be after torch.manual_seed(seed), every
+    run samples its actions from its own generator, and a single Adam
+    optimizer over the stacked parameters is the same as one optimizer per
+    run, as Adam works elementwise. The episodes of the runs are played in
+    lockstep: a run that finished its episode waits, masked, for the
+    others, so every run does one update per episode.
+
+    Input:
+    seeds : seeds of the runs, one per run'''
+
+    PARAMETERS = ['hidden_w', 'hidden_b', 'action_w', 'action_b', 'value_w',
+                  'value_b']
+
+    def __init__(self, agent, input_dim, output_dim, hidden_size, alpha,
+                 gamma, seeds):
+        super(EnsemblePolicy, self).__init__()
+
+        models = []
+        for seed in seeds:
+            torch.manual_seed(seed)
+            models.append(Policy(agent, input_dim, output_dim, hidden_size,
+                                 alpha, gamma))
+        for name, layer in [('hidden', 'hidden'), ('action', 'action_head'),
+                            ('value', 'value_head')]:
+            for suffix, attribute in [('_w', 'weight'), ('_b', 'bias')]:
+                setattr(self, name + suffix, nn.Parameter(torch.stack([
+                    getattr(getattr(m, layer), attribute).detach()
+                    for m in models])))
+        self.params = tuple(getattr(self, name) for name in self.PARAMETERS)
+
+        self.agent = agent
+        self.gamma = gamma
+        self.rngs = [np.random.default_rng(seed) for seed in seeds]
+        self.optimizer = torch.optim.Adam(self.parameters(), lr=alpha)
+
+        # one entry per step of the episode: [log_probs, values, probs],
+        # rewards and which runs were still playing
+        self.actions = []
+        self.rewards = []
+        self.masks = []
+
+        self.profiler = NULL_PROFILER
+
+    def choose_actions(self, states, active):
+        '''Samples the actions of every run in states (R, input_dim). Only
+        the generators of the active runs are used.'''
+
+        t = self.profiler.now()
+        # a copy: the caller writes the next states in the same array, which
+        # the graph of the update must not see
+        states = torch.tensor(states, dtype=torch.float32)
+        t = self.profiler.lap('to_tensor', t)
+
+        probs, values = ensemble_forward(states, *self.params)
+        t = self.profiler.lap('forward', t)
+
+        # inverse transform sampling with the generator of every run
+        uniforms = torch.tensor([rng.random() if playing else 0.
+                                 for rng, playing in zip(self.rngs, active)])
+        cdf = probs.detach().cumsum(-1)
+        actions = (cdf < uniforms.unsqueeze(1)).sum(-1).clamp(
+            max=probs.shape[1] - 1)
+        log_probs = torch.log(probs.gather(1, actions.unsqueeze(1))).squeeze(1)
+
+        self.actions.append([log_probs, values, probs])
+        self.masks.append(np.array(active))
+        actions = actions.tolist()
+        self.profiler.lap('sample', t)
+
+        return actions
+
+    def backprop(self):
+        '''Updates every run on its last episode.
+
+        Output:
+        lists of the loss and of the average entropy of every run'''
+
+        masks = torch.from_numpy(np.array(self.masks, dtype=np.float32))
+        lengths = masks.sum(0)
+
+        # discounted returns, 0 after the end of the episode of a run
+        rewards = np.array(self.rewards, dtype=np.float32) * masks.numpy()
+        returns = np.zeros_like(rewards)
+        R = np.zeros(rewards.shape[1], dtype=np.float32)
+        for step in reversed(range(len(rewards))):
+            R = rewards[step] + self.gamma * R
+            returns[step] = R
+        returns = torch.from_numpy(returns)
+
+        # normalise the returns of every run over its own episode
+        mean = returns.sum(0) / lengths
+        std = torch.sqrt((((returns - mean) * masks) ** 2).sum(0)
+                         / (lengths - 1))
+        returns = (returns - mean) / (std + eps) * masks
+
+        log_probs = torch.stack([log_prob for log_prob, _, _ in self.actions])
+        losses = -(log_probs * returns * masks).sum(0)
+        if self.agent == 'ac':
+            values = torch.stack([value for _, value, _ in self.actions])
+            advantages = returns - values.detach()
+            value_losses = F.smooth_l1_loss(values, returns, reduction='none')
+            losses = (-(log_probs * advantages * masks).sum(0)
+                      + (value_losses * masks).sum(0))
+
+        with torch.no_grad():
+            probs = torch.stack([p for _, _, p in self.actions])
+            entropy = -(probs * torch.log(probs + eps)).sum(-1)
+            entropy = (entropy * masks).sum(0) / lengths
+
+        self.optimizer.zero_grad()
+        losses.sum().backward()
+        self.optimizer.step()
+
+        del self.actions[:]
+        del self.rewards[:]
+        del self.masks[:]
+
+        return losses.tolist(), entropy.tolist()
@@ -0,0 +1,214 @@
+'''Export format of the trained policies, for serving.
+
+An exported network is a .npz file with the weights and biases of its
+layers, w0, b0, w1, b1, ..., and a JSON header, meta:
+
+    {"version": 2, "input_dim": 4, "output_dim": 2, "layers": 2,
+     "precision": "fp32", "output": "softmax", ...}
+
+The hidden layers use ReLU. The last layer is followed by a softmax for
+the actors of Policy (policy.py) and of Actor (HW03Q02_torch_bootstrap.py),
+and by nothing for a critic (output "linear").
+
+The weights are stored in one of PRECISIONS:
+
+    fp32  as trained
+    fp16  half precision
+    int8  symmetric int8 with one float32 scale per output unit, s<idx>
+
+Loading an exported network only needs numpy, so a server starts without
+torch. The numpy forward pass uses the weights converted back to float32;
+torch_module runs the fp16 and int8 weights with the dynamically quantized
+kernels of torch instead (see quantize.py for their comparison):
+
+    policy = ExportedPolicy('data/models/rf_h32_a0.01_r0.npz')
+    actions = policy.act(states)'''
+
+import os
+import json
+import warnings
+
+import numpy as np
+
+from checkpoint import atomic_write
+
+EXPORT_SUFFIX = '.npz'
+FORMAT_VERSION = 2
+PRECISIONS = ['fp32', 'fp16', 'int8']
+
+
+# #############################################################################
+#
+# Export
+#
+# #############################################################################
+
+
+def quantize(w, precision):
+    '''Weights w of shape (outputs, inputs) in precision.
+
+    Output:
+    stored weights and their per-output scales (None but for int8)'''
+
+    if precision == 'fp32':
+        return w.astype(np.float32), None
+    if precision == 'fp16':
+        return w.astype(np.float16), None
+
+    scale = np.abs(w).max(axis=1) / 127
+    scale[scale == 0] = 1
+    q = np.clip(np.rint(w / scale[:, None]), -127, 127).astype(np.int8)
+
+    return q, scale.astype(np.float32)
+
+
+def dequantize(w, scale=None):
+    '''float32 weights of quantize.'''
+
+    w = w.astype(np.float32)
+
+    return w if scale is None else w * scale[:, None]
+
+
+def save_network(path, weights, biases, precision='fp32', output='softmax',
+                 **meta):
+    '''Saves the network of float32 weights and biases in path.
+
+    Input:
+    path      : .npz file
+    weights   : weights of the layers, from input to output, each of shape
+                (outputs, inputs)
+    biases    : biases of the layers
+    precision : precision of the stored weights, one of PRECISIONS
+    output    : 'softmax' for an actor, 'linear' for a critic
+    meta      : information saved in the header, e.g. env, agent, alpha'''
+
+    assert precision in PRECISIONS
+    arrays = {}
+    for idx, (w, b) in enumerate(zip(weights, biases)):
+        arrays['w{}'.format(idx)], scale = quantize(np.asarray(w), precision)
+        if scale is not None:
+            arrays['s{}'.format(idx)] = scale
+        arrays['b{}'.format(idx)] = np.asarray(b, dtype=np.float32)
+
+    meta = dict(meta, version=FORMAT_VERSION, layers=len(weights),
+                input_dim=int(weights[0].shape[1]),
+                output_dim=int(weights[-1].shape[0]), precision=precision,
+                output=output)
+    arrays['meta'] = np.array(json.dumps(meta, default=str))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    atomic_write(path, lambda f: np.savez(f, **arrays))
+
+
+def export_policy(path, layers, precision='fp32', output='softmax', **meta):
+    '''Saves the network made of layers, torch.nn.Linear layers from input
+    to output, in path (see save_network).'''
+
+    weights = [layer.weight.detach().cpu().numpy() for layer in layers]
+    biases = [layer.bias.detach().cpu().numpy() for layer in layers]
+    save_network(path, weights, biases, precision, output, **meta)
+
+
+# #############################################################################
+#
+# Inference
+#
+# #############################################################################
+
+
+class ExportedPolicy():
+    '''Network loaded from a file saved by save_network.
+
+    Input:
+    path : .npz file'''
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.meta = json.loads(data['meta'].item())
+            if self.meta['version'] > FORMAT_VERSION:
+                raise ValueError('{} has format version {}, newer than {}'
+                                 .format(path, self.meta['version'],
+                                         FORMAT_VERSION))
+            self.weights = [
+                dequantize(data['w{}'.format(idx)],
+                           data['s{}'.format(idx)]
+                           if 's{}'.format(idx) in data else None)
+                for idx in range(self.meta['layers'])]
+            self.biases = [data['b{}'.format(idx)].astype(np.float32)
+                           for idx in range(self.meta['layers'])]
+        # (inputs, outputs) for the numpy forward pass
+        self.layers = [(w.T.copy(), b) for w, b in zip(self.weights,
+                                                       self.biases)]
+
+        self.input_dim = self.meta['input_dim']
+        self.output_dim = self.meta['output_dim']
+        # files of version 1 only held fp32 actors
+        self.precision = self.meta.get('precision', 'fp32')
+        self.output = self.meta.get('output', 'softmax')
+
+    def forward(self, states):
+        '''Output of the network for states of shape (batch, input_dim):
+        action probabilities or values.'''
+
+        x = np.asarray(states, dtype=np.float32)
+        for w, b in self.layers[:-1]:
+            x = np.maximum(x @ w + b, 0)
+        w, b = self.layers[-1]
+        x = x @ w + b
+        if self.output == 'linear':
+            return x
+
+        x -= x.max(axis=-1, keepdims=True)
+        probs = np.exp(x)
+
+        return probs / probs.sum(axis=-1, keepdims=True)
+
+    def probs(self, states):
+        '''Action probabilities of states of shape (batch, input_dim).'''
+
+        return self.forward(states)
+
+    def act(self, states, greedy=True, rng=None):
+        '''Actions of states of shape (batch, input_dim), the most probable
+        ones or sampled with the numpy Generator rng.'''
+
+        probs = self.probs(states)
+        if greedy:
+            return probs.argmax(axis=-1)
+
+        uniforms = rng.random((len(probs), 1))
+
+        return np.minimum((probs.cumsum(axis=-1) < uniforms).sum(axis=-1),
+                          self.output_dim - 1)
+
+    def torch_module(self):
+        '''torch module of the network, without the softmax. The fp16 and
+        int8 weights are run by the dynamically quantized linear layers of
+        torch, the activations staying float32.'''
+
+        import torch
+        import torch.nn as nn
+
+        modules = []
+        for w, b in zip(self.weights, self.biases):
+            linear = nn.Linear(w.shape[1], w.shape[0])
+            with torch.no_grad():
+                linear.weight.copy_(torch.from_numpy(w))
+                linear.bias.copy_(torch.from_numpy(b))
+            modules.extend([linear, nn.ReLU()])
+        module = nn.Sequential(*modules[:-1]).eval()
+
+        if self.precision == 'fp32':
+            return module
+
+        from torch.ao.quantization import (float16_dynamic_qconfig,
+                                           per_channel_dynamic_qconfig,
+                                           quantize_dynamic)
+        qconfig = (per_channel_dynamic_qconfig if self.precision == 'int8'
+                   else float16_dynamic_qconfig)
+
+        # recent versions warn that torch.ao.quantization moves to torchao
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return quantize_dynamic(module, {nn.Linear: qconfig})
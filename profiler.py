@@ -0,0 +1,211 @@
+'''Opt-in per-phase timers for the training loops.
+
+The loops time their phases (environment step, conversion to tensors,
+forward pass, sampling, backpropagation, logging...) with laps:
+
+    t = profiler.now()
+    state, reward, done, _ = env.step(action)
+    t = profiler.lap('env_step', t)
+
+Times are aggregated per episode and per run, and can be exported as a
+summary table and as a Chrome trace (chrome://tracing or Perfetto). When
+profiling is off, the loops use NULL_PROFILER whose methods do nothing.'''
+
+import os
+import json
+import time
+
+import numpy as np
+
+MAX_EVENTS = 10**6
+
+
+class NullProfiler():
+    '''Profiler used when profiling is off.'''
+
+    enabled = False
+
+    def now(self):
+        return 0
+
+    def lap(self, phase, start):
+        return 0
+
+    def count(self, counter, n=1):
+        pass
+
+    def end_episode(self):
+        pass
+
+    def end_run(self, name):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler():
+    '''Input:
+    trace      : if True, every lap is also kept for the Chrome trace
+    max_events : maximum number of laps kept for the trace'''
+
+    enabled = True
+
+    def __init__(self, trace=True, max_events=MAX_EVENTS):
+        self.phases = []
+        self.phase_ids = {}
+        # totals (ns) and number of laps of the current episode
+        self.episode_time = []
+        self.episode_calls = []
+        self.counters = {}
+
+        # per-episode totals of the current run, then per-run summaries
+        self.episodes = []
+        self.runs = []
+
+        self.trace = trace
+        self.events = np.zeros((max_events if trace else 0, 3), dtype=np.int64)
+        self.n_events = 0
+        self.origin = time.perf_counter_ns()
+
+    def now(self):
+        return time.perf_counter_ns()
+
+    def lap(self, phase, start):
+        '''Adds the time since start to phase and returns the current time,
+        which is the start of the next phase.'''
+
+        end = time.perf_counter_ns()
+
+        idx = self.phase_ids.get(phase)
+        if idx is None:
+            idx = self.phase_ids[phase] = len(self.phases)
+            self.phases.append(phase)
+            self.episode_time.append(0)
+            self.episode_calls.append(0)
+        self.episode_time[idx] += end - start
+        self.episode_calls[idx] += 1
+
+        if self.n_events < len(self.events):
+            self.events[self.n_events] = (idx, start, end - start)
+            self.n_events += 1
+
+        return end
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def end_episode(self):
+        self.episodes.append((list(self.episode_time),
+                              list(self.episode_calls)))
+        self.episode_time = [0] * len(self.phases)
+        self.episode_calls = [0] * len(self.phases)
+
+    def end_run(self, name):
+        '''Aggregates the episodes of the run that just finished.'''
+
+        if any(self.episode_calls):
+            self.end_episode()
+
+        n_phases = len(self.phases)
+        times = np.zeros((len(self.episodes), n_phases), dtype=np.int64)
+        calls = np.zeros((len(self.episodes), n_phases), dtype=np.int64)
+        for episode, (t, c) in enumerate(self.episodes):
+            times[episode, :len(t)] = t
+            calls[episode, :len(c)] = c
+
+        self.runs.append({
+            'name': name,
+            'episodes': len(self.episodes),
+            'time': times,
+            'calls': calls,
+            'counters': dict(self.counters),
+        })
+        self.episodes = []
+        self.counters = {}
+
+    # #########################################################################
+    # Exports
+    # #########################################################################
+
+    def totals(self):
+        '''Total time (s) and number of laps of each phase over all runs.'''
+
+        n_phases = len(self.phases)
+        time_s = np.zeros(n_phases)
+        calls = np.zeros(n_phases, dtype=np.int64)
+        for run in self.runs:
+            time_s[:run['time'].shape[1]] += run['time'].sum(axis=0) / 1e9
+            calls[:run['calls'].shape[1]] += run['calls'].sum(axis=0)
+
+        return time_s, calls
+
+    def summary(self):
+        '''Summary of every phase, as a list of dictionaries.'''
+
+        time_s, calls = self.totals()
+        total = max(time_s.sum(), 1e-12)
+
+        return [{
+            'phase': phase,
+            'calls': int(calls[idx]),
+            'total_s': float(time_s[idx]),
+            'mean_us': float(1e6 * time_s[idx] / max(calls[idx], 1)),
+            'share': float(time_s[idx] / total),
+        } for idx, phase in enumerate(self.phases)]
+
+    def print_summary(self):
+        print('{:<16}{:>12}{:>12}{:>14}{:>9}'.format(
+            'Phase', 'Calls', 'Total (s)', 'Mean (us)', 'Share'))
+        for row in sorted(self.summary(), key=lambda r: -r['total_s']):
+            print('{:<16}{:>12}{:>12.3f}{:>14.2f}{:>8.1f}%'.format(
+                row['phase'], row['calls'], row['total_s'], row['mean_us'],
+                100 * row['share']))
+
+        for run in self.runs:
+            steps = run['counters'].get('steps', 0)
+            seconds = run['time'].sum() / 1e9
+            print('Run {}: {} episodes, {} steps, {:.1f} steps/s'.format(
+                run['name'], run['episodes'], steps,
+                steps / max(seconds, 1e-12)))
+
+    def save(self, path):
+        '''Saves the summary and the per-episode totals of every run.'''
+
+        with open(path, 'w') as f:
+            json.dump({
+                'phases': self.phases,
+                'summary': self.summary(),
+                'runs': [{
+                    'name': run['name'],
+                    'counters': run['counters'],
+                    'episode_time_ns': run['time'].tolist(),
+                    'episode_calls': run['calls'].tolist(),
+                } for run in self.runs],
+            }, f)
+
+    def save_trace(self, path):
+        '''Saves the laps in the Chrome trace event format.'''
+
+        pid = os.getpid()
+        events = [{
+            'name': self.phases[idx],
+            'ph': 'X',
+            'ts': (start - self.origin) / 1e3,
+            'dur': duration / 1e3,
+            'pid': pid,
+            'tid': 0,
+        } for idx, start, duration in self.events[:self.n_events].tolist()]
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def export(self, prefix):
+        '''Prints the summary and saves <prefix>profile.json and
+        <prefix>trace.json.'''
+
+        self.print_summary()
+        self.save(prefix + 'profile.json')
+        if self.trace:
+            self.save_trace(prefix + 'trace.json')
+        print('Profile saved to {}profile.json'.format(prefix))
@@ -0,0 +1,282 @@
+'''Compact variants of an exported network, and their comparison with it.
+
+For every precision (see policy_export.PRECISIONS), the network is saved
+next to the original as <name>.<precision>.npz, then compared with the
+original on:
+
+    accuracy  for an actor, the rate of agreement of the greedy actions
+              and the average return of greedy episodes of the
+              environment; for a critic, the largest error of the values
+    latency   median time of a forward pass for every batch size, with
+              torch (dynamically quantized kernels for fp16 and int8),
+              and with the numpy forward pass of the server. numpy runs
+              every variant with float32 weights, so it is only timed for
+              fp32
+
+    python quantize.py data/models/rf_h32_a0.01_r0.npz --output q.json
+
+The accuracy is measured on the states visited by the original network
+during its evaluation episodes, or on random states without
+environment.'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from policy_export import PRECISIONS, ExportedPolicy, save_network
+
+EPISODES = 20
+STATES = 10000
+BATCH_SIZES = [1, 32, 256]
+REPEATS = 200
+SEED = 0
+
+
+# #############################################################################
+#
+# Parser
+#
+# #############################################################################
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description='Exports compact variants of an exported network and '
+        'compares their accuracy and latency with it.')
+    parser.add_argument('model', type=str,
+                        help='Network saved by policy_export, in fp32.')
+    parser.add_argument('-p', '--precisions', type=str, nargs='*',
+                        default=PRECISIONS[1:], choices=PRECISIONS[1:],
+                        help='Precisions of the compact variants. Default: '
+                        + ' '.join(PRECISIONS[1:]))
+    parser.add_argument('--env', type=str, default=None,
+                        help='Environment of the evaluation episodes. '
+                        'Default: the environment saved in the model, if '
+                        'any.')
+    parser.add_argument('-e', '--episodes', type=int, default=EPISODES,
+                        help='Number of greedy evaluation episodes. '
+                        'Default: ' + str(EPISODES))
+    parser.add_argument('--states', type=int, default=STATES,
+                        help='Number of states of the accuracy check. '
+                        'Default: ' + str(STATES))
+    parser.add_argument('-b', '--batch_sizes', type=int, nargs='*',
+                        default=BATCH_SIZES,
+                        help='Batch sizes of the latency comparison. '
+                        'Default: ' + str(BATCH_SIZES))
+    parser.add_argument('-n', '--repeats', type=int, default=REPEATS,
+                        help='Number of timed forward passes per batch size. '
+                        'Default: ' + str(REPEATS))
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='Seed of the episodes and of the random states. '
+                        'Default: ' + str(SEED))
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='JSON file where the comparison is saved.')
+
+    return parser.parse_args()
+
+
+# #############################################################################
+#
+# Accuracy
+#
+# #############################################################################
+
+
+def variant_path(path, precision):
+    return '{}.{}.npz'.format(os.path.splitext(path)[0], precision)
+
+
+def play(policy, env_name, episodes, seed):
+    '''Returns and visited states of greedy episodes of policy.'''
+
+    import gym
+
+    env = gym.make(env_name)
+    env.seed(seed)
+    returns, states = [], []
+    for _ in range(episodes):
+        state, total, done = env.reset(), 0., False
+        while not done:
+            states.append(state)
+            action = int(policy.act(np.asarray(state)[None])[0])
+            state, reward, done, _ = env.step(action)
+            total += reward
+        returns.append(total)
+    env.close()
+
+    return np.array(returns), np.array(states, dtype=np.float32)
+
+
+def accuracy(reference, variant, states, env_name, episodes, seed):
+    '''Comparison of the outputs of variant and of reference on states.'''
+
+    result = {}
+    if reference.output == 'linear':
+        error = np.abs(variant.forward(states) - reference.forward(states))
+        scale = np.abs(reference.forward(states)).max()
+        result['max_error'] = float(error.max())
+        result['max_relative_error'] = float(error.max() / max(scale, 1e-12))
+        return result
+
+    agreement = (variant.act(states) == reference.act(states)).mean()
+    result['agreement'] = float(agreement)
+    result['agreement_torch'] = float(
+        (torch_actions(variant, states) == reference.act(states)).mean())
+    if env_name is not None:
+        returns, _ = play(variant, env_name, episodes, seed)
+        result['return'] = float(returns.mean())
+
+    return result
+
+
+def torch_actions(policy, states):
+    import torch
+
+    with torch.no_grad():
+        output = policy.torch_module()(torch.from_numpy(states))
+
+    return output.argmax(-1).numpy()
+
+
+# #############################################################################
+#
+# Latency
+#
+# #############################################################################
+
+
+def median_time(forward, x, repeats):
+    '''Median time (s) of forward(x), after a few calls to warm up.'''
+
+    for _ in range(min(10, repeats)):
+        forward(x)
+    times = np.zeros(repeats)
+    for idx in range(repeats):
+        start = time.perf_counter()
+        forward(x)
+        times[idx] = time.perf_counter() - start
+
+    return float(np.median(times))
+
+
+def latency(policy, batch_sizes, repeats, rng):
+    '''Median latency (us) and throughput (states/s) of the forward passes
+    of policy for every batch size.'''
+
+    import torch
+
+    module = policy.torch_module()
+
+    def torch_forward(x):
+        with torch.no_grad():
+            return module(x)
+
+    result = {}
+    for batch_size in batch_sizes:
+        x = rng.normal(size=(batch_size, policy.input_dim)).astype(np.float32)
+        runtimes = [('torch', torch_forward, torch.from_numpy(x))]
+        if policy.precision == 'fp32':
+            runtimes.append(('numpy', policy.forward, x))
+        for runtime, forward, data in runtimes:
+            seconds = median_time(forward, data, repeats)
+            result['{}_b{}'.format(runtime, batch_size)] = {
+                'latency_us': 1e6 * seconds,
+                'throughput': batch_size / seconds,
+            }
+
+    return result
+
+
+# #############################################################################
+#
+# Report
+#
+# #############################################################################
+
+
+def print_report(report, batch_sizes):
+    print('Model: {}'.format(report['model']))
+    if 'return' in report:
+        print('Return of fp32: {:.2f}'.format(report['return']))
+
+    for precision, result in report['variants'].items():
+        accuracy = ''
+        if 'agreement' in result:
+            accuracy = 'agreement {:.4f} (torch {:.4f})'.format(
+                result['agreement'], result['agreement_torch'])
+            if 'return' in result:
+                accuracy += ', return {:.2f}'.format(result['return'])
+        elif 'max_error' in result:
+            accuracy = 'max error {:.2e} (relative {:.2e})'.format(
+                result['max_error'], result['max_relative_error'])
+        print('{}\t{} bytes\t{}'.format(precision, result['bytes'], accuracy))
+
+        for runtime in ['torch', 'numpy']:
+            timings = [result.get('{}_b{}'.format(runtime, batch_size))
+                       for batch_size in batch_sizes]
+            if None in timings:
+                continue
+            print('  {:<6}'.format(runtime) + ''.join(
+                '  b{}: {:8.1f} us {:10.0f}/s'.format(
+                    batch_size, timing['latency_us'], timing['throughput'])
+                for batch_size, timing in zip(batch_sizes, timings)))
+
+
+# #############################################################################
+#
+# Main
+#
+# #############################################################################
+
+
+def main():
+    args = get_arguments()
+
+    reference = ExportedPolicy(args.model)
+    if reference.precision != 'fp32':
+        print('{} is not in fp32'.format(args.model))
+        sys.exit(1)
+
+    env_name = args.env or reference.meta.get('env')
+    if reference.output == 'linear':
+        env_name = None
+    rng = np.random.default_rng(args.seed)
+
+    report = {'model': args.model, 'env': env_name, 'variants': {}}
+    if env_name is not None:
+        returns, states = play(reference, env_name, args.episodes, args.seed)
+        states = states[rng.permutation(len(states))[:args.states]]
+        report['return'] = float(returns.mean())
+    else:
+        states = rng.normal(size=(args.states, reference.input_dim)).astype(
+            np.float32)
+
+    meta = {key: value for key, value in reference.meta.items()
+            if key not in ['precision', 'output']}
+    variants = [('fp32', args.model, reference)]
+    for precision in args.precisions:
+        path = variant_path(args.model, precision)
+        save_network(path, reference.weights, reference.biases, precision,
+                     reference.output, **meta)
+        variants.append((precision, path, ExportedPolicy(path)))
+
+    for precision, path, policy in variants:
+        result = {'path': path, 'bytes': os.path.getsize(path)}
+        if precision != 'fp32':
+            result.update(accuracy(reference, policy, states, env_name,
+                                   args.episodes, args.seed))
+        result.update(latency(policy, args.batch_sizes, args.repeats, rng))
+        report['variants'][precision] = result
+
+    print_report(report, args.batch_sizes)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+'''Regression gate of the training scripts against a stored baseline.
+
+Every case runs a script with a small configuration in a fresh
+interpreter, in a temporary folder, --repeats times with the seeds 0, 1,
+..., and measures:
+
+    wall_time      seconds of the whole process, startup included
+    steps_per_sec  environment steps per second of training, from the
+                   durations of the episodes in the metrics (see metrics.py)
+    peak_rss       peak resident memory of the process, in MB
+    curves         lengths of the episodes of every run of every agent
+
+HW03Q01 plays no episodes: its curve is the final weights it prints, and
+its steps per second come from the wall time. The cases of TensorFlow are
+skipped when it is not installed. Nothing is downloaded: the runs only
+need the packages of the scripts and a CPU.
+
+The results are compared with the baseline, and the gate fails (exit code
+1) when the steps per second drop, or the wall time or the peak memory
+grow, by more than their tolerance, when the learning curves of an
+agent shift, or when a case ran but has no baseline. Unchanged code gives the same curves from the same seeds;
+when they differ, e.g. after a change of the random numbers, the runs are
+compared as samples: a Welch t-test at level LEVEL of the mean length of
+the runs, and another of the mean length of their last tenth. The
+episodes of a run are correlated, so the runs are the samples, not the
+episodes. The runs of HW03Q02 are also tested against the matching cell
+of the reference sweep, REFERENCE.
+
+    python regression.py --update     # records data/regression_baseline.json
+    python regression.py              # compares with it
+
+The throughput depends on the machine: the baseline keeps a description
+of the machine it was recorded on, and a warning is printed when it is
+compared on another one.'''
+
+import os
+import re
+import sys
+import bisect
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+import importlib.metadata
+
+import numpy as np
+
+from metrics import read
+from threads import cpu_count
+from checkpoint import atomic_write
+from results_store import import_pickle
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(FOLDER, 'data', 'regression_baseline.json')
+REFERENCE = os.path.join(FOLDER, 'data', '2020-04-08T09-35-53_steps.pickle')
+REPEATS = 3
+THROUGHPUT_TOLERANCE = 0.2
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.2
+WEIGHT_TOLERANCE = 1e-6
+# two-sided level of the t-tests, and critical values of Student's t
+# distribution at that level by degrees of freedom
+LEVEL = 0.01
+T_TABLE = [(1, 63.657), (2, 9.925), (3, 5.841), (4, 4.604), (5, 4.032),
+           (6, 3.707), (7, 3.499), (8, 3.355), (9, 3.250), (10, 3.169),
+           (12, 3.055), (15, 2.947), (20, 2.845), (30, 2.750), (60, 2.660),
+           (120, 2.617)]
+T_NORMAL = 2.576
+PACKAGES = ['numpy', 'torch', 'gym', 'tensorflow', 'matplotlib']
+
+# runs a script and writes the peak memory of the process and its children
+WRAPPER = '''
+import sys, json, atexit, resource
+sys.path.insert(0, {folder!r})
+atexit.register(lambda: open({stats_path!r}, 'w').write(json.dumps(max(
+    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))))
+sys.argv = {argv!r}
+import runpy
+runpy.run_path(sys.argv[0], run_name="__main__")
+'''
+
+
+# #############################################################################
+#
+# Parser
+#
+# #############################################################################
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description='Compares the speed, memory and learning curves of the '
+        'training scripts with a stored baseline.')
+    parser.add_argument('--update', action='store_true',
+                        help='If this flag is set, the results are saved as '
+                        'the new baseline instead of being compared with it. '
+                        'The cases that are skipped keep their baseline.')
+    parser.add_argument('-b', '--baseline', type=str, default=BASELINE,
+                        help='JSON file of the baseline. Default: '
+                        + os.path.relpath(BASELINE, FOLDER))
+    parser.add_argument('-c', '--cases', type=str, default=None, nargs='*',
+                        help='Cases to run, by name, e.g. "HW03Q02 rf/ac". '
+                        'Default: all the cases.')
+    parser.add_argument('-n', '--repeats', type=int, default=REPEATS,
+                        help='Number of runs of every case, with the seeds '
+                        '0 to repeats - 1, to be the same as the baseline; '
+                        'the medians of the times and of the memory are '
+                        'compared. Default: ' + str(REPEATS))
+    parser.add_argument('--throughput_tolerance', type=float,
+                        default=THROUGHPUT_TOLERANCE,
+                        help='Largest relative drop of the steps per second. '
+                        'Default: ' + str(THROUGHPUT_TOLERANCE))
+    parser.add_argument('--time_tolerance', type=float,
+                        default=TIME_TOLERANCE,
+                        help='Largest relative increase of the wall time. '
+                        'Default: ' + str(TIME_TOLERANCE))
+    parser.add_argument('--memory_tolerance', type=float,
+                        default=MEMORY_TOLERANCE,
+                        help='Largest relative increase of the peak memory. '
+                        'Default: ' + str(MEMORY_TOLERANCE))
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='JSON file where the results and the checks '
+                        'are saved.')
+
+    return parser.parse_args()
+
+
+# #############################################################################
+#
+# Cases
+#
+# #############################################################################
+
+
+def cases():
+    '''name, command line, modules needed, and number of steps for the
+    cases that have no metrics. The cases with metrics take a --seed.'''
+
+    q02 = ['-e', '100', '--threads', '1', '--log_interval', '3600']
+
+    return [
+        ('HW03Q01 one_agent', ['HW03Q01.py', '--no_plot', '-s', '20000'],
+         [], 20000),
+        ('HW03Q01 agents_50', ['HW03Q01.py', '--no_plot', '-s', '1000',
+                               '-choose_implementation', 'agents_50'],
+         [], 50 * 1000),
+        ('HW03Q01 agents_50_variance',
+         ['HW03Q01.py', '--no_plot', '-s', '1000',
+          '-choose_implementation', 'agents_50_variance'], [], 50 * 1000),
+        ('HW03Q02 rf/ac', ['HW03Q02.py', '-n', '3', '-s', '32', '--alphas',
+                           '0.01'] + q02, ['torch', 'gym'], None),
+        ('bootstrap AC', ['HW03Q02_torch_bootstrap.py'] + q02,
+         ['torch', 'gym'], None),
+        ('TF AC', ['HW03Q02_tf.py'] + q02, ['tensorflow', 'gym'], None),
+    ]
+
+
+def reference_curves(folder, argv):
+    '''Runs of the cell of REFERENCE with the hidden size and the learning
+    rate of the HW03Q02 case, with as many episodes as in the case.'''
+
+    store = import_pickle(REFERENCE, os.path.join(folder, 'reference'))
+    config = store.args()
+    size_idx = config.hidden_size.index(int(argv[argv.index('-s') + 1]))
+    alpha_idx = config.alphas.index(float(argv[argv.index('--alphas') + 1]))
+    episodes = int(argv[argv.index('-e') + 1])
+
+    return {agent: np.asarray(store.cell(agent, size_idx, alpha_idx)
+                              [:, :episodes]).tolist()
+            for agent in ['rf', 'ac']}
+
+
+def curves_of(folder):
+    '''Lengths of the training episodes of every run (cell of the
+    metrics) of every agent (prefix of the cells, e.g. rf and ac), and the
+    seconds they took, from the metrics written in folder.'''
+
+    runs = {}
+    duration = 0.
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if not re.search(r'metrics\.\d+\.jsonl$', name):
+                continue
+            for row in read(os.path.join(root, name)):
+                # evaluations are not training episodes
+                if '/' in row['cell']:
+                    continue
+                runs.setdefault(row['cell'], []).append(row['length'])
+                duration += row['duration']
+
+    curves = {}
+    for cell in sorted(runs):
+        curves.setdefault(cell.split('_')[0], []).append(runs[cell])
+
+    return curves, duration
+
+
+def run_case(argv, steps, repeats):
+    '''Runs a case repeats times, with the seeds 0 to repeats - 1.
+
+    Output:
+    dictionary of the median wall time, steps per second and peak memory,
+    and of the curves of all the runs'''
+
+    times, speeds, memory = [], [], []
+    result = {'curves': {}}
+    env = dict(os.environ, MPLBACKEND='Agg', CUDA_VISIBLE_DEVICES='')
+    for repeat in range(repeats):
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, 'data'))
+            stats_path = os.path.join(folder, 'stats.json')
+            command = [os.path.join(FOLDER, argv[0])] + argv[1:]
+            if steps is None:
+                command += ['--seed', str(repeat)]
+            code = WRAPPER.format(folder=FOLDER, stats_path=stats_path,
+                                  argv=command)
+
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, '-c', code], cwd=folder,
+                                     env=env, capture_output=True, text=True)
+            times.append(time.perf_counter() - start)
+            if process.returncode != 0:
+                raise RuntimeError(process.stderr[-2000:])
+
+            with open(stats_path) as f:
+                # kB on Linux, bytes on macOS
+                memory.append(json.load(f) / (2**20 if sys.platform == 'darwin'
+                                              else 2**10))
+
+            if steps is None:
+                curves, duration = curves_of(folder)
+                speeds.append(sum(sum(map(sum, runs))
+                                  for runs in curves.values()) / duration)
+                for agent, runs in curves.items():
+                    result['curves'].setdefault(agent, []).extend(runs)
+            else:
+                # HW03Q01 prints the final weights instead of episodes
+                result['curves'] = {'weights': [float(w) for w in re.findall(
+                    r'w\d+=(\S+)', process.stdout)]}
+                speeds.append(steps / times[-1])
+
+    result.update(wall_time=float(np.median(times)),
+                  steps_per_sec=float(np.median(speeds)),
+                  peak_rss=float(np.median(memory)))
+
+    return result
+
+
+# #############################################################################
+#
+# Comparison
+#
+# #############################################################################
+
+
+def summary(runs):
+    '''Mean length of the episodes of every run, and of the last tenth of
+    its episodes.'''
+
+    return {'mean': [np.mean(run) for run in runs],
+            'last': [np.mean(run[-max(1, len(run) // 10):]) for run in runs]}
+
+
+def t_critical(df):
+    '''Critical value of Student's t distribution at LEVEL, rounded down
+    to the degrees of freedom of T_TABLE, so that it is conservative.'''
+
+    if df >= T_TABLE[-1][0]:
+        return T_NORMAL
+    idx = max(0, bisect.bisect_right([d for d, _ in T_TABLE], df) - 1)
+
+    return T_TABLE[idx][1]
+
+
+def welch_test(a, b):
+    '''Welch t-test of the means of two samples.
+
+    Output:
+    the statistic and its critical value at LEVEL, or None when there are
+    not enough runs to estimate the variances'''
+
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    if len(a) < 2 or len(b) < 2:
+        return None
+    va, vb = a.var(ddof=1) / len(a), b.var(ddof=1) / len(b)
+    if va + vb == 0:
+        # constant samples: any difference of the means is a shift
+        return (0., 0.) if a.mean() == b.mean() else (np.inf, 0.)
+    statistic = abs(a.mean() - b.mean()) / np.sqrt(va + vb)
+    df = (va + vb)**2 / (va**2 / (len(a) - 1) + vb**2 / (len(b) - 1))
+
+    return float(statistic), t_critical(df)
+
+
+def compare(name, base, current, args):
+    '''Checks of a case against its baseline.
+
+    Output:
+    list of (check, passed, description)'''
+
+    checks = []
+
+    def relative(metric, limit, higher_is_better):
+        change = current[metric] / base[metric] - 1
+        passed = (change >= -limit if higher_is_better else change <= limit)
+        checks.append((metric, passed, '{:.4g} -> {:.4g} ({:+.1%}, limit '
+                       '{}{:.0%})'.format(base[metric], current[metric],
+                                          change, '-' if higher_is_better
+                                          else '+', limit)))
+
+    relative('steps_per_sec', args.throughput_tolerance, True)
+    relative('wall_time', args.time_tolerance, False)
+    relative('peak_rss', args.memory_tolerance, False)
+
+    references = [('baseline', base['curves'])]
+    if 'reference' in current:
+        references.append(('reference', current['reference']))
+    for label, curves in references:
+        for agent, expected in curves.items():
+            found = current['curves'].get(agent)
+            check = '{} {}'.format(agent, label)
+            if agent == 'weights':
+                passed = found is not None and np.allclose(
+                    found, expected, rtol=WEIGHT_TOLERANCE)
+                # the values compared, as parsed from the output
+                checks.append((check, passed, 'final weights {}: {} -> '
+                               '{}'.format('unchanged' if passed else 'changed',
+                                           expected, found)))
+            elif not found:
+                checks.append((check, False, 'no episodes'))
+            elif found == expected:
+                checks.append((check, True, 'same episodes'))
+            else:
+                before, after = summary(expected), summary(found)
+                for stat in ['mean', 'last']:
+                    test = welch_test(after[stat], before[stat])
+                    if test is None:
+                        checks.append((
+                            '{} {}'.format(check, stat), False,
+                            'episodes changed, not enough runs to test them '
+                            '({} -> {}), use --repeats 2 or more'.format(
+                                len(expected), len(found))))
+                        continue
+                    statistic, critical = test
+                    checks.append((
+                        '{} {}'.format(check, stat), statistic <= critical,
+                        '{} runs {:.1f} -> {} runs {:.1f}, t {:.2f} '
+                        '(critical {:.2f})'.format(
+                            len(expected), np.mean(before[stat]), len(found),
+                            np.mean(after[stat]), statistic, critical)))
+
+    return checks
+
+
+def machine():
+    '''Description of the machine and of the versions of the packages.'''
+
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {'platform': platform.platform(), 'processor': platform.machine(),
+            'cpus': cpu_count(), 'python': platform.python_version(),
+            'packages': versions}
+
+
+# #############################################################################
+#
+# Main
+#
+# #############################################################################
+
+
+def main():
+    args = get_arguments()
+
+    baseline = {'machine': None, 'cases': {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.update:
+        print('No baseline in {}, record one with --update'.format(
+            args.baseline))
+        sys.exit(1)
+
+    host = machine()
+    if not args.update and baseline['machine'] != host:
+        print('Warning: the baseline was recorded on another machine or with '
+              'other packages, the times are not comparable:\n  {}\n  '
+              '{}'.format(baseline['machine'], host))
+
+    results = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as folder:
+        for name, argv, modules, steps in cases():
+            if args.cases is not None and name not in args.cases:
+                continue
+            missing = [m for m in modules if importlib.util.find_spec(m) is None]
+            if missing:
+                print('{}: skipped, {} not installed'.format(
+                    name, ', '.join(missing)))
+                continue
+
+            print('{}: {}'.format(name, ' '.join(argv)))
+            try:
+                result = run_case(argv, steps, args.repeats)
+            except RuntimeError as error:
+                print('{}: FAILED to run\n{}'.format(name, error))
+                failures.append((name, 'run', str(error)))
+                continue
+            print('  {:.2f} s, {:.0f} steps/s, {:.0f} MB'.format(
+                result['wall_time'], result['steps_per_sec'],
+                result['peak_rss']))
+            results[name] = result
+
+            if args.update:
+                continue
+            if name.startswith('HW03Q02 '):
+                result['reference'] = reference_curves(folder, argv)
+            if name not in baseline['cases']:
+                description = 'no baseline, record one with --update'
+                print('  {:<6}{:<20}{}'.format('FAIL', 'baseline',
+                                               description))
+                failures.append((name, 'baseline', description))
+                continue
+            result['checks'] = compare(name, baseline['cases'][name], result,
+                                       args)
+            for check, passed, description in result['checks']:
+                print('  {:<6}{:<20}{}'.format('ok' if passed else 'FAIL',
+                                               check, description))
+                if not passed:
+                    failures.append((name, check, description))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': host, 'cases': results}, f, indent=2)
+
+    if args.update:
+        baseline['machine'] = host
+        baseline['cases'].update(results)
+        atomic_write(args.baseline, lambda f: f.write(
+            json.dumps(baseline, indent=1).encode()))
+        print('Baseline saved in {}'.format(args.baseline))
+    elif failures:
+        print('\nREGRESSION: {} check{} failed'.format(
+            len(failures), 's' if len(failures) > 1 else ''))
+        for name, check, description in failures:
+            print('  {}: {}: {}'.format(name, check,
+                                        description.splitlines()[-1]))
+        sys.exit(1)
+    else:
+        print('\nNo regression')
+
+
+if __name__ == '__main__':
+    main()
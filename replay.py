@@ -0,0 +1,217 @@
+'''Experience replay stored in preallocated ring arrays.
+
+A transition is one row of the arrays of the buffer, so adding it is O(1)
+and creates no Python object, and a minibatch is gathered with one fancy
+index per array:
+
+    states       (capacity, state_dim) float32
+    actions      (capacity,)           int64
+    rewards      (capacity,)           float32
+    next_states  (capacity, state_dim) float32
+    dones        (capacity,)           bool
+    probs        (capacity, n_actions) float32, the behaviour policy
+
+The behaviour probabilities let an off-policy learner correct for the
+policy having changed since the transition was played (see the importance
+weights of HW03Q02_torch_bootstrap.py).
+
+PrioritizedReplayBuffer samples transitions proportionally to a priority
+(e.g. the TD error) with a sum tree, and returns the importance-sampling
+weights correcting for it. Reference: Schaul et al., Prioritized
+Experience Replay (2016).'''
+
+import numpy as np
+
+PRIORITY_EXPONENT = 0.6
+IMPORTANCE_EXPONENT = 0.4
+MIN_PRIORITY = 1e-6
+
+
+# #############################################################################
+#
+# Uniform
+#
+# #############################################################################
+
+
+class ReplayBuffer():
+    '''Input:
+    capacity  : number of transitions kept, the oldest are overwritten
+    state_dim : size of a state
+    n_actions : number of actions
+    seed      : seed of the sampling'''
+
+    def __init__(self, capacity, state_dim, n_actions, seed=None):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.probs = np.zeros((capacity, n_actions), dtype=np.float32)
+
+        # index of the next row written, and number of rows written
+        self.head = 0
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done, probs):
+        '''Adds one transition, overwriting the oldest one when the buffer
+        is full.
+
+        Output:
+        index of the transition'''
+
+        idx = self.head
+        self.states[idx] = state
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        self.next_states[idx] = next_state
+        self.dones[idx] = done
+        self.probs[idx] = probs
+
+        self.head = (idx + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+        return idx
+
+    def gather(self, indices):
+        '''Transitions at indices, as a dictionary of arrays.'''
+
+        return {
+            'indices': indices,
+            'states': self.states[indices],
+            'actions': self.actions[indices],
+            'rewards': self.rewards[indices],
+            'next_states': self.next_states[indices],
+            'dones': self.dones[indices],
+            'probs': self.probs[indices],
+        }
+
+    def sample(self, batch_size):
+        '''batch_size transitions drawn uniformly, with replacement. The
+        importance-sampling weights are all 1.'''
+
+        batch = self.gather(self.rng.integers(self.size, size=batch_size))
+        batch['weights'] = np.ones(batch_size, dtype=np.float32)
+
+        return batch
+
+    def update_priorities(self, indices, errors):
+        '''Priorities are not used by uniform sampling.'''
+
+        pass
+
+
+# #############################################################################
+#
+# Prioritized
+#
+# #############################################################################
+
+
+class SumTree():
+    '''Binary tree whose leaves are the priorities of the transitions and
+    whose nodes are the sums of their children, in one array: node n has
+    children 2n and 2n + 1, and the leaves start at node size.'''
+
+    def __init__(self, capacity):
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.nodes = np.zeros(2 * self.size)
+
+    def total(self):
+        return self.nodes[1]
+
+    def update(self, indices, priorities):
+        '''Sets the priorities of the leaves at indices, and the sums of
+        their parents, one level at a time.'''
+
+        nodes = np.asarray(indices) + self.size
+        self.nodes[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.nodes[nodes] = (self.nodes[2 * nodes]
+                                 + self.nodes[2 * nodes + 1])
+            nodes = np.unique(nodes // 2)
+
+    def set(self, index, priority):
+        '''Same as update for a single leaf, without the array overhead.'''
+
+        node = index + self.size
+        self.nodes[node] = priority
+        node //= 2
+        while node >= 1:
+            self.nodes[node] = self.nodes[2 * node] + self.nodes[2 * node + 1]
+            node //= 2
+
+    def find(self, values):
+        '''Leaves whose cumulated priorities contain values, all the values
+        descending the tree together.'''
+
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=float)
+        while nodes[0] < self.size:
+            left = 2 * nodes
+            go_right = values >= self.nodes[left]
+            values -= np.where(go_right, self.nodes[left], 0)
+            nodes = left + go_right
+
+        return nodes - self.size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    '''Replay buffer sampling the transitions proportionally to their
+    priority p ** priority_exponent. A new transition gets the largest
+    priority seen so far, so it is sampled at least once.
+
+    Input:
+    priority_exponent   : 0 is uniform sampling, 1 fully prioritized
+    importance_exponent : exponent of the importance-sampling weights, 1
+                          fully corrects for the prioritization'''
+
+    def __init__(self, capacity, state_dim, n_actions, seed=None,
+                 priority_exponent=PRIORITY_EXPONENT,
+                 importance_exponent=IMPORTANCE_EXPONENT):
+        super(PrioritizedReplayBuffer, self).__init__(
+            capacity, state_dim, n_actions, seed)
+        self.tree = SumTree(capacity)
+        self.priority_exponent = priority_exponent
+        self.importance_exponent = importance_exponent
+        self.max_priority = 1.
+
+    def add(self, state, action, reward, next_state, done, probs):
+        idx = super(PrioritizedReplayBuffer, self).add(
+            state, action, reward, next_state, done, probs)
+        self.tree.set(idx, self.max_priority)
+
+        return idx
+
+    def sample(self, batch_size):
+        '''batch_size transitions drawn proportionally to their priority,
+        with stratified sampling, and their importance-sampling weights
+        normalised by their maximum.'''
+
+        total = self.tree.total()
+        bounds = np.linspace(0, total, batch_size + 1)
+        values = self.rng.uniform(bounds[:-1], bounds[1:])
+        indices = np.minimum(self.tree.find(values), self.size - 1)
+
+        batch = self.gather(indices)
+        probabilities = self.tree.nodes[indices + self.tree.size] / total
+        weights = (self.size * probabilities) ** -self.importance_exponent
+        batch['weights'] = (weights / weights.max()).astype(np.float32)
+
+        return batch
+
+    def update_priorities(self, indices, errors):
+        '''Sets the priorities of the transitions at indices from their
+        errors, e.g. the absolute TD errors.'''
+
+        priorities = (np.abs(errors) + MIN_PRIORITY) ** self.priority_exponent
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities)
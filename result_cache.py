@@ -0,0 +1,125 @@
+'''Content-addressed cache of the steps per episode of single runs.
+
+A run is identified by the hash of its full configuration (environment,
+agent, hidden size, learning rate, discount, number of episodes, maximum
+number of steps, seed and version of the code), so re-running a sweep that
+overlaps with an earlier one only trains the runs that were never seen.
+
+    <folder>/<key>.npy    steps of every episode of the run
+    <folder>/<key>.json   configuration of the run
+
+The cache is bounded in size: when it grows larger than max_bytes, the
+least recently used entries are removed.'''
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from checkpoint import atomic_write
+
+
+def source_version(*paths):
+    '''Hash of the source files, used as the version of the code.'''
+
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()[:16]
+
+
+class ResultCache():
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(config):
+        '''Hash of a configuration given as a dictionary.'''
+
+        text = json.dumps(config, sort_keys=True, default=str)
+
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.folder, key + extension)
+
+    def get(self, key):
+        '''Returns the cached steps, or None if the run is not cached.'''
+
+        path = self._path(key, '.npy')
+        try:
+            scores = np.load(path)
+        except FileNotFoundError:
+            return None
+
+        # the modification time orders the entries for the eviction
+        os.utime(path)
+
+        return scores
+
+    def put(self, key, scores, config):
+        atomic_write(self._path(key, '.json'), lambda f: f.write(
+            json.dumps(config, indent=2, default=str).encode()))
+        atomic_write(self._path(key, '.npy'),
+                     lambda f: np.save(f, np.asarray(scores)))
+        self.evict()
+
+    def entries(self):
+        '''List of (last use, size in bytes, key) of the cached runs.'''
+
+        entries = []
+        for filename in os.listdir(self.folder):
+            key, extension = os.path.splitext(filename)
+            if extension != '.npy':
+                continue
+            try:
+                stat = os.stat(self._path(key, '.npy'))
+                size = stat.st_size + os.path.getsize(self._path(key, '.json'))
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                continue
+            entries.append((stat.st_mtime, size, key))
+
+        return entries
+
+    def remove(self, key):
+        for extension in ['.npy', '.json']:
+            try:
+                os.remove(self._path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        '''Removes the least recently used runs until the cache fits in
+        max_bytes.'''
+
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+    def invalidate(self, **fields):
+        '''Removes the runs whose configuration matches all the given
+        fields (compared as strings), or every run if no field is given.
+
+        Output:
+        number of removed runs'''
+
+        removed = 0
+        for _, _, key in self.entries():
+            with open(self._path(key, '.json')) as f:
+                config = json.load(f)
+            if all(str(config.get(name)) == str(value)
+                   for name, value in fields.items()):
+                self.remove(key)
+                removed += 1
+
+        return removed
@@ -0,0 +1,374 @@
+'''SQLite index of the saved results of the HW03Q02 sweeps.
+
+The results are ResultsStore folders (see results_store.py), and pickles of
+[steps_rf, steps_ac, args] from older versions, which are converted to
+stores the first time they are indexed. The index records, per results
+file, its configuration and, per cell (agent, hidden size, learning rate),
+the shape, the summary of the steps and where the steps are in the chunk:
+
+    files   path, signature of the files, shape, configuration as JSON
+    config  path, key, value: one row per argument of the sweep
+    cells   path, agent, hidden_size, alpha, runs, episodes, mean, last,
+            best, played, chunk, offset, dtype
+
+so finding the cells of a question only reads the index, and reading their
+steps only maps the bytes of these cells:
+
+    index = ResultsIndex()
+    index.update()
+    for cell in index.cells(agent='ac', hidden_size=64, gamma=0.99):
+        steps = index.steps(cell, episodes=slice(0, 100))
+
+The index is updated incrementally: a file is only read again when its
+modification time or its size changed, and the files that disappeared are
+removed. HW03Q02 adds its results when it saves them.
+
+    python results_index.py update
+    python results_index.py query --agent ac --hidden_size 64 gamma=0.99'''
+
+import os
+import json
+import sqlite3
+import argparse
+import contextlib
+
+import numpy as np
+
+from results_store import STORE_SUFFIX, ResultsStore, import_pickle
+
+SAVED_MODELS_FOLDER = './data/'
+INDEX_NAME = 'results.sqlite'
+# version of the tables, the index is rebuilt when it changes
+INDEX_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, signature TEXT, agents TEXT, hidden_size TEXT,
+    alphas TEXT, runs INTEGER, episodes INTEGER, config TEXT);
+CREATE TABLE IF NOT EXISTS config (
+    path TEXT, key TEXT, value);
+CREATE TABLE IF NOT EXISTS cells (
+    path TEXT, agent TEXT, size_idx INTEGER, alpha_idx INTEGER,
+    hidden_size INTEGER, alpha REAL, runs INTEGER, episodes INTEGER,
+    mean REAL, last REAL, best INTEGER, played INTEGER, chunk TEXT,
+    offset INTEGER, dtype TEXT);
+CREATE INDEX IF NOT EXISTS config_key ON config (key, value);
+CREATE INDEX IF NOT EXISTS cells_query ON cells (agent, hidden_size, alpha);
+'''
+CELL_COLUMNS = ['path', 'agent', 'size_idx', 'alpha_idx', 'hidden_size',
+                'alpha', 'runs', 'episodes', 'mean', 'last', 'best', 'played',
+                'chunk', 'offset', 'dtype']
+
+
+# #############################################################################
+#
+# Files
+#
+# #############################################################################
+
+
+def signature(path):
+    '''Modification time and size of a file, or of the files of a folder,
+    that change when the results are written again.'''
+
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    else:
+        paths = [path]
+    stats = [os.stat(p) for p in paths if os.path.isfile(p)]
+
+    return '{}:{}:{}'.format(len(stats), max(s.st_mtime_ns for s in stats),
+                             sum(s.st_size for s in stats))
+
+
+def results_files(folder):
+    '''Stores and pickles of steps of folder. The pickles that were already
+    converted to a store are left out, their store is indexed instead.'''
+
+    names = sorted(os.listdir(folder))
+    paths = []
+    for name in names:
+        path = os.path.join(folder, name)
+        if name.endswith(STORE_SUFFIX):
+            if os.path.exists(os.path.join(path, 'meta.json')):
+                paths.append(path)
+        elif (name.endswith('.pickle')
+              and name[:-len('.pickle')] + STORE_SUFFIX not in names):
+            paths.append(path)
+
+    return paths
+
+
+def data_offset(path):
+    '''Offset of the data in a .npy file, after its header.'''
+
+    with open(path, 'rb') as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            np.lib.format.read_array_header_1_0(f)
+        else:
+            np.lib.format.read_array_header_2_0(f)
+
+        return f.tell()
+
+
+def summarise(steps):
+    '''Summary of the (runs, episodes) steps of a cell, 0 meaning that the
+    episode was not played.
+
+    Output:
+    mean steps of the played episodes, mean of the last tenth of the
+    episodes played by every run, longest episode and number of played
+    episodes'''
+
+    steps = np.asarray(steps, dtype=np.float64)
+    played = steps > 0
+    count = int(played.sum())
+    if not count:
+        return None, None, 0, 0
+
+    lasts = []
+    for run, mask in zip(steps, played):
+        run = run[mask]
+        if len(run):
+            lasts.append(run[-max(1, len(run) // 10):].mean())
+
+    return (float(steps[played].mean()), float(np.mean(lasts)),
+            int(steps.max()), count)
+
+
+# #############################################################################
+#
+# Index
+#
+# #############################################################################
+
+
+class ResultsIndex():
+    '''SQLite index of the results of a folder.
+
+    Input:
+    folder : folder of the results
+    path   : (optional) file of the index, INDEX_NAME in folder by
+             default'''
+
+    def __init__(self, folder=SAVED_MODELS_FOLDER, path=None):
+        self.folder = folder
+        self.path = path or os.path.join(folder, INDEX_NAME)
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != INDEX_VERSION:
+            with self.db:
+                for table in ['files', 'config', 'cells']:
+                    self.db.execute('DROP TABLE IF EXISTS ' + table)
+                self.db.execute('PRAGMA user_version = {}'.format(
+                    INDEX_VERSION))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def key(self, path):
+        '''Path of a results file relative to the folder, as stored.'''
+
+        return os.path.relpath(path, self.folder)
+
+    def update(self, verbose=False):
+        '''Indexes the new and modified results of the folder and forgets
+        the removed ones.
+
+        Output:
+        number of files indexed'''
+
+        paths = results_files(self.folder)
+        known = dict(self.db.execute('SELECT path, signature FROM files'))
+        present = {self.key(p) for p in paths}
+
+        with self.db:
+            for key in set(known) - present:
+                self.remove(key)
+
+        count = 0
+        for path in paths:
+            if known.get(self.key(path)) != signature(path):
+                if verbose:
+                    print('Indexing {}'.format(self.key(path)))
+                self.add(path)
+                count += 1
+
+        return count
+
+    def remove(self, key):
+        for table in ['files', 'config', 'cells']:
+            self.db.execute('DELETE FROM {} WHERE path = ?'.format(table),
+                            (key,))
+
+    def add(self, path):
+        '''Indexes one store or pickle, replacing its previous entries.'''
+
+        key = self.key(path)
+        sig = signature(path)
+        if path.endswith('.pickle'):
+            store = import_pickle(path)
+            key = self.key(store.folder)
+            sig = signature(store.folder)
+        else:
+            store = ResultsStore(path)
+        meta = store.meta
+
+        rows = []
+        for agent in meta['agents']:
+            for size_idx, hidden_size in enumerate(meta['hidden_size']):
+                for alpha_idx, alpha in enumerate(meta['alphas']):
+                    chunk = store.chunk_path(agent, size_idx, alpha_idx)
+                    if not os.path.exists(chunk):
+                        continue
+                    steps = store.cell(agent, size_idx, alpha_idx)
+                    rows.append((key, agent, size_idx, alpha_idx, hidden_size,
+                                 alpha, steps.shape[0], steps.shape[1])
+                                + summarise(steps)
+                                + (os.path.basename(chunk), data_offset(chunk),
+                                   str(steps.dtype)))
+
+        config = [(key, name, value if isinstance(value, (int, float, str))
+                   or value is None else json.dumps(value, default=str))
+                  for name, value in meta['config'].items()]
+
+        with self.db:
+            self.remove(key)
+            self.db.execute(
+                'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, sig, json.dumps(meta['agents']),
+                 json.dumps(meta['hidden_size']), json.dumps(meta['alphas']),
+                 meta['runs'], meta['episodes'],
+                 json.dumps(meta['config'], default=str)))
+            self.db.executemany('INSERT INTO config VALUES (?, ?, ?)', config)
+            self.db.executemany('INSERT INTO cells VALUES ({})'.format(
+                ', '.join('?' * len(CELL_COLUMNS))), rows)
+
+    def cells(self, agent=None, hidden_size=None, alpha=None, **config):
+        '''Cells matching the agent, the hidden size, the learning rate and
+        the other arguments of the sweep given as keywords, e.g. gamma=0.99.
+
+        Output:
+        list of sqlite3.Row with the columns CELL_COLUMNS'''
+
+        conditions, values = [], []
+        for column, value in [('agent', agent), ('hidden_size', hidden_size),
+                              ('alpha', alpha)]:
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                values.append(value)
+        for name, value in config.items():
+            conditions.append('path IN (SELECT path FROM config WHERE key = ? '
+                              'AND value = ?)')
+            values.extend([name, value])
+
+        query = 'SELECT * FROM cells'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY path, agent, size_idx, alpha_idx'
+
+        return self.db.execute(query, values).fetchall()
+
+    def steps(self, cell, runs=slice(None), episodes=slice(None)):
+        '''Steps of a cell returned by cells, memory-mapped so that only the
+        selected runs and episodes are read.'''
+
+        chunk = os.path.join(self.folder, cell['path'], cell['chunk'])
+        data = np.memmap(chunk, dtype=cell['dtype'], mode='r',
+                         offset=cell['offset'],
+                         shape=(cell['runs'], cell['episodes']))
+
+        return data[runs, episodes]
+
+    def config(self, path):
+        '''Arguments of the sweep of a results file, as a dictionary.'''
+
+        row = self.db.execute('SELECT config FROM files WHERE path = ?',
+                              (path,)).fetchone()
+
+        return None if row is None else json.loads(row['config'])
+
+
+def index_results(path, folder=SAVED_MODELS_FOLDER):
+    '''Adds one results file of folder to its index.'''
+
+    with contextlib.closing(ResultsIndex(folder)) as index:
+        index.add(path)
+
+
+# #############################################################################
+#
+# Parser
+#
+# #############################################################################
+
+
+def config_value(text):
+    '''Value of a KEY=VALUE argument of a query, as a number if it is one.'''
+
+    for kind in [int, float]:
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+
+    return text
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description='Index of the saved results of the HW03Q02 sweeps.')
+    parser.add_argument('-d', '--folder', type=str,
+                        default=SAVED_MODELS_FOLDER,
+                        help='Folder of the results. Default: '
+                        + SAVED_MODELS_FOLDER)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('update', help='Indexes the new and modified '
+                        'results.')
+    query = commands.add_parser('query', help='Lists the cells matching a '
+                                'query, after updating the index.')
+    query.add_argument('--agent', type=str, default=None, choices=['rf', 'ac'],
+                       help='Agent of the cells.')
+    query.add_argument('--hidden_size', type=int, default=None,
+                       help='Size of the hidden layer of the cells.')
+    query.add_argument('--alpha', type=float, default=None,
+                       help='Learning rate of the cells.')
+    query.add_argument('config', nargs='*', default=[],
+                       help='Other arguments of the sweeps, as KEY=VALUE, '
+                       'e.g. gamma=0.99.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+
+    with contextlib.closing(ResultsIndex(args.folder)) as index:
+        count = index.update(verbose=True)
+        if args.command == 'update':
+            print('{} file{} indexed in {}'.format(
+                count, 's' if count != 1 else '', index.path))
+            return
+
+        config = {}
+        for item in args.config:
+            name, _, value = item.partition('=')
+            config[name] = config_value(value)
+        cells = index.cells(args.agent, args.hidden_size, args.alpha, **config)
+
+        print('{:<40}{:<6}{:>8}{:>10}{:>6}{:>9}{:>8}{:>8}'.format(
+            'file', 'agent', 'hidden', 'alpha', 'runs', 'episodes', 'mean',
+            'last'))
+        for cell in cells:
+            print('{:<40}{:<6}{:>8}{:>10g}{:>6}{:>9}{:>8.1f}{:>8.1f}'.format(
+                cell['path'], cell['agent'], cell['hidden_size'],
+                cell['alpha'], cell['runs'], cell['episodes'],
+                cell['mean'] or 0, cell['last'] or 0))
+        print('{} cell{}'.format(len(cells), 's' if len(cells) != 1 else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+'''Chunked storage of the steps per episode of the HW03Q02 sweeps.
+
+A store is a folder:
+
+    <folder>/meta.json                          configuration of the sweep
+    <folder>/<agent>_<size_idx>_<alpha_idx>.npy steps of one cell
+
+Each chunk holds the (runs, episodes) steps of one (agent, hidden_size,
+alpha) cell as unsigned integers. Chunks are memory-mapped when read, so
+plotting one panel only reads the chunks of that panel. A value of 0 means
+that the episode was not played.'''
+
+import os
+import json
+import pickle
+import argparse
+
+import numpy as np
+
+from checkpoint import atomic_write
+
+STORE_SUFFIX = '.steps'
+FORMAT_VERSION = 1
+
+
+# #############################################################################
+#
+# Store
+#
+# #############################################################################
+
+
+def compact_dtype(*arrays):
+    '''Smallest unsigned type holding the steps of all the arrays.'''
+
+    largest = max(np.max(a) if np.size(a) else 0 for a in arrays)
+
+    return 'uint16' if largest < 2**16 else 'uint32'
+
+
+class ResultsStore():
+    '''Folder of per-cell chunks with a JSON header.'''
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.shape = (len(self.meta['hidden_size']), len(self.meta['alphas']),
+                      self.meta['runs'], self.meta['episodes'])
+        self.dtype = np.dtype(self.meta['dtype'])
+
+    @classmethod
+    def create(cls, folder, agents, sizes, alphas, runs, episodes, config,
+               dtype='uint16'):
+        '''Creates an empty store.
+
+        Input:
+        folder   : folder of the store
+        agents   : names of the agents, e.g. ['rf', 'ac']
+        sizes    : sizes of the hidden layer
+        alphas   : learning rates
+        runs     : number of runs per cell
+        episodes : number of episodes per run
+        config   : dictionary of the arguments of the sweep
+        dtype    : type of the chunks, large enough for the longest episode'''
+
+        os.makedirs(folder, exist_ok=True)
+        meta = {
+            'version': FORMAT_VERSION,
+            'dtype': dtype,
+            'agents': list(agents),
+            'hidden_size': list(sizes),
+            'alphas': list(alphas),
+            'runs': runs,
+            'episodes': episodes,
+            'config': config,
+        }
+        atomic_write(os.path.join(folder, 'meta.json'), lambda f: f.write(
+            json.dumps(meta, indent=2, default=str).encode()))
+
+        return cls(folder)
+
+    def args(self):
+        '''Arguments of the sweep, as returned by get_arguments.'''
+
+        config = dict(self.meta['config'])
+        for key in ['hidden_size', 'alphas', 'runs', 'episodes']:
+            config[key] = self.meta[key]
+
+        return argparse.Namespace(**config)
+
+    def chunk_path(self, agent, size_idx, alpha_idx):
+        return os.path.join(self.folder, '{}_{}_{}.npy'.format(
+            agent, size_idx, alpha_idx))
+
+    def write(self, agent, size_idx, alpha_idx, data):
+        '''Writes the (runs, episodes) steps of one cell.'''
+
+        data = np.rint(data).astype(self.dtype)
+        atomic_write(self.chunk_path(agent, size_idx, alpha_idx),
+                     lambda f: np.save(f, data))
+
+    def write_agent(self, agent, steps):
+        '''Writes the (sizes, alphas, runs, episodes) steps of one agent.'''
+
+        for size_idx in range(steps.shape[0]):
+            for alpha_idx in range(steps.shape[1]):
+                self.write(agent, size_idx, alpha_idx,
+                           steps[size_idx, alpha_idx])
+
+    def cell(self, agent, size_idx, alpha_idx):
+        '''Memory-mapped (runs, episodes) steps of one cell.'''
+
+        path = self.chunk_path(agent, size_idx, alpha_idx)
+        if not os.path.exists(path):
+            return np.zeros(self.shape[2:], dtype=self.dtype)
+
+        return np.load(path, mmap_mode='r')
+
+    def steps(self, agent):
+        '''Lazy (sizes, alphas, runs, episodes) array of one agent.'''
+
+        return LazySteps(self, agent)
+
+    def write_array(self, name, data):
+        '''Writes an array that is not split in chunks, e.g. the episode at
+        which each run was solved.'''
+
+        atomic_write(os.path.join(self.folder, name + '.npy'),
+                     lambda f: np.save(f, np.asarray(data)))
+
+    def array(self, name):
+        '''Array saved by write_array, or None if there is none.'''
+
+        path = os.path.join(self.folder, name + '.npy')
+        if not os.path.exists(path):
+            return None
+
+        return np.load(path, mmap_mode='r')
+
+
+class LazySteps():
+    '''Array-like view of the steps of one agent. Indexing only reads the
+    chunks of the selected cells.'''
+
+    def __init__(self, store, agent):
+        self.store = store
+        self.agent = agent
+        self.shape = store.shape
+        self.dtype = store.dtype
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (4 - len(key))
+        size_key, alpha_key, rest = key[0], key[1], key[2:]
+
+        if isinstance(size_key, slice):
+            sizes = range(self.shape[0])[size_key]
+            return np.stack([self[(s, alpha_key) + rest] for s in sizes])
+        if isinstance(alpha_key, slice):
+            alphas = range(self.shape[1])[alpha_key]
+            return np.stack([self[(size_key, a) + rest] for a in alphas])
+
+        return self.store.cell(self.agent, size_key, alpha_key)[rest]
+
+    def __array__(self, dtype=None):
+        data = self[:, :]
+        return data if dtype is None else data.astype(dtype)
+
+
+# #############################################################################
+#
+# Pickles
+#
+# #############################################################################
+
+
+def import_pickle(path, folder=None):
+    '''Converts a [steps_rf, steps_ac, args] pickle saved by HW03Q02 into a
+    store, saved next to it unless folder is given. The conversion is done
+    only once.'''
+
+    if folder is None:
+        folder = os.path.splitext(path)[0] + STORE_SUFFIX
+    if os.path.exists(os.path.join(folder, 'meta.json')):
+        return ResultsStore(folder)
+
+    with open(path, 'rb') as f:
+        steps_rf, steps_ac, args = pickle.load(f)
+
+    sizes, alphas, runs, episodes = steps_rf.shape
+    config = vars(args)
+    store = ResultsStore.create(
+        folder, ['rf', 'ac'],
+        config.get('hidden_size', list(range(sizes)))[:sizes],
+        config.get('alphas', list(range(alphas)))[:alphas],
+        runs, episodes, config, compact_dtype(steps_rf, steps_ac))
+    store.write_agent('rf', steps_rf)
+    store.write_agent('ac', steps_ac)
+
+    return store
+
+
+def open_results(path):
+    '''Opens a store, or imports a .pickle file into a store.'''
+
+    if path.endswith('.pickle'):
+        return import_pickle(path)
+
+    return ResultsStore(path)
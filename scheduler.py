@@ -0,0 +1,110 @@
+'''Asynchronous successive halving (ASHA) over a grid of configurations.
+
+Every configuration starts with a small budget (rung 0). A configuration
+of rung k is promoted to rung k + 1, with eta times more budget, when it is
+among the best 1 / eta configurations that finished rung k. There are at
+most floor(log_eta(len(configs))) + 1 rungs, the last one with the full
+budget, so that the best configuration reaches it. Promotions are
+decided as soon as a worker asks for a job, without waiting for the whole
+rung to finish, so several workers can share one scheduler. With a single
+worker, synchronous promotions wait until every configuration of a rung
+finished it, so that exactly len(configs) // eta**k configurations reach
+rung k.
+
+Reference: Li et al., A System for Massively Parallel Hyperparameter
+Tuning (2020).'''
+
+ETA = 3
+
+
+class SuccessiveHalving():
+    '''Input:
+    configs    : list of hashable configurations
+    min_budget : budget of rung 0
+    max_budget : budget of the last rung
+    eta        : reduction factor between two rungs
+    synchronous: if True, the promotions of a rung wait for all its jobs,
+                 which must be reported before the next job is asked for'''
+
+    def __init__(self, configs, min_budget, max_budget, eta=ETA,
+                 synchronous=False):
+        assert 0 < min_budget <= max_budget
+        assert eta > 1
+
+        # eta**k configurations are needed to promote one of them k times
+        n_rungs = 1
+        while eta**n_rungs <= len(configs):
+            n_rungs += 1
+
+        self.budgets = []
+        budget = min_budget
+        while budget < max_budget and len(self.budgets) < n_rungs - 1:
+            self.budgets.append(budget)
+            budget *= eta
+        self.budgets.append(max_budget)
+
+        self.eta = eta
+        self.synchronous = synchronous
+        self.n_configs = len(configs)
+        self.pending = list(configs)
+        # scores of the configurations that finished each rung
+        self.rungs = [{} for _ in self.budgets]
+        self.promoted = [set() for _ in self.budgets]
+
+    def next_job(self):
+        '''Returns the next (config, rung) to run, or None when there is
+        nothing left to run.'''
+
+        if self.synchronous:
+            return self.next_synchronous_job()
+
+        # promotions first, from the top rung down
+        for rung in reversed(range(len(self.budgets) - 1)):
+            scores = self.rungs[rung]
+            n_promotable = len(scores) // self.eta
+            best = sorted(scores, key=scores.get, reverse=True)[:n_promotable]
+            for config in best:
+                if config not in self.promoted[rung]:
+                    self.promoted[rung].add(config)
+                    return config, rung + 1
+
+        if self.pending:
+            return self.pending.pop(0), 0
+
+        return None
+
+    def next_synchronous_job(self):
+        '''Same as next_job, but a rung is only promoted from once every
+        configuration that entered it finished it.'''
+
+        if self.pending:
+            return self.pending.pop(0), 0
+
+        entered = self.n_configs
+        for rung in range(len(self.budgets) - 1):
+            scores = self.rungs[rung]
+            if len(scores) < entered:
+                return None
+            n_promotable = len(scores) // self.eta
+            best = sorted(scores, key=scores.get, reverse=True)[:n_promotable]
+            for config in best:
+                if config not in self.promoted[rung]:
+                    self.promoted[rung].add(config)
+                    return config, rung + 1
+            entered = n_promotable
+
+        return None
+
+    def report(self, config, rung, score):
+        '''Records the score (higher is better) of config at the end of
+        rung.'''
+
+        self.rungs[rung][config] = score
+
+    def last_rung(self, config):
+        '''Highest rung finished by config, or -1.'''
+
+        finished = [rung for rung, scores in enumerate(self.rungs)
+                    if config in scores]
+
+        return max(finished, default=-1)
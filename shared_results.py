@@ -0,0 +1,192 @@
+'''Steps per episode of a running sweep, in shared memory.
+
+The block holds the (sizes, alphas, runs, episodes) steps of one agent and
+the number of episodes already written for every run:
+
+    shape     4 x int64
+    progress  (sizes, alphas, runs) int64
+    steps     (sizes, alphas, runs, episodes) uint32
+
+Worker processes write the steps of their run in place after every
+episode, so nothing is sent back to the parent, and any process knowing
+the name of the block can follow the sweep. The parent writes that name in
+<sweep folder>/shared.json, which the monitor reads:
+
+    python shared_results.py data/<sweep> [--plot]'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from multiprocessing import resource_tracker, shared_memory
+
+from checkpoint import atomic_write
+
+DTYPE = np.uint32
+INTERVAL = 2.0
+
+
+class SharedResults():
+    '''Input:
+    shape : (sizes, alphas, runs, episodes) to create a new block
+    name  : name of an existing block to attach to
+    track : when attaching, whether the block is removed when this process
+            exits. Worker processes share the tracker of their parent, a
+            monitor started on its own must not remove the block.'''
+
+    def __init__(self, shape=None, name=None, track=True):
+        if shape is not None:
+            shape = tuple(shape)
+            size = (8 * (4 + int(np.prod(shape[:3])))
+                    + np.dtype(DTYPE).itemsize * int(np.prod(shape)))
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            np.ndarray(4, dtype=np.int64, buffer=self.memory.buf)[:] = shape
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            if not track:
+                resource_tracker.unregister(self.memory._name, 'shared_memory')
+            shape = tuple(np.ndarray(4, dtype=np.int64,
+                                     buffer=self.memory.buf).tolist())
+            self.owner = False
+
+        self.name = self.memory.name
+        self.shape = shape
+        self.progress = np.ndarray(shape[:3], dtype=np.int64,
+                                   buffer=self.memory.buf, offset=8 * 4)
+        self.steps = np.ndarray(shape, dtype=DTYPE, buffer=self.memory.buf,
+                                offset=8 * (4 + self.progress.size))
+
+    def __reduce__(self):
+        # processes started with spawn attach to the block by name
+        return SharedResults, (None, self.name)
+
+    def update(self, index, scores):
+        '''Writes the scores of the run at index (size_idx, alpha_idx, run)
+        that are not written yet. The progress is updated after the steps,
+        so a reader never sees a counted episode that is not written.'''
+
+        start = self.progress[index]
+        self.steps[index][start:len(scores)] = scores[start:]
+        self.progress[index] = len(scores)
+
+    def done(self):
+        '''Boolean (sizes, alphas, runs) array of the finished runs.'''
+
+        return self.progress >= self.shape[3]
+
+    def close(self):
+        '''Detaches from the block, and removes it in the process that
+        created it.'''
+
+        # the arrays must not outlive the buffer
+        del self.progress, self.steps
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# #############################################################################
+#
+# Monitor
+#
+# #############################################################################
+
+
+def publish(folder, shared, agent):
+    '''Lets the monitor find the block of the agent being trained.'''
+
+    atomic_write(os.path.join(folder, 'shared.json'), lambda f: f.write(
+        json.dumps({'name': shared.name, 'agent': agent}).encode()))
+
+
+def published(folder):
+    try:
+        with open(os.path.join(folder, 'shared.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def print_progress(agent, shared, config):
+    progress = shared.progress
+    print('{}\t{}/{} runs done\t{:.1f}% of the episodes'.format(
+        agent, np.sum(shared.done()), progress.size,
+        100 * progress.sum() / (progress.size * shared.shape[3])))
+    for size_idx, hidden_size in enumerate(config['hidden_size']):
+        for alpha_idx, alpha in enumerate(config['alphas']):
+            print('  Hidden size: {}\tLearning rate: {}\tEpisodes: {}'.format(
+                hidden_size, alpha, progress[size_idx, alpha_idx].tolist()))
+
+
+def plot_progress(fig, agent, shared, config):
+    '''Learning curves of the episodes written so far.'''
+
+    from HW03Q02 import plot_line_variance
+
+    fig.clear()
+    axs = fig.subplots(nrows=len(config['hidden_size']),
+                       ncols=len(config['alphas']), squeeze=False,
+                       sharey=True)
+    fig.suptitle('{} (partial)'.format(agent))
+    x_values = np.arange(1, shared.shape[3] + 1)
+    for size_idx, hidden_size in enumerate(config['hidden_size']):
+        for alpha_idx, alpha in enumerate(config['alphas']):
+            ax = axs[size_idx, alpha_idx]
+            data = np.array(shared.steps[size_idx, alpha_idx], dtype=float)
+            if data.any():
+                plot_line_variance(ax, x_values, data, agent, 'C0')
+            ax.set_title('Hidden layer size: {}\nLearning rate: {}'.format(
+                hidden_size, alpha))
+
+
+def monitor(folder, plot=False, interval=INTERVAL):
+    '''Follows the sweep saved in folder until it is interrupted.'''
+
+    with open(os.path.join(folder, 'config.json')) as f:
+        config = json.load(f)
+    if plot:
+        import matplotlib.pyplot as plt
+        fig = plt.figure(figsize=(10, 10))
+
+    shared, current = None, None
+    while True:
+        info = published(folder)
+        if info is not None and info != current:
+            if shared is not None:
+                shared.close()
+            try:
+                shared = SharedResults(name=info['name'], track=False)
+            except FileNotFoundError:
+                # the sweep is finished or between two agents
+                shared = None
+            current = info
+
+        if shared is not None:
+            print_progress(current['agent'], shared, config)
+            if plot:
+                plot_progress(fig, current['agent'], shared, config)
+        if plot:
+            plt.pause(interval)
+        else:
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Follows the progress of a running HW03Q02 sweep.')
+    parser.add_argument('folder', type=str, help='Folder of the sweep.')
+    parser.add_argument('--plot', action='store_true',
+                        help='Plots the learning curves written so far.')
+    parser.add_argument('--interval', type=float, default=INTERVAL,
+                        help='Seconds between two updates. Default: '
+                        + str(INTERVAL))
+    options = parser.parse_args()
+    try:
+        monitor(options.folder, options.plot, options.interval)
+    except KeyboardInterrupt:
+        sys.exit()
@@ -0,0 +1,142 @@
+'''Startup time of the entry points.
+
+Every case runs in a fresh interpreter, --repeats times, and the median and
+minimum wall times are reported with the heavy modules (torch, gym,
+matplotlib, tensorflow) that the case imported. The results can be saved
+as JSON to follow the startup time over time:
+
+    python startup_benchmark.py --repeats 10 --output data/startup.json'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from results_store import STORE_SUFFIX, ResultsStore
+
+REPEATS = 5
+HEAVY_MODULES = ['torch', 'gym', 'matplotlib', 'tensorflow']
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# runs the code of a case and writes the heavy modules it imported
+WRAPPER = '''
+import sys, json, atexit
+atexit.register(lambda: open({modules_path!r}, 'w').write(json.dumps(
+    [m for m in {heavy!r} if m in sys.modules])))
+{code}
+'''
+
+
+# #############################################################################
+#
+# Parser
+#
+# #############################################################################
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description='Measures the startup time of the entry points.')
+    parser.add_argument('-n', '--repeats', type=int, default=REPEATS,
+                        help='Number of runs of every case. Default: '
+                        + str(REPEATS))
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='JSON file where the results are saved.')
+
+    return parser.parse_args()
+
+
+# #############################################################################
+#
+# Cases
+#
+# #############################################################################
+
+
+def script(path, *argv):
+    '''Code running a script as python path argv would.'''
+
+    return ('import runpy\nsys.argv = {!r}\n'
+            'try:\n    runpy.run_path(sys.argv[0], run_name="__main__")\n'
+            'except SystemExit:\n    pass').format([path] + list(argv))
+
+
+def make_results(folder):
+    '''Small saved sweep for the --load case.'''
+
+    store = ResultsStore.create(
+        os.path.join(folder, 'startup' + STORE_SUFFIX), ['rf', 'ac'], [32],
+        [0.01], 2, 200, {'env': 'CartPole-v0', 'solved_score': 195.0,
+                         'solved_window': 100})
+    rng = np.random.default_rng(0)
+    for agent in ['rf', 'ac']:
+        store.write_agent(agent, rng.integers(10, 200, size=(1, 1, 2, 200)))
+
+    return store.folder
+
+
+def cases(results):
+    return [
+        ('python', 'pass'),
+        ('import HW03Q02', 'import HW03Q02'),
+        ('HW03Q02 --help', script('HW03Q02.py', '--help')),
+        ('HW03Q02 --load', script('HW03Q02.py', '--load', results)),
+        ('HW03Q01 --no_plot', script('HW03Q01.py', '--no_plot', '-s', '10')),
+    ]
+
+
+def measure(code, repeats, modules_path):
+    '''Wall times of repeats fresh interpreters running code.'''
+
+    wrapped = WRAPPER.format(modules_path=modules_path, heavy=HEAVY_MODULES,
+                             code=code)
+    env = dict(os.environ, MPLBACKEND='Agg')
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', wrapped], cwd=FOLDER, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=True)
+        times.append(time.perf_counter() - start)
+
+    with open(modules_path) as f:
+        modules = json.load(f)
+
+    return times, modules
+
+
+# #############################################################################
+#
+# Main
+#
+# #############################################################################
+
+
+def main():
+    args = get_arguments()
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        modules_path = os.path.join(folder, 'modules.json')
+        print('{:<20}{:>12}{:>12}  {}'.format(
+            'Case', 'Median (s)', 'Min (s)', 'Heavy modules'))
+        for name, code in cases(make_results(folder)):
+            times, modules = measure(code, args.repeats, modules_path)
+            results.append({'case': name, 'times': times, 'modules': modules})
+            print('{:<20}{:>12.3f}{:>12.3f}  {}'.format(
+                name, np.median(times), np.min(times),
+                ', '.join(modules) or '-'))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version, 'repeats': args.repeats,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
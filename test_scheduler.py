@@ -0,0 +1,41 @@
+from scheduler import SuccessiveHalving
+
+
+def finish(scheduler):
+    '''Runs every job of scheduler, scoring a configuration by itself.'''
+
+    job = scheduler.next_job()
+    while job is not None:
+        config, rung = job
+        scheduler.report(config, rung, config)
+        job = scheduler.next_job()
+
+
+def test_default_grid_has_one_config_at_max_budget():
+    # 3 hidden sizes x 3 learning rates, --min_episodes 100, --episodes 2000
+    configs = list(range(9))
+    scheduler = SuccessiveHalving(configs, 100, 2000, 3, synchronous=True)
+    finish(scheduler)
+
+    assert scheduler.budgets == [100, 300, 2000]
+    played = [scheduler.budgets[scheduler.last_rung(config)]
+              for config in configs]
+    assert played.count(2000) == 1
+    assert played.count(300) == 2
+    assert played[8] == 2000
+
+
+def test_single_config_gets_max_budget():
+    scheduler = SuccessiveHalving(['a'], 100, 2000, 3)
+    finish(scheduler)
+
+    assert scheduler.budgets == [2000]
+    assert scheduler.last_rung('a') == 0
+
+
+def test_asynchronous_default_grid_reaches_max_budget():
+    configs = list(range(9))
+    scheduler = SuccessiveHalving(configs, 100, 2000, 3)
+    finish(scheduler)
+
+    assert max(scheduler.last_rung(config) for config in configs) == 2
@@ -0,0 +1,189 @@
+'''Number of threads of the math libraries, per process.
+
+torch and TensorFlow start a pool of one thread per core for the operators
+(intra-op) and another for running independent operators (inter-op), and
+so does the BLAS library of numpy. The networks of these experiments are
+far too small to be split between threads: a 4 -> 32 -> 2 forward pass
+takes microseconds, less than waking up a thread. When several runs share
+a host (see --workers), every process starts its own pools and the
+threads of the workers compete for the cores.
+
+The threads of a process are set from its share of the cores, its budget:
+
+    auto  the budget, i.e. the cores divided by the number of workers
+    tune  the fastest of 1, 2, 4, ... threads up to the budget, timed on a
+          training step of the script (see autotune)
+    N     N threads
+
+The inter-op pools are always set to one thread, since the training loops
+run one operator at a time. TensorFlow fixes its pools when its runtime
+starts, so they are set before the first operation and cannot be tuned.
+
+threadpoolctl, when installed, limits the BLAS threads of numpy in the
+running process. The BLAS variables of the environment are set as well,
+for the processes started afterwards.
+
+    threads = configure_threads(args.threads, args.workers, tuning_step)'''
+
+import os
+import time
+import warnings
+
+import numpy as np
+
+THREAD_MODES = ['auto', 'tune']
+THREADS = 'auto'
+TUNING_REPEATS = 5
+# length of the episodes of the tuning steps of the scripts
+TUNING_STEPS = 50
+BLAS_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                  'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def thread_count(value):
+    '''argparse type of --threads: one of THREAD_MODES or a number.'''
+
+    if value in THREAD_MODES:
+        return value
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError(value)
+
+    return int(value)
+
+
+def cpu_count():
+    '''Number of cores the process may run on.'''
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def thread_budget(workers=1):
+    '''Cores of one of workers processes sharing the host.'''
+
+    return max(1, cpu_count() // max(1, workers))
+
+
+def candidates(budget):
+    '''Numbers of threads tried by autotune: 1, 2, 4, ... and budget.'''
+
+    counts = [1]
+    while counts[-1] * 2 < budget:
+        counts.append(counts[-1] * 2)
+    if budget > 1:
+        counts.append(budget)
+
+    return counts
+
+
+# #############################################################################
+#
+# Setting
+#
+# #############################################################################
+
+
+def set_threads(intra, inter=1, framework='torch'):
+    '''Sets the intra-op and inter-op threads of framework and the BLAS
+    threads of the process. With framework 'numpy', only the BLAS threads
+    are set.'''
+
+    for variable in BLAS_VARIABLES:
+        os.environ[variable] = str(intra)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(intra)
+    except ImportError:
+        pass
+
+    if framework == 'torch':
+        import torch
+
+        torch.set_num_threads(intra)
+        try:
+            torch.set_num_interop_threads(inter)
+        except RuntimeError:
+            # only possible once, before the first parallel operation
+            pass
+    elif framework == 'tensorflow':
+        import tensorflow as tf
+
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+        except RuntimeError as error:
+            warnings.warn('TensorFlow threads not set: {}'.format(error))
+
+
+# #############################################################################
+#
+# Tuning
+#
+# #############################################################################
+
+
+def autotune(step, counts, repeats=TUNING_REPEATS, framework='torch'):
+    '''Times step() with every number of threads of counts.
+
+    Input:
+    step    : function running a short, representative piece of training,
+              e.g. an episode and its update
+    counts  : numbers of threads to try
+    repeats : timed calls of step per number of threads, after one call
+              that is not timed
+
+    Output:
+    the number of threads of the fastest median step, and the median time
+    in seconds of a step for every number of threads'''
+
+    timings = {}
+    for count in counts:
+        set_threads(count, framework=framework)
+        step()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            step()
+            times.append(time.perf_counter() - start)
+        timings[count] = float(np.median(times))
+
+    return min(timings, key=timings.get), timings
+
+
+def configure_threads(threads=THREADS, workers=1, step=None,
+                      framework='torch', verbose=True):
+    '''Sets the threads of the process from --threads (see the module).
+
+    Input:
+    threads   : 'auto', 'tune' or a number of threads
+    workers   : number of processes sharing the host
+    step      : function timed by autotune, needed by 'tune'
+    framework : 'torch', 'tensorflow' or 'numpy'
+    verbose   : prints the threads chosen
+
+    Output:
+    the number of intra-op threads, to be set in the workers as well'''
+
+    budget = thread_budget(workers)
+    if threads == 'tune' and framework == 'tensorflow':
+        warnings.warn('TensorFlow threads cannot be changed once set, using '
+                      'the budget of {} threads.'.format(budget))
+        threads = 'auto'
+
+    if threads == 'tune':
+        count, timings = autotune(step, candidates(budget),
+                                  framework=framework)
+        if verbose:
+            print('Threads: ' + ', '.join(
+                '{} {:.2f} ms'.format(n, 1e3 * t) for n, t in timings.items()))
+    else:
+        count = budget if threads == 'auto' else threads
+
+    set_threads(count, framework=framework)
+    if verbose:
+        print('Threads per process: {} ({} cores, {} worker{})'.format(
+            count, cpu_count(), workers, 's' if workers > 1 else ''))
+
+    return count
@@ -0,0 +1,332 @@
+'''Linear policies on tile-coded features, a cheap baseline of the HW03Q02
+agents (see --backend tiles).
+
+A tiling cuts the state space in a grid of TILES tiles per dimension, and
+every tiling is shifted by a fraction of a tile, by a different amount in
+every dimension. A state is encoded by the tile it falls in in each of the
+tilings, and the coordinates of the tiles are hashed in a table of MEMORY
+weights per output:
+
+    tile   = floor(TILES * (state - low) / (high - low) + offset[tiling])
+    index  = hash(tiling, tile) % MEMORY
+
+so a state activates exactly one weight per tiling, and the action
+preferences and the value are sums of tilings weights:
+
+    probs  = softmax(actor[indices].sum(0))
+    value  = critic[indices].sum()
+
+The indices are computed for a whole batch of states at once (see
+TileCoder.indices), and the updates only touch the weights of the active
+tiles, with step size alpha / tilings. A step costs a few hundred
+operations instead of the forward and backward passes of an MLP.
+
+rf updates at the end of the episode on the normalised returns, as
+Policy. ac is the one-step actor-critic, updated online at every step by
+observe on the TD error of the critic, with eligibility traces of decay
+trace_decay (lambda) for both the actor and the critic. The traces are
+kept sparse: a step only updates the tiles of the steps whose trace
+(gamma * lambda)^age is above TRACE_CUTOFF.
+
+This module only imports numpy.'''
+
+import numpy as np
+
+from profiler import NULL_PROFILER
+from numpy_policy import discount_rewards, eps
+
+TILES = 8
+MEMORY = 2**14
+TRACE_DECAY = 0.8
+TRACE_CUTOFF = 0.01
+# bound of the dimensions that the observation space leaves unbounded
+STATE_BOUND = 3.
+# odd displacements of the tilings (Sutton and Barto, section 9.5.4)
+# and multipliers of the hash of the tile coordinates
+PRIMES = np.array([1, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37])
+HASH = np.array([73856093, 19349663, 83492791, 49979687, 86028121,
+                 15485863, 32452843, 67867967, 49979693, 22801763,
+                 38745179, 12582917, 92821])
+
+
+# #############################################################################
+#
+# Features
+#
+# #############################################################################
+
+
+class TileCoder():
+    '''Hashed tile coding of states.
+
+    Input:
+    low, high : bounds of the states, clipped to +-STATE_BOUND, e.g. the
+                unbounded velocities of CartPole
+    tilings   : number of tilings
+    tiles     : tiles per dimension of a tiling
+    memory    : size of the hash table'''
+
+    def __init__(self, low, high, tilings, tiles=TILES, memory=MEMORY):
+        assert len(low) < len(PRIMES)
+        low = np.maximum(low, -STATE_BOUND)
+        high = np.minimum(high, STATE_BOUND)
+
+        self.low = low.astype(np.float64)
+        self.scale = tiles / (high - low)
+        self.tilings = tilings
+        self.memory = memory
+        # (tilings, dims), in fractions of a tile
+        self.offsets = (np.arange(tilings)[:, None] * PRIMES[:len(low)]
+                        / tilings) % 1
+        self.tiling_hash = np.arange(tilings) * HASH[-1]
+        self.hash = HASH[:len(low)]
+
+    def indices(self, states):
+        '''Indices of the active weights of states of shape (dims,) or
+        (batch, dims), of shape (tilings,) or (batch, tilings).'''
+
+        scaled = (np.asarray(states) - self.low) * self.scale
+        # (..., tilings, dims)
+        coords = np.floor(scaled[..., None, :] + self.offsets).astype(np.int64)
+
+        return (coords @ self.hash + self.tiling_hash) % self.memory
+
+
+class SparseSGD():
+    '''Stochastic gradient steps on the rows of weight tables.
+
+    Input:
+    lr : step size of the sum of the active weights, divided between the
+         tilings'''
+
+    def __init__(self, lr, tilings):
+        self.lr = lr / tilings
+
+    def step(self, weights, indices, grads):
+        '''Adds lr * grads[i] to weights[indices[i]], adding the updates of
+        the repeated indices. weights, indices and grads are flat, as
+        np.add.at is several times slower on the rows of a table.'''
+
+        np.add.at(weights, indices, self.lr * grads)
+
+    def state_dict(self):
+        return {'lr': self.lr}
+
+    def load_state_dict(self, state):
+        self.lr = state['lr']
+
+
+# #############################################################################
+#
+# Model
+#
+# #############################################################################
+
+
+class TileCodingPolicy():
+    '''Same interface as Policy (policy.py), for one_run, with observe
+    called after every step.
+
+    Input:
+    low, high   : bounds of the states (see TileCoder)
+    tilings     : number of tilings
+    trace_decay : lambda of the eligibility traces of ac, 0 for one-step
+                  updates
+    seed        : (optional) seed of the sampling of the actions'''
+
+    def __init__(self, agent, low, high, output_dim, tilings, alpha, gamma,
+                 trace_decay=TRACE_DECAY, seed=None, tiles=TILES,
+                 memory=MEMORY):
+        self.coder = TileCoder(low, high, tilings, tiles, memory)
+        self.actor = np.zeros((memory, output_dim))
+        self.critic = np.zeros(memory)
+        # flat view of actor, and offsets of the actions in it
+        self.actor_flat = self.actor.reshape(-1)
+        self.action_offsets = np.arange(output_dim)
+        self.optimizer = SparseSGD(alpha, tilings)
+        self.gamma = gamma
+        self.agent = agent
+        self.rng = np.random.default_rng(seed)
+
+        # number of past steps whose trace is above TRACE_CUTOFF
+        decay = gamma * trace_decay
+        steps = 1
+        if decay > 0:
+            steps += int(np.log(TRACE_CUTOFF) / np.log(decay))
+        # ring buffers of the active weights of the critic and of the actor
+        # and of the gradient of the log-probability of the last steps
+        self.trace_indices = np.zeros((steps, tilings), dtype=np.int64)
+        self.trace_rows = np.zeros((steps, tilings, output_dim),
+                                   dtype=np.int64)
+        self.trace_grads = np.zeros((steps, output_dim))
+        self.trace_steps = 0
+        # trace of every row when the last step is in row i, in row i
+        ages = (np.arange(steps)[:, None] - np.arange(steps)) % steps
+        self.trace_table = decay ** ages
+
+        # one entry per step: [log_prob, value, probs], as in Policy
+        self.actions = []
+        self.rewards = []
+        self.indices = []
+        self.choices = []
+        self.losses = []
+
+        self.profiler = NULL_PROFILER
+
+        if agent == 'ac':
+            self.backprop = self.backprop_ac
+        else:
+            self.backprop = self.backprop_rf
+            # rf only learns at the end of the episode
+            self.observe = None
+
+    def forward(self, indices):
+        '''Action probabilities and values of the active weights indices
+        of one or several states.'''
+
+        logits = self.actor[indices].sum(-2)
+        logits -= logits.max(axis=-1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=-1, keepdims=True)
+
+        return probs, self.critic[indices].sum(-1)
+
+    def choose_action(self, state):
+        t = self.profiler.now()
+        indices = self.coder.indices(state)
+        probs, value = self.forward(indices)
+        t = self.profiler.lap('forward', t)
+
+        # inverse transform sampling
+        action = min(int((probs.cumsum() < self.rng.random()).sum()),
+                     len(probs) - 1)
+
+        self.actions.append([np.log(probs[action]), value, probs])
+        self.indices.append(indices)
+        self.choices.append(action)
+        self.profiler.lap('sample', t)
+
+        return action
+
+    def bootstrap(self, state):
+        '''Value of state estimated by the critic.'''
+
+        return self.critic[self.coder.indices(state)].sum().item()
+
+    def observe(self, reward, state, done):
+        '''Online update of ac on the step that led to state with reward.'''
+
+        _, value, probs = self.actions[-1]
+        next_value = 0. if done else self.bootstrap(state)
+        delta = reward + self.gamma * next_value - value
+
+        self.losses.append(-delta * self.actions[-1][0] + 0.5 * delta ** 2)
+
+        length = len(self.trace_table)
+        row = self.trace_steps % length
+        indices = self.indices[-1]
+        self.trace_indices[row] = indices
+        self.trace_rows[row] = indices[:, None] * len(self.action_offsets)
+        self.trace_rows[row] += self.action_offsets
+        np.negative(probs, out=self.trace_grads[row])
+        self.trace_grads[row, self.choices[-1]] += 1
+        self.trace_steps += 1
+
+        # the weights of the last steps, updated in proportion to their
+        # trace
+        n = min(self.trace_steps, length)
+        traces = delta * self.trace_table[row, :n]
+        self.optimizer.step(self.critic, self.trace_indices[:n].ravel(),
+                            np.repeat(traces, self.coder.tilings))
+        grads = traces[:, None] * self.trace_grads[:n]
+        self.optimizer.step(self.actor_flat, self.trace_rows[:n].ravel(),
+                            np.repeat(grads, self.coder.tilings, axis=0)
+                            .ravel())
+
+    def evaluate(self, envs, greedy=True, generator=None):
+        '''Same as Policy.evaluate, generator being a numpy Generator.'''
+
+        states = np.array([env.reset() for env in envs])
+        steps = np.zeros(len(envs), dtype=int)
+        active = np.ones(len(envs), dtype=bool)
+
+        while active.any():
+            playing = np.flatnonzero(active)
+            probs, _ = self.forward(self.coder.indices(states[playing]))
+            if greedy:
+                actions = probs.argmax(-1)
+            else:
+                uniforms = generator.random((len(playing), 1))
+                actions = np.minimum((probs.cumsum(-1) < uniforms).sum(-1),
+                                     probs.shape[1] - 1)
+
+            for run, action in zip(playing, actions.tolist()):
+                states[run], _, done, _ = envs[run].step(action)
+                steps[run] += 1
+                if done:
+                    active[run] = False
+
+        return steps
+
+    def forget(self):
+        '''Empties the buffers of the episode without learning from it.'''
+
+        del self.rewards[:]
+        del self.actions[:]
+        del self.indices[:]
+        del self.choices[:]
+        del self.losses[:]
+        self.trace_steps = 0
+
+    def entropy(self):
+        '''Average entropy of the policy over the current episode.'''
+
+        probs = np.array([p for _, _, p in self.actions])
+
+        return float(-(probs * np.log(probs + eps)).sum(-1).mean())
+
+    def backprop_rf(self):
+        '''Gradient step of REINFORCE on the episode, on the normalised
+        returns as Policy.backprop_rf. The critic is not trained.'''
+
+        returns = discount_rewards(self.rewards, self.gamma)
+        returns = (returns - returns.mean()) / (returns.std(ddof=1) + eps)
+        probs = np.array([p for _, _, p in self.actions])
+        steps = np.arange(len(self.choices))
+
+        grads = -probs
+        grads[steps, self.choices] += 1
+        grads *= returns[:, None]
+        rows = (np.array(self.indices)[..., None] * grads.shape[1]
+                + self.action_offsets)
+        self.optimizer.step(self.actor_flat, rows.ravel(),
+                            np.repeat(grads, self.coder.tilings, axis=0)
+                            .ravel())
+
+        loss = -(np.log(probs[steps, self.choices]) * returns).sum()
+        entropy = self.entropy()
+        self.forget()
+
+        return float(loss), entropy
+
+    def backprop_ac(self):
+        '''End of an episode of ac, already learnt by observe.
+
+        Output:
+        the sum of the losses -delta * log_prob + delta^2 / 2 of the steps,
+        and the average entropy'''
+
+        loss = sum(self.losses)
+        entropy = self.entropy()
+        self.forget()
+
+        return float(loss), entropy
+
+    def state_dict(self):
+        return {'actor': self.actor.copy(), 'critic': self.critic.copy(),
+                'rng': self.rng.bit_generator.state}
+
+    def load_state_dict(self, state):
+        self.actor[:] = state['actor']
+        self.critic[:] = state['critic']
+        self.rng.bit_generator.state = state['rng']
@@ -0,0 +1,252 @@
+'''Append-only recording of trajectories, read back as memory-mapped arrays.
+
+A dataset is a folder with one raw file per field, and a JSON header:
+
+    <folder>/meta.json          fields, number of steps and of episodes
+    <folder>/obs.bin            (steps, obs_dim) float32, state before the step
+    <folder>/action.bin         (steps,) int32
+    <folder>/reward.bin         (steps,) float32
+    <folder>/done.bin           (steps,) bool
+    <folder>/log_prob.bin       (steps,) float32, log-probability of action
+    <folder>/episodes.bin       (episodes,) int64, first step of every episode
+
+The training loops give every step to TrajectoryRecorder.record, which
+writes it in a preallocated chunk; full chunks are appended to the files,
+and the header is updated up to the last finished episode, so a crashed
+run leaves a readable dataset. TrajectoryDataset maps
+the files without reading them: sequential minibatches are views of the
+maps, random minibatches only copy the selected rows.
+
+    dataset = TrajectoryDataset('data/<sweep>/trajectories/rf_h32_a0.01_r0')
+    for batch in dataset.batches(256, shuffle=True):
+        batch['obs'], batch['next_obs'], batch['reward'], batch['done']'''
+
+import os
+import json
+
+import numpy as np
+
+from checkpoint import atomic_write
+
+FORMAT_VERSION = 1
+CHUNK = 4096
+BATCH_SIZE = 256
+
+
+def fields(obs_dim):
+    '''dtype and shape of a step of every field.'''
+
+    return {
+        'obs': ('float32', [obs_dim]),
+        'action': ('int32', []),
+        'reward': ('float32', []),
+        'done': ('bool', []),
+        'log_prob': ('float32', []),
+    }
+
+
+# #############################################################################
+#
+# Recorder
+#
+# #############################################################################
+
+
+class TrajectoryRecorder():
+    '''Input:
+    folder   : folder of the dataset, created if needed. An existing
+               dataset is continued, e.g. when a run is resumed
+    obs_dim  : size of an observation
+    config   : (optional) dictionary saved in the header
+    episodes : (optional) number of episodes kept from an existing dataset,
+               e.g. those of the checkpoint a run is resumed from
+    chunk    : number of steps kept in memory before they are appended'''
+
+    def __init__(self, folder, obs_dim, config=None, episodes=None,
+                 chunk=CHUNK):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.fields = fields(obs_dim)
+        self.meta = {'version': FORMAT_VERSION, 'obs_dim': obs_dim,
+                     'fields': self.fields, 'steps': 0, 'episodes': 0,
+                     'config': config or {}}
+        meta_path = os.path.join(folder, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta.update(json.load(f), config=self.meta['config'])
+            if episodes is not None and episodes < self.meta['episodes']:
+                starts = np.fromfile(self.path('episodes'), dtype=np.int64,
+                                     count=episodes + 1)
+                self.meta['steps'] = int(starts[episodes])
+                self.meta['episodes'] = episodes
+            self._truncate()
+
+        self.files = {name: open(self.path(name), 'ab') for name in self.fields}
+        self.episode_file = open(self.path('episodes'), 'ab')
+        self.chunk = {name: np.zeros([chunk] + shape, dtype=dtype)
+                      for name, (dtype, shape) in self.fields.items()}
+        self.n = 0
+        self.steps = self.meta['steps']
+        self.episode_start = self.steps
+        self.episodes = self.meta['episodes']
+
+    def path(self, name):
+        return os.path.join(self.folder, name + '.bin')
+
+    def _truncate(self):
+        '''Drops what was written after the last complete flush, e.g. the
+        steps of an episode interrupted by a crash.'''
+
+        for name, (dtype, shape) in self.fields.items():
+            size = self.meta['steps'] * np.dtype(dtype).itemsize * int(
+                np.prod(shape))
+            with open(self.path(name), 'ab') as f:
+                f.truncate(size)
+        with open(self.path('episodes'), 'ab') as f:
+            f.truncate(8 * self.meta['episodes'])
+
+    def record(self, obs, action, reward, done, log_prob=np.nan):
+        '''Adds one step.'''
+
+        n = self.n
+        self.chunk['obs'][n] = obs
+        self.chunk['action'][n] = action
+        self.chunk['reward'][n] = reward
+        self.chunk['done'][n] = done
+        self.chunk['log_prob'][n] = log_prob
+        self.n = n + 1
+        self.steps += 1
+
+        if self.n == len(self.chunk['obs']):
+            self.flush()
+
+    def end_episode(self):
+        '''Marks the end of the current episode.'''
+
+        if self.steps == self.episode_start:
+            return
+
+        self.episode_file.write(
+            np.array([self.episode_start], dtype=np.int64).tobytes())
+        self.episode_start = self.steps
+        self.episodes += 1
+
+    def _append(self):
+        for name, data in self.chunk.items():
+            self.files[name].write(data[:self.n].tobytes())
+        self.n = 0
+
+    def flush(self):
+        '''Appends the steps in memory and updates the header, up to the
+        last finished episode.'''
+
+        self._append()
+        for f in list(self.files.values()) + [self.episode_file]:
+            f.flush()
+
+        self.meta['steps'] = self.episode_start
+        self.meta['episodes'] = self.episodes
+        atomic_write(os.path.join(self.folder, 'meta.json'), lambda f: f.write(
+            json.dumps(self.meta, indent=2, default=str).encode()))
+
+    def close(self):
+        '''Ends the current episode and closes the files.'''
+
+        self.end_episode()
+        self.flush()
+        for f in list(self.files.values()) + [self.episode_file]:
+            f.close()
+
+
+# #############################################################################
+#
+# Dataset
+#
+# #############################################################################
+
+
+class TrajectoryDataset():
+    '''Memory-mapped dataset written by TrajectoryRecorder.
+
+    Input:
+    folder : folder of the dataset'''
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.steps = self.meta['steps']
+        self.n_episodes = self.meta['episodes']
+
+        self.arrays = {}
+        for name, (dtype, shape) in self.meta['fields'].items():
+            self.arrays[name] = self.map(name, dtype, [self.steps] + shape)
+        starts = self.map('episodes', 'int64', [self.n_episodes])
+        self.episodes = np.append(starts, self.steps)
+
+        # the last step of every episode has no next observation
+        self.last = np.zeros(self.steps, dtype=bool)
+        self.last[self.episodes[1:] - 1] = True
+
+    def map(self, name, dtype, shape):
+        if 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+
+        return np.memmap(os.path.join(self.folder, name + '.bin'),
+                         dtype=dtype, mode='r', shape=tuple(shape))
+
+    def __len__(self):
+        return self.steps
+
+    def __getitem__(self, key):
+        '''Steps selected by key (a slice gives views of the maps), with
+        the observation following each step, in next_obs.'''
+
+        batch = {name: array[key] for name, array in self.arrays.items()}
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.steps)
+            next_key = slice(start + 1, min(stop + 1, self.steps), step)
+            next_obs = self.arrays['obs'][next_key]
+            if len(next_obs) < len(batch['obs']):
+                # the last step of the dataset ends its episode
+                next_obs = np.concatenate([next_obs, batch['obs'][-1:]])
+        else:
+            next_obs = self.arrays['obs'][np.minimum(np.asarray(key) + 1,
+                                                     self.steps - 1)]
+        batch['next_obs'] = next_obs
+        # the next observation of the last step is not used
+        batch['last'] = self.last[key]
+
+        return batch
+
+    def batches(self, batch_size=BATCH_SIZE, shuffle=False, seed=None):
+        '''Minibatches over the whole dataset, in order or shuffled.'''
+
+        if not shuffle:
+            for start in range(0, self.steps, batch_size):
+                yield self[start:start + batch_size]
+            return
+
+        order = np.random.default_rng(seed).permutation(self.steps)
+        for start in range(0, self.steps, batch_size):
+            yield self[np.sort(order[start:start + batch_size])]
+
+    def episode(self, idx):
+        '''Steps of episode idx.'''
+
+        return self[self.episodes[idx]:self.episodes[idx + 1]]
+
+    def lengths(self):
+        return np.diff(self.episodes)
+
+    def returns(self, gamma):
+        '''Discounted return from every step to the end of its episode.'''
+
+        rewards = np.asarray(self.arrays['reward'], dtype=np.float64)
+        returns = np.zeros(self.steps)
+        R = 0.
+        for t in reversed(range(self.steps)):
+            R = rewards[t] + gamma * R * (not self.last[t])
+            returns[t] = R
+
+        return returns